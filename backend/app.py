@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
+from flask import Flask, render_template, request, jsonify, session, send_from_directory, abort
 from flask_cors import CORS
 import os
 import logging
@@ -9,10 +9,18 @@ from routes.expert_analysis import expert_analysis_bp
 from routes.fact_checking import fact_checking_bp
 from routes.chat_history import chat_history_bp
 from routes.tts import tts_bp
+from services.ai_service import ai_service
+from services.browser_pool import browser_pool
+from config import UPLOAD_CONFIG
+from utils.upload_stream import StreamingUploadRequest
 
 app = Flask(__name__, static_folder='../frontend')
 app.secret_key = 'your-secret-key-here'  # 在生产环境中请使用更安全的密钥
 
+# 上传的文件边解析边落盘，超过大小上限的请求在读取请求体之前拒绝
+app.request_class = StreamingUploadRequest
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_CONFIG['max_request_bytes']
+
 # 启用CORS
 CORS(app)
 
@@ -29,6 +37,34 @@ app.register_blueprint(chat_history_bp, url_prefix='/api/chat-history')
 app.register_blueprint(tts_bp, url_prefix='/api/tts')
 
 
+@app.route('/api/system/stats', methods=['GET'])
+def system_stats():
+    """获取AI连接池和响应缓存的运行统计"""
+    return jsonify({
+        'success': True,
+        'ai_pool': ai_service.get_pool_stats(),
+        'llm_cache': ai_service.get_cache_stats()
+    })
+
+@app.route('/api/system/browser-health', methods=['GET'])
+def browser_health():
+    """检查常驻浏览器池是否可用"""
+    result = browser_pool.health_check()
+    return jsonify({'success': result.get('healthy', False), 'browser_pool': result})
+
+@app.before_request
+def parse_uploads():
+    """在进入路由之前解析上传表单，超过大小上限时由下面的413处理返回，不会被路由里的异常处理吞掉"""
+    if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        request.form
+    elif request.content_length and request.content_length > UPLOAD_CONFIG['max_request_bytes']:
+        abort(413)
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """上传内容超过大小上限"""
+    return jsonify({'success': False, 'message': f'上传内容过大：{e.description}'}), 413
+
 @app.route('/') 
 def index():
     return send_from_directory('../frontend', 'index.html')
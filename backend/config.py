@@ -11,6 +11,204 @@ AI_CONFIG = {
     'complex_model': 'GLM-4V-Flash'  # 复杂任务
 }
 
+# AI 接口HTTP连接池配置
+AI_HTTP_CONFIG = {
+    'pool_connections': int(os.getenv('AI_POOL_CONNECTIONS', 4)),  # 缓存的主机连接池数量
+    'pool_maxsize': int(os.getenv('AI_POOL_MAXSIZE', 32)),  # 每个主机的最大保持连接数
+    'pool_block': False,  # 连接池耗尽时是否阻塞等待
+    'keep_alive': True,  # 是否开启TCP keep-alive
+    'connect_timeout': float(os.getenv('AI_CONNECT_TIMEOUT', 10)),  # 连接超时（秒）
+    'read_timeout': float(os.getenv('AI_READ_TIMEOUT', 60)),  # 读取超时（秒）
+    'max_retries': 2  # 建立连接失败时的重试次数
+}
+
+# 大模型响应缓存配置（默认关闭，设置 LLM_CACHE_ENABLED=1 开启）
+LLM_CACHE_CONFIG = {
+    'enabled': os.getenv('LLM_CACHE_ENABLED', '0') == '1',
+    'ttl': int(os.getenv('LLM_CACHE_TTL', 7 * 24 * 3600)),  # 缓存有效期（秒）
+    'memory_max_entries': 256,  # 内存LRU最多保存的回复数
+    'disk_enabled': True,  # 是否启用磁盘缓存
+    'disk_dir': 'data/cache/llm',
+    'disk_max_bytes': 200 * 1024 * 1024,  # 磁盘缓存总大小上限
+    'max_item_chars': 200000,  # 超过该长度的回复不缓存
+    'replay_chunk_size': 32  # 命中缓存时按多少字符一块回放
+}
+
+# 网页抓取并发配置
+CRAWLER_CONFIG = {
+    'max_workers': int(os.getenv('CRAWLER_MAX_WORKERS', 8)),  # 全局最大并发抓取数
+    'per_domain_concurrency': 2,  # 同一域名的最大并发数
+    'per_domain_interval': 1.0,  # 同一域名两次请求之间的最小间隔（秒）
+    'url_deadline': 90  # 单个URL从提交起的最长等待时间（秒）
+}
+
+# 搜索服务配置
+SEARCH_CONFIG = {
+    'api_url': os.getenv('SEARCH_API_URL', 'http://chengyuxuan.top:3100/search'),
+    'max_workers': int(os.getenv('SEARCH_MAX_WORKERS', 8)),  # 同时进行的搜索请求数
+    'connect_timeout': 5,  # 建立连接超时（秒）
+    'read_timeout': 15,  # 单次搜索读取超时（秒）
+    'deadline': 20,  # 一批关键词搜索的总等待时间（秒）
+    'cache_ttl': 600,  # 搜索结果缓存时间（秒）
+    'cache_max_entries': 512  # 内存中最多缓存的查询数
+}
+
+# Playwright浏览器池配置
+BROWSER_POOL_CONFIG = {
+    'max_pages': int(os.getenv('BROWSER_MAX_PAGES', 4)),  # 同时打开的页面数上限
+    'recycle_after_pages': 100,  # 每个浏览器服务多少个页面后重启
+    'max_memory_mb': 1500,  # 浏览器相关进程内存超过该值时重启（需要psutil）
+    'memory_check_interval': 10,  # 检查浏览器内存的最短间隔（秒）
+    'warm_contexts': 2,  # 每种上下文配置保留的预热上下文数（全新未用过的上下文）
+    'task_timeout': 120,  # 单次抓取任务的最长等待时间（秒）
+    'chromium_args': [
+        '--no-sandbox',
+        '--disable-blink-features=AutomationControlled',
+        '--disable-dev-shm-usage',
+        '--disable-gpu',
+        '--disable-web-security',
+        '--disable-features=VizDisplayCompositor'
+    ]
+}
+
+# OCR配置
+OCR_CONFIG = {
+    'max_workers': int(os.getenv('OCR_MAX_WORKERS', min(4, os.cpu_count() or 1))),  # OCR进程池大小，0表示在当前线程串行识别
+    'image_timeout': 60,  # 单张图片的识别超时（秒）
+    'lang': 'chi_sim+eng',  # 支持中英文
+    'tesseract_config': '--oem 3 --psm 6',
+    'engine': os.getenv('OCR_ENGINE', 'auto'),  # auto: 安装了tesserocr时使用常驻引擎，否则用pytesseract；pytesseract: 强制每张图片调用tesseract命令
+    'cache_enabled': os.getenv('OCR_CACHE_ENABLED', '1') == '1',  # 按图片内容哈希缓存识别结果
+    'cache_dir': 'data/cache/ocr',
+    'cache_max_bytes': 50 * 1024 * 1024,  # OCR缓存总大小上限
+    # 自适应预处理
+    'target_dpi': 300,  # 带DPI信息的图片缩放到该分辨率
+    'min_side': 1200,  # 没有DPI信息时长边的下限（小图放大，最多2倍）
+    'max_side': 3000,  # 没有DPI信息时长边的上限（大图缩小）
+    'noise_low': 2.0,  # 噪声低于该值不去噪
+    'noise_high': 10.0  # 噪声高于该值才使用非局部均值去噪，介于两者之间用中值滤波
+}
+
+# PDF文本提取配置
+PDF_CONFIG = {
+    'backend': os.getenv('PDF_BACKEND', 'auto'),  # auto: 安装了pypdfium2时使用它（更快），否则用PyPDF2；也可指定 pypdfium2 / pypdf2
+    'max_workers': int(os.getenv('PDF_MAX_WORKERS', min(4, os.cpu_count() or 1))),  # 提取进程池大小，0表示在当前线程逐页提取
+    'pages_per_task': 16,  # 每个子进程任务提取的连续页数
+    'parallel_min_pages': 32,  # 少于该页数的文档不使用进程池
+    'max_pages': 500,  # 最多提取的页数
+    'max_chars': 500000  # 最多提取的字符数，超出后截断
+}
+
+# 上传配置：上传的文件在表单解析时直接按块写入磁盘，超出上限的请求尽早拒绝
+UPLOAD_CONFIG = {
+    'max_request_bytes': int(os.getenv('UPLOAD_MAX_REQUEST_MB', 100)) * 1024 * 1024,  # 单个请求的大小上限（MAX_CONTENT_LENGTH）
+    'max_file_bytes': int(os.getenv('UPLOAD_MAX_FILE_MB', 50)) * 1024 * 1024,  # 单个文件的大小上限
+    'chunk_size': 1024 * 1024,  # 复制上传文件时每块的大小
+    'incoming_dir': 'data/uploads/.incoming'  # 表单解析时的落盘目录（需与上传目录在同一文件系统）
+}
+
+# 上传文件的文本提取缓存（按文件内容哈希 + 提取器版本）
+EXTRACT_CACHE_CONFIG = {
+    'enabled': os.getenv('EXTRACT_CACHE_ENABLED', '1') == '1',
+    'dir': 'data/cache/extracted',
+    'max_bytes': 200 * 1024 * 1024  # 缓存总大小上限
+}
+
+# 上下文预算配置：按模型估算token数，长内容按标题/段落切块后放入各步骤的预算
+CONTEXT_CONFIG = {
+    'model_context_tokens': {  # 各模型的上下文长度（token）
+        'GLM-4-Flash': 128000,
+        'GLM-4V-Flash': 8192
+    },
+    'default_context_tokens': 8192,  # 未列出的模型
+    'reserve_output_tokens': 2048,  # 留给模型输出的token数
+    'prompt_overhead_tokens': 1024,  # 留给提示词模板本身的token数
+    'min_input_tokens': 1024,  # 内容预算的下限
+    'tokens_per_char': {'cjk': 0.8, 'other': 0.3},  # 每个中文字符/其他字符折算的token数
+    'model_tokens_per_char': {},  # 个别模型单独的折算比例
+    'head_ratio': 0.7,  # 内容放不下时保留开头部分所占的比例，其余保留结尾
+    'step_budgets': {  # 单独限制内容预算的步骤，避免提示词过长导致模型无响应
+        'summary': 2000
+    }
+}
+
+# 长文档分段摘要（map-reduce）配置
+MAP_REDUCE_CONFIG = {
+    'max_workers': int(os.getenv('MAP_REDUCE_WORKERS', 4)),  # 并发摘要的线程数
+    'model': os.getenv('MAP_REDUCE_MODEL'),  # 分段摘要使用的模型，为空时使用简单模型
+    'chunk_tokens': 3000,  # 每个分段的token数上限
+    'reduce_input_tokens': 6000,  # 每次合并的输入token数上限
+    'summary_chars': 400,  # 每份摘要的字数上限
+    'cache_dir': 'data/cache/chunk_summaries',
+    'cache_ttl': 30 * 24 * 3600,  # 分段摘要缓存有效期（秒）
+    'cache_max_bytes': 100 * 1024 * 1024  # 分段摘要缓存总大小上限
+}
+
+# 智能伴读会话配置：解析出的文档和对话保存在服务端，聊天请求只需携带新消息
+READING_SESSION_CONFIG = {
+    'max_sessions': int(os.getenv('READING_SESSION_MAX', 200)),  # 内存中保留的会话数上限
+    'max_memory_bytes': int(os.getenv('READING_SESSION_MEMORY_MB', 256)) * 1024 * 1024,  # 内存中会话内容的总大小上限
+    'ttl': int(os.getenv('READING_SESSION_TTL_HOURS', 24)) * 3600,  # 会话多久未访问后过期（秒）
+    'spill_enabled': os.getenv('READING_SESSION_SPILL', '1') == '1',  # 超出上限的会话是否写入磁盘而不是直接丢弃
+    'spill_dir': 'data/sessions/reading'
+}
+
+# 智能伴读文档检索配置：长文档切段建立BM25索引，每次提问只放入最相关的段落
+RETRIEVAL_CONFIG = {
+    'passage_tokens': 300,  # 每个段落的token数上限
+    'top_k': int(os.getenv('RETRIEVAL_TOP_K', 6)),  # 每次提问最多取多少个段落
+    'context_tokens': 3000,  # 放入提示词的段落总token数上限
+    'full_context_tokens': 3000,  # 不超过该长度的文档整篇放入，不建索引
+    'k1': 1.5,  # BM25词频饱和参数
+    'b': 0.75  # BM25文档长度归一化参数
+}
+
+# 对话历史压缩配置：最近几轮原样保留，更早的对话折叠成滚动摘要
+HISTORY_CONFIG = {
+    'model': os.getenv('HISTORY_SUMMARY_MODEL'),  # 生成摘要使用的模型，为空时使用简单模型
+    'summary_chars': 600,  # 摘要的字数上限
+    'max_workers': 2,  # 后台生成摘要的线程数
+    'cache_dir': 'data/cache/history_summaries',
+    'cache_ttl': 7 * 24 * 3600,  # 摘要缓存有效期（秒）
+    'cache_max_bytes': 50 * 1024 * 1024,  # 摘要缓存总大小上限
+    'default': {
+        'keep_turns': int(os.getenv('HISTORY_KEEP_TURNS', 6)),  # 原样保留最近几轮对话（一问一答为一轮）
+        'fold_turns': 4,  # 更早的对话每累计几轮折叠进摘要一次
+        'max_tokens': 6000,  # 摘要和保留的历史合计的token数上限
+        'max_message_tokens': 1500,  # 单条历史消息的token数上限，超出时保留首尾
+        'summarize': True  # 为False时不生成摘要，超出预算的旧对话直接舍弃
+    },
+    'features': {  # 各功能单独的设置，未列出的项使用default
+        'intelligent_reading': {},
+        'expert_analysis': {'keep_turns': 8},  # 角色扮演多保留原话，便于保持语气
+        'fact_checking': {'max_message_tokens': 3000},  # 第一条回复是完整的鉴定报告
+        'comprehensive_analysis': {'max_message_tokens': 3000}  # 第一条回复是完整的分析报告
+    }
+}
+
+# 流式响应（SSE）配置
+SSE_CONFIG = {
+    'flush_chars': 48,  # 合并的增量文本达到该长度时立即发送
+    'flush_interval': 0.05,  # 增量文本最多缓冲多久（秒）
+    'heartbeat_interval': 15  # 无数据时发送心跳的间隔（秒），0表示关闭
+}
+
+# 聊天记录存储配置
+CHAT_STORE_CONFIG = {
+    'compact_after': 50  # 累计多少次标题等元数据修改后压缩日志文件
+}
+
+# 聊天记录全文检索配置（BM25倒排索引）
+CHAT_SEARCH_CONFIG = {
+    'compact_after': 500,  # 索引日志累计多少行增量后压缩为快照
+    'title_weight': 2,  # 标题中的词按几倍词频计入
+    'k1': 1.2,  # BM25词频饱和参数
+    'b': 0.75,  # BM25文档长度归一化参数
+    'snippet_chars': 80,  # 搜索结果中匹配片段的长度
+    'snippet_source_chars': 500,  # 索引中为每条消息保存的开头文字（用于生成片段，匹配词都不在其中时才读取对话文件）
+    'max_page_size': 50  # 每页结果数上限
+}
+
 # 为了兼容启动脚本
 GLM_API_KEY = AI_CONFIG['api_key']
 
@@ -1,21 +1,10 @@
 from flask import Blueprint, request, jsonify, session
-import csv
 import os
 import hashlib
-from datetime import datetime
+from services.user_store import user_store
 
 auth_bp = Blueprint('auth', __name__)
 
-USER_CSV_PATH = 'data/users.csv'
-
-def init_user_csv():
-    """初始化用户CSV文件"""
-    os.makedirs('data', exist_ok=True)
-    if not os.path.exists(USER_CSV_PATH):
-        with open(USER_CSV_PATH, 'w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(['username', 'password', 'user_folder', 'created_at'])
-
 def get_user_folder(username):
     """获取用户文件夹路径"""
     return f"data/users/{username}"
@@ -31,25 +20,18 @@ def register():
         if not username or not password:
             return jsonify({'success': False, 'message': '用户名和密码不能为空'})
         
-        init_user_csv()
-        
         # 检查用户是否已存在
-        with open(USER_CSV_PATH, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)  # 跳过标题行
-            for row in reader:
-                if row and row[0] == username:
-                    return jsonify({'success': False, 'message': '用户名已存在'})
+        if user_store.get(username):
+            return jsonify({'success': False, 'message': '用户名已存在'})
         
         # 创建用户文件夹
         user_folder = get_user_folder(username)
         os.makedirs(user_folder, exist_ok=True)
         os.makedirs(f"{user_folder}/chat_history", exist_ok=True)
         
-        # 添加新用户（明文存储密码，如您要求）
-        with open(USER_CSV_PATH, 'a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow([username, password, user_folder, datetime.now().isoformat()])
+        # 添加新用户（明文存储密码，如您要求）；并发注册同名用户时只有一个会成功
+        if not user_store.create(username, password, user_folder):
+            return jsonify({'success': False, 'message': '用户名已存在'})
         
         return jsonify({'success': True, 'message': '注册成功'})
         
@@ -67,27 +49,22 @@ def login():
         if not username or not password:
             return jsonify({'success': False, 'message': '用户名和密码不能为空'})
         
-        init_user_csv()
-        
         # 验证用户登录
-        with open(USER_CSV_PATH, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)  # 跳过标题行
-            for row in reader:
-                if row and len(row) >= 3 and row[0] == username and row[1] == password:
-                    # 登录成功，设置session
-                    session['user'] = {
-                        'username': username,
-                        'user_folder': row[2]
-                    }
-                    return jsonify({
-                        'success': True, 
-                        'message': '登录成功',
-                        'user': {
-                            'username': username,
-                            'user_folder': row[2]
-                        }
-                    })
+        user_record = user_store.verify(username, password)
+        if user_record:
+            # 登录成功，设置session
+            session['user'] = {
+                'username': username,
+                'user_folder': user_record['user_folder']
+            }
+            return jsonify({
+                'success': True, 
+                'message': '登录成功',
+                'user': {
+                    'username': username,
+                    'user_folder': user_record['user_folder']
+                }
+            })
         
         return jsonify({'success': False, 'message': '用户名或密码错误'})
         
@@ -118,19 +95,16 @@ def get_profile():
     
     try:
         # 读取用户信息
-        with open(USER_CSV_PATH, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)  # 跳过标题行
-            for row in reader:
-                if row and row[0] == user['username']:
-                    return jsonify({
-                        'success': True,
-                        'profile': {
-                            'username': row[0],
-                            'user_folder': row[2],
-                            'created_at': row[3] if len(row) > 3 else 'Unknown'
-                        }
-                    })
+        user_record = user_store.get(user['username'])
+        if user_record:
+            return jsonify({
+                'success': True,
+                'profile': {
+                    'username': user_record['username'],
+                    'user_folder': user_record['user_folder'],
+                    'created_at': user_record['created_at']
+                }
+            })
         
         return jsonify({'success': False, 'message': '用户信息不存在'})
         
@@ -1,20 +1,12 @@
 from flask import Blueprint, request, jsonify, session
-import json
-import os
+import time
 import uuid
 from datetime import datetime
+from config import CHAT_SEARCH_CONFIG
+from services.chat_store import chat_store
 
 chat_history_bp = Blueprint('chat_history', __name__)
 
-def get_user_chat_folder(username):
-    """获取用户聊天记录文件夹"""
-    return f"data/users/{username}/chat_history"
-
-def get_chat_file_path(username, chat_id):
-    """获取聊天记录文件路径"""
-    chat_folder = get_user_chat_folder(username)
-    return os.path.join(chat_folder, f"{chat_id}.json")
-
 @chat_history_bp.route('/list', methods=['GET'])
 def list_chat_history():
     """获取用户的聊天记录列表"""
@@ -24,41 +16,70 @@ def list_chat_history():
         return jsonify({'success': True, 'chat_list': [], 'message': '未登录，无法获取聊天记录'})
     
     try:
-        chat_folder = get_user_chat_folder(user['username'])
-        os.makedirs(chat_folder, exist_ok=True)
+        # 分页参数（不传page_size时返回全部），默认按更新时间倒序
+        sort_by = request.args.get('sort', 'updated_at')
+        descending = request.args.get('order', 'desc') != 'asc'
+        page = request.args.get('page', 1, type=int)
+        page_size = request.args.get('page_size', type=int)
         
-        chat_list = []
+        # 从用户的聊天记录索引读取，不再逐个打开对话文件
+        chat_list, total = chat_store.index.list(user['username'], sort_by, descending, page, page_size)
         
-        # 遍历聊天记录文件
-        for filename in os.listdir(chat_folder):
-            if filename.endswith('.json'):
-                chat_id = filename[:-5]  # 移除.json扩展名
-                file_path = os.path.join(chat_folder, filename)
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        chat_data = json.load(f)
-                        
-                    chat_list.append({
-                        'chat_id': chat_id,
-                        'title': chat_data.get('title', '未命名对话'),
-                        'feature': chat_data.get('feature', 'intelligent_reading'),
-                        'created_at': chat_data.get('created_at', ''),
-                        'updated_at': chat_data.get('updated_at', ''),
-                        'message_count': len(chat_data.get('messages', []))
-                    })
-                except:
-                    # 如果文件损坏，跳过
-                    continue
-        
-        # 按更新时间排序
-        chat_list.sort(key=lambda x: x['updated_at'], reverse=True)
-        
-        return jsonify({'success': True, 'chats': chat_list})
+        return jsonify({
+            'success': True,
+            'chats': chat_list,
+            'total': total,
+            'page': page,
+            'page_size': page_size or total
+        })
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'获取聊天记录失败：{str(e)}'})
 
+@chat_history_bp.route('/search', methods=['GET'])
+def search_chat_history():
+    """全文搜索用户的聊天记录（标题和消息内容），可按功能和日期过滤"""
+    user = session.get('user')
+    if not user:
+        return jsonify({'success': True, 'chats': [], 'total': 0, 'message': '未登录，无法搜索聊天记录'})
+    
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'message': '搜索关键词不能为空'})
+        
+        feature = request.args.get('feature') or None
+        date_from = request.args.get('date_from') or None
+        date_to = request.args.get('date_to') or None
+        for value in (date_from, date_to):
+            if value:
+                try:
+                    datetime.strptime(value, '%Y-%m-%d')
+                except ValueError:
+                    return jsonify({'success': False, 'message': '日期格式应为YYYY-MM-DD'})
+        
+        page = request.args.get('page', 1, type=int)
+        page_size = request.args.get('page_size', 20, type=int)
+        page_size = min(max(page_size, 1), CHAT_SEARCH_CONFIG['max_page_size'])
+        
+        started = time.time()
+        chats, total = chat_store.search.search(
+            user['username'], query, feature=feature, date_from=date_from, date_to=date_to,
+            page=page, page_size=page_size
+        )
+        
+        return jsonify({
+            'success': True,
+            'chats': chats,
+            'total': total,
+            'page': page,
+            'page_size': page_size,
+            'took_ms': round((time.time() - started) * 1000, 1)
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'搜索聊天记录失败：{str(e)}'})
+
 @chat_history_bp.route('/create', methods=['POST'])
 def create_new_chat():
     """创建新的聊天记录"""
@@ -76,23 +97,8 @@ def create_new_chat():
         # 生成新的聊天ID
         chat_id = str(uuid.uuid4())
         
-        # 创建聊天记录数据
-        chat_data = {
-            'chat_id': chat_id,
-            'title': title,
-            'feature': feature,
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat(),
-            'messages': []
-        }
-        
-        # 保存聊天记录
-        chat_folder = get_user_chat_folder(user['username'])
-        os.makedirs(chat_folder, exist_ok=True)
-        
-        file_path = get_chat_file_path(user['username'], chat_id)
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(chat_data, f, ensure_ascii=False, indent=2)
+        # 创建聊天记录
+        chat_store.create(user['username'], chat_id, title, feature)
         
         return jsonify({'success': True, 'chat_id': chat_id, 'message': '新对话创建成功'})
         
@@ -117,14 +123,11 @@ def get_chat_history(chat_id):
         })
     
     try:
-        file_path = get_chat_file_path(user['username'], chat_id)
+        chat_data = chat_store.load(user['username'], chat_id)
         
-        if not os.path.exists(file_path):
+        if chat_data is None:
             return jsonify({'success': False, 'message': '聊天记录不存在'})
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            chat_data = json.load(f)
-        
         return jsonify({'success': True, 'chat': chat_data})
         
     except Exception as e:
@@ -146,40 +149,20 @@ def save_chat_message():
         if not chat_id or not message:
             return jsonify({'success': False, 'message': '参数不完整'})
         
-        file_path = get_chat_file_path(user['username'], chat_id)
-        
-        # 读取现有聊天记录
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                chat_data = json.load(f)
-        else:
-            # 如果文件不存在，创建新的聊天记录
-            chat_data = {
-                'chat_id': chat_id,
-                'title': '未命名对话',
-                'feature': 'intelligent_reading',
-                'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat(),
-                'messages': []
-            }
-        
-        # 添加新消息
-        message['timestamp'] = datetime.now().isoformat()
-        chat_data['messages'].append(message)
-        chat_data['updated_at'] = datetime.now().isoformat()
+        # 如果聊天记录不存在，创建新的聊天记录（create在锁内检查，已存在时不会覆盖）
+        if not chat_store.exists(user['username'], chat_id):
+            chat_store.create(user['username'], chat_id, '未命名对话', 'intelligent_reading')
         
         # 如果是第一条用户消息，可以用它作为标题
-        if len(chat_data['messages']) == 1 and message.get('role') == 'user':
+        first_message_title = None
+        if message.get('role') == 'user':
             title = message.get('content', '')[:30]  # 取前30个字符作为标题
             if title:
-                chat_data['title'] = title + ('...' if len(message.get('content', '')) > 30 else '')
-        
-        # 保存更新的聊天记录
-        chat_folder = get_user_chat_folder(user['username'])
-        os.makedirs(chat_folder, exist_ok=True)
+                first_message_title = title + ('...' if len(message.get('content', '')) > 30 else '')
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(chat_data, f, ensure_ascii=False, indent=2)
+        # 追加新消息（只写入一行，不重写整个文件）
+        message['timestamp'] = datetime.now().isoformat()
+        chat_store.append_message(user['username'], chat_id, message, first_message_title)
         
         return jsonify({'success': True, 'message': '消息保存成功'})
         
@@ -195,10 +178,7 @@ def delete_chat_history(chat_id):
         return jsonify({'success': True, 'message': '未登录，无聊天记录可删除'})
     
     try:
-        file_path = get_chat_file_path(user['username'], chat_id)
-        
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if chat_store.delete(user['username'], chat_id):
             return jsonify({'success': True, 'message': '聊天记录删除成功'})
         else:
             return jsonify({'success': False, 'message': '聊天记录不存在'})
@@ -222,21 +202,10 @@ def update_chat_title():
         if not chat_id or not new_title:
             return jsonify({'success': False, 'message': '参数不完整'})
         
-        file_path = get_chat_file_path(user['username'], chat_id)
-        
-        if not os.path.exists(file_path):
+        # 追加一条标题更新记录
+        if chat_store.update_meta(user['username'], chat_id, title=new_title) is None:
             return jsonify({'success': False, 'message': '聊天记录不存在'})
         
-        # 读取并更新聊天记录
-        with open(file_path, 'r', encoding='utf-8') as f:
-            chat_data = json.load(f)
-        
-        chat_data['title'] = new_title
-        chat_data['updated_at'] = datetime.now().isoformat()
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(chat_data, f, ensure_ascii=False, indent=2)
-        
         return jsonify({'success': True, 'message': '标题更新成功'})
         
     except Exception as e:
@@ -251,14 +220,11 @@ def export_chat_history(chat_id):
         return jsonify({'success': True, 'content': '# 临时对话\n\n未登录用户，无聊天记录可导出。', 'title': '临时对话'})
     
     try:
-        file_path = get_chat_file_path(user['username'], chat_id)
+        chat_data = chat_store.load(user['username'], chat_id)
         
-        if not os.path.exists(file_path):
+        if chat_data is None:
             return jsonify({'success': False, 'message': '聊天记录不存在'})
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            chat_data = json.load(f)
-        
         # 生成导出格式
         export_content = f"# {chat_data.get('title', '未命名对话')}\n\n"
         export_content += f"**功能**: {chat_data.get('feature', 'unknown')}\n"
@@ -301,29 +267,15 @@ def save_message():
         if not session_id or not message:
             return jsonify({'success': False, 'message': '缺少必要参数'})
         
-        # 获取聊天记录文件路径
-        file_path = get_chat_file_path(user['username'], session_id)
-        
-        if not os.path.exists(file_path):
-            return jsonify({'success': False, 'message': '会话不存在'})
-        
-        # 读取现有聊天记录
-        with open(file_path, 'r', encoding='utf-8') as f:
-            chat_data = json.load(f)
-        
-        # 添加新消息
-        chat_data['messages'].append({
+        # 追加新消息（只写入一行，不重写整个文件）
+        summary = chat_store.append_message(user['username'], session_id, {
             'role': message.get('role', 'user'),
             'content': message.get('content', ''),
             'timestamp': message.get('timestamp', datetime.now().isoformat())
         })
         
-        # 更新修改时间
-        chat_data['updated_at'] = datetime.now().isoformat()
-        
-        # 保存文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(chat_data, f, ensure_ascii=False, indent=2)
+        if summary is None:
+            return jsonify({'success': False, 'message': '会话不存在'})
         
         return jsonify({'success': True, 'message': '消息保存成功'})
         
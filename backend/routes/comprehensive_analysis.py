@@ -1,32 +1,18 @@
-from flask import Blueprint, request, jsonify, Response
-import json
+from flask import Blueprint, request, jsonify
 import uuid
-import requests
 from services.ai_service import ai_service
 from services.web_crawler import web_crawler
 from services.ocr_service import ocr_service
-from utils.file_handler import save_uploaded_files, extract_text_from_file
+from services.search_client import search_client
+from services.summarizer import summarizer
+from services.history_compactor import history_compactor
+from utils.file_handler import save_uploaded_files, stream_text_from_file
+from utils.sse import SSEWriter, sse_response
+from utils.step_dag import StepDAG
+from utils.context_budget import fit_parts, fit_to_model
 
 comprehensive_analysis_bp = Blueprint('comprehensive_analysis', __name__)
 
-SEARCH_API_URL = "http://chengyuxuan.top:3100/search"
-
-def search_information(query):
-    """搜索相关信息"""
-    try:
-        params = {
-            'q': query,
-            'format': 'json'
-        }
-        response = requests.get(SEARCH_API_URL, params=params, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
-        return data
-        
-    except Exception as e:
-        return {'error': str(e)}
-
 @comprehensive_analysis_bp.route('/start', methods=['POST'])
 def start_comprehensive_analysis():
     """开始全面总结分析"""
@@ -77,26 +63,18 @@ def start_comprehensive_analysis():
             if not files:
                 return jsonify({'success': False, 'message': '未检测到上传的文件'})
                 
+            # 在流式响应中提取文件文字，PDF逐页报告进度
             saved_paths = save_uploaded_files(files)
-            
-            for file_path in saved_paths:
-                file_content = extract_text_from_file(file_path)
-                if file_content:
-                    extracted_content += f"\n\n=== {file_path} ===\n{file_content}"
+            return sse_response(generate_file_comprehensive_analysis(saved_paths, str(uuid.uuid4())))
         
         elif content_type == 'image':
             images = request.files.getlist('images')
             if not images:
                 return jsonify({'success': False, 'message': '未检测到上传的图片'})
                 
+            # 在流式响应中并发识别图片，逐张报告进度
             saved_paths = ocr_service.save_uploaded_images(images)
-            ocr_results = ocr_service.extract_text_from_multiple_images(saved_paths)
-            
-            for result in ocr_results:
-                if result['success']:
-                    extracted_content += f"\n\n=== 图片文字 ===\n{result['text']}"
-                else:
-                    extracted_content += f"\n\n错误：无法识别图片文字：{result['error']}"
+            return sse_response(generate_image_comprehensive_analysis(saved_paths, str(uuid.uuid4())))
         
         if not extracted_content.strip():
             return jsonify({'success': False, 'message': '没有提取到任何有效内容，请检查上传的内容'})
@@ -105,18 +83,50 @@ def start_comprehensive_analysis():
         session_id = str(uuid.uuid4())
         
         # 使用流式响应实现实时进度更新
-        return Response(
-            generate_comprehensive_analysis(extracted_content, session_id),
-            mimetype='text/plain'
-        )
+        return sse_response(generate_comprehensive_analysis(extracted_content, session_id))
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'开始全面分析失败：{str(e)}'})
 
+def generate_file_comprehensive_analysis(saved_paths, session_id):
+    """先提取文件文字（PDF每完成一页发送pdf_progress事件），再进行全面分析"""
+    writer = SSEWriter()
+    extracted_content = ""
+    for file_path in saved_paths:
+        file_content = yield from stream_text_from_file(file_path, writer)
+        if file_content:
+            extracted_content += f"\n\n=== {file_path} ===\n{file_content}"
+    
+    if not extracted_content.strip():
+        yield writer.event('error', message='没有提取到任何有效内容，请检查上传的内容')
+        return
+    
+    yield from generate_comprehensive_analysis(extracted_content, session_id)
+
+
+def generate_image_comprehensive_analysis(saved_paths, session_id):
+    """先识别图片文字（每完成一张发送ocr_progress事件），再进行全面分析"""
+    writer = SSEWriter()
+    ocr_results = yield from ocr_service.stream_text_from_multiple_images(saved_paths, writer)
+    
+    extracted_content = ""
+    for result in ocr_results:
+        if result['success']:
+            extracted_content += f"\n\n=== 图片文字 ===\n{result['text']}"
+        else:
+            extracted_content += f"\n\n错误：无法识别图片文字：{result['error']}"
+    
+    if not extracted_content.strip():
+        yield writer.event('error', message='没有提取到任何有效内容，请检查上传的内容')
+        return
+    
+    yield from generate_comprehensive_analysis(extracted_content, session_id)
+
 def generate_comprehensive_analysis(content, session_id):
     """生成全面分析的四个步骤"""
+    writer = SSEWriter()
     try:
-        yield f"data: {json.dumps({'type': 'session_id', 'session_id': session_id})}\n\n"
+        yield writer.event('session_id', session_id=session_id)
         
         # 调试信息
         print(f"=== 全面分析调试（流式版本）===")
@@ -127,27 +137,40 @@ def generate_comprehensive_analysis(content, session_id):
         
         # 检查内容是否为空或包含爬虫错误
         if not content.strip():
-            yield f"data: {json.dumps({'type': 'error', 'message': '内容为空，无法进行分析'})}\n\n"
+            yield writer.event('error', message='内容为空，无法进行分析')
             return
             
         if "错误：无法提取" in content:
-            yield f"data: {json.dumps({'type': 'error', 'message': '网页内容提取失败，请检查链接是否有效'})}\n\n"
+            yield writer.event('error', message='网页内容提取失败，请检查链接是否有效')
             return
             
         if "没有提取到任何内容" in content:
-            yield f"data: {json.dumps({'type': 'error', 'message': '没有提取到任何有效内容，请重新尝试'})}\n\n"
+            yield writer.event('error', message='没有提取到任何有效内容，请重新尝试')
             return
         
-        # 第一步：文章概要
-        print("=" * 30)
-        print("开始第一步：文章概要")
-        print("=" * 30)
-        yield f"data: {json.dumps({'type': 'step_start', 'step': 1, 'name': '文章概要', 'description': '提取文章大意和核心信息'})}\n\n"
-        
-        overview_prompt = f"""我是一个专业的内容分析助手。请对以下内容进行全面的概要分析。
+        # 关键词提取和搜索只依赖原文，与第一步并发执行；第三、四步依赖前面的结果。
+        # 各步骤的事件仍按步骤顺序输出给前端
+        def condense_step(writer, inputs):
+            # 第一步的开始事件在这里发送：长文档的摘要进度属于第一步，前端要先建好第一步才能显示
+            yield writer.event('step_start', step=1, name='文章概要', description='提取文章大意和核心信息')
+            # 超出模型上下文的长文档先分段并发摘要、逐层合并，概要和深入思考都基于合并后的摘要
+            if not summarizer.needs_summary(content, ai_service.complex_model):
+                return content
+            document = yield from summarizer.summarize(content, writer, step=1)
+            return f"（原文较长，以下是按原文顺序分段摘要后合并的内容）\n\n{document}"
+        
+        def overview_step(writer, inputs):
+            # 第一步：文章概要
+            print("=" * 30)
+            print("开始第一步：文章概要")
+            print("=" * 30)
+            
+            # 按模型上下文预算放入原文（或长文档的合并摘要）
+            document = fit_to_model(inputs['condense'], ai_service.complex_model)
+            overview_prompt = f"""我是一个专业的内容分析助手。请对以下内容进行全面的概要分析。
 
 **待分析内容：**
-{content}
+{document}
 
 **分析任务：**
 请对上述内容进行全面的概要分析，包括：
@@ -181,34 +204,33 @@ def generate_comprehensive_analysis(content, session_id):
 <think>
 我需要仔细阅读这篇内容，从多个维度进行概要分析，包括主题、观点、论述、信息点和结构等方面。
 </think>"""
-        
-        overview_content = ""
-        print("正在调用AI进行概要分析...")
-        for chunk in ai_service.complex_chat(overview_prompt):
-            thinking, display = ai_service.extract_thinking(chunk)
-            if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'step': 1, 'content': thinking})}\n\n"
-            if display:
-                overview_content += display
-                yield f"data: {json.dumps({'type': 'content', 'step': 1, 'content': display})}\n\n"
-        
-        print(f"概要分析完成，内容长度: {len(overview_content)}")
-        yield f"data: {json.dumps({'type': 'step_complete', 'step': 1})}\n\n"
-        
-        # 第二步：搜索结果
-        print("=" * 30)
-        print("开始第二步：搜索结果")
-        print("=" * 30)
-        yield f"data: {json.dumps({'type': 'step_start', 'step': 2, 'name': '搜索结果', 'description': '搜索相关资料和信息'})}\n\n"
-        
-        # 首先让AI提取搜索关键词
-        yield f"data: {json.dumps({'type': 'thinking', 'step': 2, 'content': '正在基于文章内容提取搜索关键词...'})}\n\n"
-        
-        keyword_prompt = f"""基于以下概要分析结果：
-{overview_content}
-
-以及原文内容：
-{content}
+            
+            overview_content = ""
+            print("正在调用AI进行概要分析...")
+            for thinking, display in ai_service.split_thinking(ai_service.complex_chat(overview_prompt)):
+                if thinking:
+                    yield writer.thinking(thinking, step=1)
+                if display:
+                    overview_content += display
+                    yield writer.content(display, step=1)
+            
+            print(f"概要分析完成，内容长度: {len(overview_content)}")
+            yield writer.event('step_complete', step=1)
+            return overview_content
+        
+        def keywords_step(writer, inputs):
+            # 第二步：搜索结果
+            print("=" * 30)
+            print("开始第二步：搜索结果")
+            print("=" * 30)
+            yield writer.event('step_start', step=2, name='搜索结果', description='搜索相关资料和信息')
+            
+            # 首先让AI提取搜索关键词
+            yield writer.thinking('正在基于文章内容提取搜索关键词...', step=2)
+            
+            document = fit_to_model(content, ai_service.simple_model)
+            keyword_prompt = f"""基于以下原文内容：
+{document}
 
 请提取3-5个最重要的搜索关键词，用于搜索相关资料和信息。
 关键词应该是：
@@ -218,116 +240,131 @@ def generate_comprehensive_analysis(content, session_id):
 4. 相关的人物、机构或事件
 
 请直接输出关键词，每行一个，不要其他格式和解释。"""
+            
+            keywords_content = ""
+            for thinking, display in ai_service.split_thinking(ai_service.simple_chat(keyword_prompt)):
+                if thinking:
+                    yield writer.thinking(thinking, step=2)
+                if display:
+                    keywords_content += display
+            
+            # 解析关键词
+            keywords = [kw.strip() for kw in keywords_content.split('\n') if kw.strip() and not kw.startswith('#') and not kw.startswith('*')]
+            keywords = keywords[:5]  # 最多5个关键词
+            
+            print(f"提取到的关键词: {keywords}")
+            
+            # 美化关键词显示
+            keywords_display = "## 🎯 提取的搜索关键词\\n\\n"
+            for i, kw in enumerate(keywords, 1):
+                keywords_display += f"**{i}.** `{kw}`\\n\\n"
+            keywords_display += "\\n正在基于这些关键词搜索相关资料...\\n\\n"
+            
+            yield writer.content(keywords_display, step=2)
+            return keywords
         
-        keywords_content = ""
-        for chunk in ai_service.simple_chat(keyword_prompt):
-            thinking, display = ai_service.extract_thinking(chunk)
-            if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'step': 2, 'content': thinking})}\n\n"
-            if display:
-                keywords_content += display
-        
-        # 解析关键词
-        keywords = [kw.strip() for kw in keywords_content.split('\n') if kw.strip() and not kw.startswith('#') and not kw.startswith('*')]
-        keywords = keywords[:5]  # 最多5个关键词
-        
-        print(f"提取到的关键词: {keywords}")
-        
-        # 美化关键词显示
-        keywords_display = "## 🎯 提取的搜索关键词\\n\\n"
-        for i, kw in enumerate(keywords, 1):
-            keywords_display += f"**{i}.** `{kw}`\\n\\n"
-        keywords_display += "\\n正在基于这些关键词搜索相关资料...\\n\\n"
-        
-        yield f"data: {json.dumps({'type': 'content', 'step': 2, 'content': keywords_display})}\n\n"
-        
-        # 执行搜索
-        search_results = []
-        search_results_data = []
-        
-        for keyword in keywords:
-            print(f"正在搜索关键词: {keyword}")
-            yield f"data: {json.dumps({'type': 'thinking', 'step': 2, 'content': f'正在搜索关键词: {keyword}'})}\n\n"
+        def search_step(writer, inputs):
+            keywords = inputs['keywords']
             
-            search_result = search_information(keyword)
-            if 'error' not in search_result and 'results' in search_result and search_result['results']:
-                search_results.append({
-                    'keyword': keyword,
-                    'results': search_result
-                })
-                
-                results = search_result['results'][:3]  # 显示前3个结果
-                print(f"  找到 {len(results)} 个相关结果")
-                
-                # 显示搜索结果
-                result_content = f"\\n\\n### 🔍 关键词: {keyword}\\n\\n"
-                
-                for i, item in enumerate(results, 1):
-                    title = item.get('title', '无标题')
-                    url = item.get('url', '')
-                    snippet = item.get('snippet', item.get('description', '无描述'))
-                    
-                    # 使用简洁的文本格式，避免复杂嵌套
-                    result_content += f"{i}. **{title}**\\n"
-                    if snippet and snippet != '无描述':
-                        result_content += f"   📄 {snippet}\\n"
-                    if url:
-                        result_content += f"   🔗 {url}\\n"
-                    result_content += "\\n"
-                    
-                    # 保存搜索结果数据供后续分析使用
-                    search_results_data.append({
+            # 执行搜索
+            search_results = []
+            search_results_data = []
+            
+            for keyword in keywords:
+                print(f"正在搜索关键词: {keyword}")
+                yield writer.thinking(f'正在搜索关键词: {keyword}', step=2)
+            
+            # 各关键词的搜索互不依赖，并发执行，结果仍按关键词顺序展示
+            keyword_results = search_client.search_many(keywords)
+            
+            for keyword, search_result in zip(keywords, keyword_results):
+                if 'error' not in search_result and 'results' in search_result and search_result['results']:
+                    search_results.append({
                         'keyword': keyword,
-                        'title': title,
-                        'snippet': snippet,
-                        'url': url
+                        'results': search_result
                     })
-                
-                yield f"data: {json.dumps({'type': 'content', 'step': 2, 'content': result_content})}\n\n"
-            else:
-                print(f"  搜索 '{keyword}' 时出现错误或无结果")
-                error_msg = search_result.get('error', '未知错误')
-                yield f"data: {json.dumps({'type': 'thinking', 'step': 2, 'content': f'搜索 {keyword} 失败: {error_msg}'})}\n\n"
-                
-                result_content = f"\\n\\n### 🔍 关键词: {keyword}\\n\\n❌ 搜索时出现错误或无结果\\n\\n"
-                yield f"data: {json.dumps({'type': 'content', 'step': 2, 'content': result_content})}\n\n"
-        
-        # 总结搜索结果
-        summary_content = f"\\n\\n## 📊 搜索结果总结\\n\\n"
-        summary_content += f"- 成功搜索关键词: {len(search_results)}/{len(keywords)}\\n"
-        summary_content += f"- 总共获取到 {len(search_results_data)} 条相关信息\\n"
-        
-        if search_results:
-            summary_content += "\\n这些搜索结果为文章分析提供了额外的背景信息和相关资料，有助于更深入地理解文章内容。"
-        
-        yield f"data: {json.dumps({'type': 'content', 'step': 2, 'content': summary_content})}\n\n"
-        print(f"搜索结果汇总完成，共获得 {len(search_results_data)} 条有效结果")
-        
-        yield f"data: {json.dumps({'type': 'step_complete', 'step': 2})}\n\n"
-        
-        # 第三步：深入思考
-        print("=" * 30)
-        print("开始第三步：深入思考")
-        print("=" * 30)
-        yield f"data: {json.dumps({'type': 'step_start', 'step': 3, 'name': '深入思考', 'description': '结合搜索结果深入分析文章'})}\n\n"
-        
-        # 将搜索结果整理为文本
-        search_context = ""
-        if search_results_data:
-            search_context = "相关搜索结果：\n"
-            for result in search_results_data:
-                search_context += f"- 关键词'{result['keyword']}'：{result['title']} - {result['snippet']}\n"
-        
-        thinking_prompt = f"""基于前面的概要分析：
-{overview_content}
+                    
+                    results = search_result['results'][:3]  # 显示前3个结果
+                    print(f"  找到 {len(results)} 个相关结果")
+                    
+                    # 显示搜索结果
+                    result_content = f"\\n\\n### 🔍 关键词: {keyword}\\n\\n"
+                    
+                    for i, item in enumerate(results, 1):
+                        title = item.get('title', '无标题')
+                        url = item.get('url', '')
+                        snippet = item.get('snippet', item.get('description', '无描述'))
+                        
+                        # 使用简洁的文本格式，避免复杂嵌套
+                        result_content += f"{i}. **{title}**\\n"
+                        if snippet and snippet != '无描述':
+                            result_content += f"   📄 {snippet}\\n"
+                        if url:
+                            result_content += f"   🔗 {url}\\n"
+                        result_content += "\\n"
+                        
+                        # 保存搜索结果数据供后续分析使用
+                        search_results_data.append({
+                            'keyword': keyword,
+                            'title': title,
+                            'snippet': snippet,
+                            'url': url
+                        })
+                    
+                    yield writer.content(result_content, step=2)
+                else:
+                    print(f"  搜索 '{keyword}' 时出现错误或无结果")
+                    error_msg = search_result.get('error', '未知错误')
+                    yield writer.thinking(f'搜索 {keyword} 失败: {error_msg}', step=2)
+                    
+                    result_content = f"\\n\\n### 🔍 关键词: {keyword}\\n\\n❌ 搜索时出现错误或无结果\\n\\n"
+                    yield writer.content(result_content, step=2)
+            
+            # 总结搜索结果
+            summary_content = f"\\n\\n## 📊 搜索结果总结\\n\\n"
+            summary_content += f"- 成功搜索关键词: {len(search_results)}/{len(keywords)}\\n"
+            summary_content += f"- 总共获取到 {len(search_results_data)} 条相关信息\\n"
+            
+            if search_results:
+                summary_content += "\\n这些搜索结果为文章分析提供了额外的背景信息和相关资料，有助于更深入地理解文章内容。"
+            
+            yield writer.content(summary_content, step=2)
+            print(f"搜索结果汇总完成，共获得 {len(search_results_data)} 条有效结果")
+            
+            yield writer.event('step_complete', step=2)
+            
+            # 将搜索结果整理为文本
+            search_context = ""
+            if search_results_data:
+                search_context = "相关搜索结果：\n"
+                for result in search_results_data:
+                    search_context += f"- 关键词'{result['keyword']}'：{result['title']} - {result['snippet']}\n"
+            return search_context
+        
+        def deep_step(writer, inputs):
+            # 第三步：深入思考
+            print("=" * 30)
+            print("开始第三步：深入思考")
+            print("=" * 30)
+            yield writer.event('step_start', step=3, name='深入思考', description='结合搜索结果深入分析文章')
+            
+            # 概要、搜索结果和原文共享模型的上下文预算，原文权重最高
+            parts = fit_parts(ai_service.complex_model, {
+                'overview': (inputs['overview'], 2),
+                'search': (inputs['search'], 1),
+                'content': (inputs['condense'], 3)
+            })
+            
+            thinking_prompt = f"""基于前面的概要分析：
+{parts['overview']}
 
 结合搜索结果：
-{search_context}
+{parts['search']}
 
 请对原文进行深入思考和分析：
 
 原文：
-{content}
+{parts['content']}
 
 **分析任务：**
 请结合搜索到的相关信息，对文章进行深度分析：
@@ -369,35 +406,41 @@ def generate_comprehensive_analysis(content, session_id):
 <think>
 我需要结合概要分析和搜索结果，对原始内容进行深入的批判性分析，从多个维度评估其价值、观点、逻辑和意义。
 </think>"""
-        
-        deep_content = ""
-        print("正在进行深度分析...")
-        for chunk in ai_service.complex_chat(thinking_prompt):
-            thinking, display = ai_service.extract_thinking(chunk)
-            if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'step': 3, 'content': thinking})}\n\n"
-            if display:
-                deep_content += display
-                yield f"data: {json.dumps({'type': 'content', 'step': 3, 'content': display})}\n\n"
-        
-        print(f"深度分析完成，内容长度: {len(deep_content)}")
-        yield f"data: {json.dumps({'type': 'step_complete', 'step': 3})}\n\n"
-        
-        # 第四步：总结归纳
-        print("=" * 30)
-        print("开始第四步：总结归纳")
-        print("=" * 30)
-        yield f"data: {json.dumps({'type': 'step_start', 'step': 4, 'name': '总结归纳', 'description': '综合所有分析生成最终报告'})}\n\n"
-        
-        # 限制前面步骤内容的长度，避免prompt过长
-        overview_summary = overview_content[:500] + "..." if len(overview_content) > 500 else overview_content
-        search_summary = search_context[:300] + "..." if len(search_context) > 300 else search_context
-        deep_summary = deep_content[:500] + "..." if len(deep_content) > 500 else deep_content
-        
-        print(f"第四步prompt长度控制 - 概要: {len(overview_summary)}, 搜索: {len(search_summary)}, 深度: {len(deep_summary)}")
-        
-        # 简化prompt，避免过长导致AI无响应
-        summary_prompt = f"""基于前面的分析，请生成最终的综合总结报告。
+            
+            deep_content = ""
+            print("正在进行深度分析...")
+            for thinking, display in ai_service.split_thinking(ai_service.complex_chat(thinking_prompt)):
+                if thinking:
+                    yield writer.thinking(thinking, step=3)
+                if display:
+                    deep_content += display
+                    yield writer.content(display, step=3)
+            
+            print(f"深度分析完成，内容长度: {len(deep_content)}")
+            yield writer.event('step_complete', step=3)
+            return deep_content
+        
+        def summary_step(writer, inputs):
+            # 第四步：总结归纳
+            print("=" * 30)
+            print("开始第四步：总结归纳")
+            print("=" * 30)
+            yield writer.event('step_start', step=4, name='总结归纳', description='综合所有分析生成最终报告')
+            
+            # 限制前面步骤内容的token数（总结步骤单独使用较小的预算），避免prompt过长
+            parts = fit_parts(ai_service.complex_model, {
+                'overview': (inputs['overview'], 5),
+                'search': (inputs['search'], 3),
+                'deep': (inputs['deep'], 5)
+            }, step='summary')
+            overview_summary = parts['overview']
+            search_summary = parts['search']
+            deep_summary = parts['deep']
+            
+            print(f"第四步prompt长度控制 - 概要: {len(overview_summary)}, 搜索: {len(search_summary)}, 深度: {len(deep_summary)}")
+            
+            # 简化prompt，避免过长导致AI无响应
+            summary_prompt = f"""基于前面的分析，请生成最终的综合总结报告。
 
 概要分析摘要：
 {overview_summary}
@@ -436,37 +479,40 @@ def generate_comprehensive_analysis(content, session_id):
 <think>
 我需要基于前面的分析，生成一个完整而有价值的最终总结报告。
 </think>"""
-        
-        print("正在生成最终汇总...")
-        summary_content = ""
-        chunk_count = 0
-        
-        try:
-            for chunk in ai_service.complex_chat(summary_prompt):
-                chunk_count += 1
-                print(f"第四步收到chunk {chunk_count}: {chunk[:100]}...")
-                
-                thinking, display = ai_service.extract_thinking(chunk)
-                if thinking:
-                    print(f"第四步思考内容: {thinking[:100]}...")
-                    yield f"data: {json.dumps({'type': 'thinking', 'step': 4, 'content': thinking})}\n\n"
-                if display:
-                    print(f"第四步显示内容: {display[:100]}...")
-                    summary_content += display
-                    yield f"data: {json.dumps({'type': 'content', 'step': 4, 'content': display})}\n\n"
-        except Exception as e:
-            print(f"第四步AI调用出错: {str(e)}")
-            chunk_count = 0
+            
+            print("正在生成最终汇总...")
             summary_content = ""
-        
-        print(f"最终汇总完成，总共收到 {chunk_count} 个chunk，内容长度: {len(summary_content)}")
-        
-        # 如果没有收到任何内容，生成一个备用总结
-        if not summary_content.strip() or chunk_count == 0:
-            print("警告：AI没有返回任何内容，生成备用总结...")
+            chunk_count = 0
+            
+            try:
+                def counted_chunks():
+                    nonlocal chunk_count
+                    for chunk in ai_service.complex_chat(summary_prompt):
+                        chunk_count += 1
+                        print(f"第四步收到chunk {chunk_count}: {chunk[:100]}...")
+                        yield chunk
+                
+                for thinking, display in ai_service.split_thinking(counted_chunks()):
+                    if thinking:
+                        print(f"第四步思考内容: {thinking[:100]}...")
+                        yield writer.thinking(thinking, step=4)
+                    if display:
+                        print(f"第四步显示内容: {display[:100]}...")
+                        summary_content += display
+                        yield writer.content(display, step=4)
+            except Exception as e:
+                print(f"第四步AI调用出错: {str(e)}")
+                chunk_count = 0
+                summary_content = ""
             
-            # 基于前面步骤的内容生成一个简单的总结
-            fallback_summary = f"""## 📊 最终分析总结
+            print(f"最终汇总完成，总共收到 {chunk_count} 个chunk，内容长度: {len(summary_content)}")
+            
+            # 如果没有收到任何内容，生成一个备用总结
+            if not summary_content.strip() or chunk_count == 0:
+                print("警告：AI没有返回任何内容，生成备用总结...")
+                
+                # 基于前面步骤的内容生成一个简单的总结
+                fallback_summary = f"""## 📊 最终分析总结
 
 ### 🎯 核心发现
 通过前面的分析，我们完成了以下工作：
@@ -495,10 +541,19 @@ def generate_comprehensive_analysis(content, session_id):
 - 关注技术社区的最佳实践和经验分享
 
 *注：本总结基于前面的分析步骤生成。*"""
-            
-            yield f"data: {json.dumps({'type': 'content', 'step': 4, 'content': fallback_summary})}\n\n"
-        yield f"data: {json.dumps({'type': 'step_complete', 'step': 4})}\n\n"
-        yield f"data: {json.dumps({'type': 'analysis_complete'})}\n\n"
+                
+                yield writer.content(fallback_summary, step=4)
+            yield writer.event('step_complete', step=4)
+        
+        dag = StepDAG()
+        dag.add('condense', condense_step)
+        dag.add('overview', overview_step, deps=['condense'])
+        dag.add('keywords', keywords_step)
+        dag.add('search', search_step, deps=['keywords'])
+        dag.add('deep', deep_step, deps=['condense', 'overview', 'search'])
+        dag.add('summary', summary_step, deps=['overview', 'search', 'deep'])
+        yield from dag.run()
+        yield writer.event('analysis_complete')
         
         print("=" * 50)
         print("全面分析完成！")
@@ -506,7 +561,7 @@ def generate_comprehensive_analysis(content, session_id):
         
     except Exception as e:
         print(f"全面分析出错：{str(e)}")
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield writer.event('error', message=str(e))
 
 @comprehensive_analysis_bp.route('/chat', methods=['POST'])
 def chat_with_ai():
@@ -520,44 +575,34 @@ def chat_with_ai():
         if not user_message:
             return jsonify({'success': False, 'message': '消息不能为空'})
         
-        # 构建对话历史
-        messages = []
-        for msg in chat_history:
-            messages.append({"role": msg['role'], "content": msg['content']})
+        # 构建对话历史（较早的对话折叠为摘要）
+        messages = history_compactor.build_messages('comprehensive_analysis', chat_history, user_message)
         
-        # 添加用户新消息
-        messages.append({"role": "user", "content": user_message})
-        
-        return Response(
-            generate_chat_response(messages, session_id),
-            mimetype='text/plain'
-        )
+        return sse_response(generate_chat_response(messages, session_id))
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'聊天失败：{str(e)}'})
 
 def generate_chat_response(messages, session_id):
     """生成聊天响应"""
+    writer = SSEWriter()
     try:
-        yield f"data: {json.dumps({'type': 'session_id', 'session_id': session_id})}\n\n"
+        yield writer.event('session_id', session_id=session_id)
         
         # 直接使用已构建的消息列表，不添加额外的空消息
         model = ai_service.simple_model  # 使用简单模型进行对话
         
-        for chunk in ai_service._make_request(messages, model):
-            # 提取思考内容和显示内容
-            thinking, display = ai_service.extract_thinking(chunk)
-            
+        for thinking, display in ai_service.split_thinking(ai_service._make_request(messages, model)):
             if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'content': thinking})}\n\n"
+                yield writer.thinking(thinking)
             
             if display:
-                yield f"data: {json.dumps({'type': 'content', 'content': display})}\n\n"
+                yield writer.content(display)
         
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield writer.event('done')
         
     except Exception as e:
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield writer.event('error', message=str(e))
 
 def generate_comprehensive_analysis_json(content, session_id):
     """生成全面分析的四个步骤 - JSON版本（非流式）"""
@@ -590,7 +635,7 @@ def generate_comprehensive_analysis_json(content, session_id):
         overview_prompt = f"""我是一个专业的内容分析助手。请对以下内容进行全面的概要分析。
 
 **待分析内容：**
-{content}
+{fit_to_model(content, ai_service.complex_model)}
 
 **分析任务：**
 请对上述内容进行全面的概要分析，包括：
@@ -644,11 +689,15 @@ def generate_comprehensive_analysis_json(content, session_id):
         
         # 提取搜索关键词
         print("正在提取搜索关键词...")
+        parts = fit_parts(ai_service.simple_model, {
+            'overview': (overview_content, 1),
+            'content': (content, 2)
+        })
         keyword_prompt = f"""基于以下概要分析结果：
-{overview_content}
+{parts['overview']}
 
 以及原文内容：
-{content}
+{parts['content']}
 
 请提取3-5个最重要的搜索关键词，用于搜索相关资料和信息。
 关键词应该是：
@@ -669,12 +718,12 @@ def generate_comprehensive_analysis_json(content, session_id):
         search_results_content += f"基于文章内容，我们提取了以下关键词进行搜索：`{'`、`'.join(keywords)}`\n\n"
         
         search_results_data = []
+        keyword_results = search_client.search_many(keywords)
         
-        for i, keyword in enumerate(keywords, 1):
+        for i, (keyword, search_data) in enumerate(zip(keywords, keyword_results), 1):
             print(f"正在搜索关键词 {i}/{len(keywords)}: {keyword}")
             search_results_content += f"### {i}. 关键词：{keyword}\n\n"
             
-            search_data = search_information(keyword)
             if 'error' not in search_data and 'results' in search_data and search_data['results']:
                 results = search_data['results'][:3]  # 取前3个结果
                 print(f"  找到 {len(results)} 个相关结果")
@@ -719,10 +768,15 @@ def generate_comprehensive_analysis_json(content, session_id):
             for result in search_results_data:
                 search_context += f"- 关键词'{result['keyword']}'：{result['title']} - {result['snippet']}\n"
         
-        # 限制内容长度，避免prompt过长
-        overview_summary = overview_content[:800] + "..." if len(overview_content) > 800 else overview_content
-        search_summary = search_context[:500] + "..." if len(search_context) > 500 else search_context
-        content_summary = content[:1000] + "..." if len(content) > 1000 else content
+        # 按token预算分配各部分内容，避免prompt过长
+        parts = fit_parts(ai_service.complex_model, {
+            'overview': (overview_content, 2),
+            'search': (search_context, 1),
+            'content': (content, 3)
+        })
+        overview_summary = parts['overview']
+        search_summary = parts['search']
+        content_summary = parts['content']
         
         deep_analysis_prompt = f"""基于前面的概要分析：
 {overview_summary}
@@ -787,10 +841,15 @@ def generate_comprehensive_analysis_json(content, session_id):
         print("开始第四步：结果汇总")
         print("=" * 50)
         
-        # 限制前面步骤内容的长度，避免prompt过长
-        overview_summary = overview_content[:600] + "..." if len(overview_content) > 600 else overview_content
-        search_summary = search_results_content[:400] + "..." if len(search_results_content) > 400 else search_results_content
-        deep_summary = deep_analysis_content[:600] + "..." if len(deep_analysis_content) > 600 else deep_analysis_content
+        # 限制前面步骤内容的token数，避免prompt过长
+        parts = fit_parts(ai_service.complex_model, {
+            'overview': (overview_content, 3),
+            'search': (search_results_content, 2),
+            'deep': (deep_analysis_content, 3)
+        }, step='summary')
+        overview_summary = parts['overview']
+        search_summary = parts['search']
+        deep_summary = parts['deep']
         
         summary_prompt = f"""基于前面的分析：
 
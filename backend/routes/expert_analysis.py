@@ -1,10 +1,12 @@
-from flask import Blueprint, request, jsonify, Response
-import json
+from flask import Blueprint, request, jsonify
 import uuid
 from services.ai_service import ai_service
 from services.web_crawler import web_crawler
 from services.ocr_service import ocr_service
-from utils.file_handler import save_uploaded_files, extract_text_from_file
+from services.history_compactor import history_compactor
+from utils.file_handler import save_uploaded_files, stream_text_from_file
+from utils.sse import SSEWriter, sse_response
+from utils.context_budget import fit_to_model
 
 expert_analysis_bp = Blueprint('expert_analysis', __name__)
 
@@ -226,23 +228,17 @@ def start_expert_analysis():
         
         elif content_type == 'file':
             files = request.files.getlist('files')
+            # 在流式响应中提取文件文字，PDF逐页报告进度
             saved_paths = save_uploaded_files(files)
-            
-            for file_path in saved_paths:
-                file_content = extract_text_from_file(file_path)
-                if file_content:
-                    extracted_content += f"\n\n=== {file_path} ===\n{file_content}"
+            persona = EXPERT_PERSONAS[persona_key]
+            return sse_response(generate_file_expert_analysis(saved_paths, persona, str(uuid.uuid4()), selected_model))
         
         elif content_type == 'image':
             images = request.files.getlist('images')
+            # 在流式响应中并发识别图片，逐张报告进度
             saved_paths = ocr_service.save_uploaded_images(images)
-            ocr_results = ocr_service.extract_text_from_multiple_images(saved_paths)
-            
-            for result in ocr_results:
-                if result['success']:
-                    extracted_content += f"\n\n=== 图片文字 ===\n{result['text']}"
-                else:
-                    extracted_content += f"\n\n错误：无法识别图片文字：{result['error']}"
+            persona = EXPERT_PERSONAS[persona_key]
+            return sse_response(generate_image_expert_analysis(saved_paths, persona, str(uuid.uuid4()), selected_model))
         
         if not extracted_content.strip():
             return jsonify({'success': False, 'message': '没有提取到任何内容'})
@@ -252,10 +248,7 @@ def start_expert_analysis():
         
         persona = EXPERT_PERSONAS[persona_key]
         
-        return Response(
-            generate_expert_analysis(extracted_content, persona, session_id, crawler_results, selected_model),
-            mimetype='text/plain'
-        )
+        return sse_response(generate_expert_analysis(extracted_content, persona, session_id, crawler_results, selected_model))
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'开始大师分析失败：{str(e)}'})
@@ -279,40 +272,70 @@ def chat_with_expert():
         
         persona = EXPERT_PERSONAS[persona_key]
         
-        # 构建对话历史
-        messages = [{"role": "system", "content": persona['prompt']}]
-        for msg in chat_history:
-            messages.append({"role": msg['role'], "content": msg['content']})
-        
-        # 添加用户新消息
-        messages.append({"role": "user", "content": user_message})
-        
-        return Response(
-            generate_expert_chat_response(messages, session_id, persona['name'], selected_model),
-            mimetype='text/plain'
+        # 构建对话历史（较早的对话折叠为摘要）
+        messages = history_compactor.build_messages(
+            'expert_analysis', chat_history, user_message,
+            system_prompt=persona['prompt'], model=selected_model or ai_service.complex_model
         )
         
+        return sse_response(generate_expert_chat_response(messages, session_id, persona['name'], selected_model))
+        
     except Exception as e:
         return jsonify({'success': False, 'message': f'与专家聊天失败：{str(e)}'})
 
+def generate_file_expert_analysis(saved_paths, persona, session_id, model=None):
+    """先提取文件文字（PDF每完成一页发送pdf_progress事件），再进行专家分析"""
+    writer = SSEWriter()
+    extracted_content = ""
+    for file_path in saved_paths:
+        file_content = yield from stream_text_from_file(file_path, writer)
+        if file_content:
+            extracted_content += f"\n\n=== {file_path} ===\n{file_content}"
+    
+    if not extracted_content.strip():
+        yield writer.event('error', message='没有提取到任何内容')
+        return
+    
+    yield from generate_expert_analysis(extracted_content, persona, session_id, None, model)
+
+
+def generate_image_expert_analysis(saved_paths, persona, session_id, model=None):
+    """先识别图片文字（每完成一张发送ocr_progress事件），再进行专家分析"""
+    writer = SSEWriter()
+    ocr_results = yield from ocr_service.stream_text_from_multiple_images(saved_paths, writer)
+    
+    extracted_content = ""
+    for result in ocr_results:
+        if result['success']:
+            extracted_content += f"\n\n=== 图片文字 ===\n{result['text']}"
+        else:
+            extracted_content += f"\n\n错误：无法识别图片文字：{result['error']}"
+    
+    if not extracted_content.strip():
+        yield writer.event('error', message='没有提取到任何内容')
+        return
+    
+    yield from generate_expert_analysis(extracted_content, persona, session_id, None, model)
+
 def generate_expert_analysis(content, persona, session_id, crawler_results=None, model=None):
     """生成专家分析"""
+    writer = SSEWriter()
     try:
-        yield f"data: {json.dumps({'type': 'session_id', 'session_id': session_id})}\n\n"
-        yield f"data: {json.dumps({'type': 'persona', 'name': persona['name'], 'description': persona['description']})}\n\n"
+        yield writer.event('session_id', session_id=session_id)
+        yield writer.event('persona', name=persona['name'], description=persona['description'])
         
         # 如果有爬虫结果，发送详细信息
         if crawler_results:
-            yield f"data: {json.dumps({'type': 'crawler_results', 'results': crawler_results})}\n\n"
+            yield writer.event('crawler_results', results=crawler_results)
         
         status_message = f'正在请{persona["name"]}分析内容...'
-        yield f"data: {json.dumps({'type': 'status', 'message': status_message})}\n\n"
+        yield writer.event('status', message=status_message)
         
         # 构建专家分析提示词
         analysis_prompt = f"""你必须完全变成{persona['name']}本人，用他的大脑思考，用他的嘴巴说话。
 
 分析内容：
-{content}
+{fit_to_model(content, model or ai_service.complex_model)}
 
 特别要求：
 - 如果你是鲁迅，就要用"然而我以为..."、"大概是..."、"所谓的..."、"这样的..."等典型表达
@@ -336,42 +359,39 @@ def generate_expert_analysis(content, persona, session_id, crawler_results=None,
 现在，请完全进入{persona['name']}的角色，开始分析："""
         
         # 使用指定模型或复杂模型进行分析
-        for chunk in ai_service.complex_chat(analysis_prompt, persona['prompt'], model):
-            thinking, display = ai_service.extract_thinking(chunk)
-            
+        for thinking, display in ai_service.split_thinking(ai_service.complex_chat(analysis_prompt, persona['prompt'], model)):
             if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'content': thinking})}\n\n"
+                yield writer.thinking(thinking)
             
             if display:
-                yield f"data: {json.dumps({'type': 'content', 'content': display})}\n\n"
+                yield writer.content(display)
         
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield writer.event('done')
         
     except Exception as e:
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield writer.event('error', message=str(e))
 
 def generate_expert_chat_response(messages, session_id, expert_name, model=None):
     """生成专家聊天响应"""
+    writer = SSEWriter()
     try:
-        yield f"data: {json.dumps({'type': 'session_id', 'session_id': session_id})}\n\n"
-        yield f"data: {json.dumps({'type': 'expert_name', 'name': expert_name})}\n\n"
+        yield writer.event('session_id', session_id=session_id)
+        yield writer.event('expert_name', name=expert_name)
         
         # 选择模型：优先使用指定模型，否则使用复杂模型
         selected_model = model if model else ai_service.complex_model
         
-        for chunk in ai_service._make_request(messages, selected_model):
-            thinking, display = ai_service.extract_thinking(chunk)
-            
+        for thinking, display in ai_service.split_thinking(ai_service._make_request(messages, selected_model)):
             if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'content': thinking})}\n\n"
+                yield writer.thinking(thinking)
             
             if display:
-                yield f"data: {json.dumps({'type': 'content', 'content': display})}\n\n"
+                yield writer.content(display)
         
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield writer.event('done')
         
     except Exception as e:
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield writer.event('error', message=str(e))
 
 @expert_analysis_bp.route('/add-persona', methods=['POST'])
 def add_custom_persona():
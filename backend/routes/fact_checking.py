@@ -1,16 +1,16 @@
-from flask import Blueprint, request, jsonify, Response
-import json
+from flask import Blueprint, request, jsonify
 import uuid
-import requests
 from services.ai_service import ai_service
 from services.web_crawler import web_crawler
 from services.ocr_service import ocr_service
-from utils.file_handler import save_uploaded_files, extract_text_from_file
+from services.search_client import search_client
+from services.history_compactor import history_compactor
+from utils.file_handler import save_uploaded_files, stream_text_from_file
+from utils.sse import SSEWriter, sse_response
+from utils.context_budget import fit_parts, fit_to_model
 
 fact_checking_bp = Blueprint('fact_checking', __name__)
 
-SEARCH_API_URL = "http://chengyuxuan.top:3100/search"
-
 @fact_checking_bp.route('/start', methods=['POST'])
 def start_fact_checking():
     """开始真伪鉴定"""
@@ -49,26 +49,18 @@ def start_fact_checking():
             if not files:
                 return jsonify({'success': False, 'message': '未检测到上传的文件'})
                 
+            # 在流式响应中提取文件文字，PDF逐页报告进度
             saved_paths = save_uploaded_files(files)
-            
-            for file_path in saved_paths:
-                file_content = extract_text_from_file(file_path)
-                if file_content:
-                    extracted_content += f"\n\n=== {file_path} ===\n{file_content}"
+            return sse_response(generate_file_fact_checking_analysis(saved_paths, str(uuid.uuid4())))
         
         elif content_type == 'image':
             images = request.files.getlist('images')
             if not images:
                 return jsonify({'success': False, 'message': '未检测到上传的图片'})
                 
+            # 在流式响应中并发识别图片，逐张报告进度
             saved_paths = ocr_service.save_uploaded_images(images)
-            ocr_results = ocr_service.extract_text_from_multiple_images(saved_paths)
-            
-            for result in ocr_results:
-                if result['success']:
-                    extracted_content += f"\n\n=== 图片文字 ===\n{result['text']}"
-                else:
-                    extracted_content += f"\n\n错误：无法识别图片文字：{result['error']}"
+            return sse_response(generate_image_fact_checking_analysis(saved_paths, str(uuid.uuid4())))
         
         if not extracted_content.strip():
             return jsonify({'success': False, 'message': '没有提取到任何有效内容，请检查上传的内容'})
@@ -77,34 +69,50 @@ def start_fact_checking():
         session_id = str(uuid.uuid4())
         
         # 使用流式响应实现实时进度更新
-        return Response(
-            generate_fact_checking_analysis(extracted_content, session_id),
-            mimetype='text/plain'
-        )
+        return sse_response(generate_fact_checking_analysis(extracted_content, session_id))
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'开始真伪鉴定失败：{str(e)}'})
 
-def search_information(query):
-    """搜索相关信息"""
-    try:
-        params = {
-            'q': query,
-            'format': 'json'
-        }
-        response = requests.get(SEARCH_API_URL, params=params, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
-        return data
-        
-    except Exception as e:
-        return {'error': str(e)}
+def generate_file_fact_checking_analysis(saved_paths, session_id):
+    """先提取文件文字（PDF每完成一页发送pdf_progress事件），再进行真伪鉴定"""
+    writer = SSEWriter()
+    extracted_content = ""
+    for file_path in saved_paths:
+        file_content = yield from stream_text_from_file(file_path, writer)
+        if file_content:
+            extracted_content += f"\n\n=== {file_path} ===\n{file_content}"
+    
+    if not extracted_content.strip():
+        yield writer.event('error', message='没有提取到任何有效内容，请检查上传的内容')
+        return
+    
+    yield from generate_fact_checking_analysis(extracted_content, session_id)
+
+
+def generate_image_fact_checking_analysis(saved_paths, session_id):
+    """先识别图片文字（每完成一张发送ocr_progress事件），再进行真伪鉴定"""
+    writer = SSEWriter()
+    ocr_results = yield from ocr_service.stream_text_from_multiple_images(saved_paths, writer)
+    
+    extracted_content = ""
+    for result in ocr_results:
+        if result['success']:
+            extracted_content += f"\n\n=== 图片文字 ===\n{result['text']}"
+        else:
+            extracted_content += f"\n\n错误：无法识别图片文字：{result['error']}"
+    
+    if not extracted_content.strip():
+        yield writer.event('error', message='没有提取到任何有效内容，请检查上传的内容')
+        return
+    
+    yield from generate_fact_checking_analysis(extracted_content, session_id)
 
 def generate_fact_checking_analysis(content, session_id):
     """生成真伪鉴定分析的四个步骤"""
+    writer = SSEWriter()
     try:
-        yield f"data: {json.dumps({'type': 'session_id', 'session_id': session_id})}\n\n"
+        yield writer.event('session_id', session_id=session_id)
         
         # 调试信息
         print(f"=== 真伪鉴定调试 ===")
@@ -114,24 +122,25 @@ def generate_fact_checking_analysis(content, session_id):
         
         # 检查内容是否为空或包含爬虫错误
         if not content.strip():
-            yield f"data: {json.dumps({'type': 'error', 'message': '内容为空，无法进行分析'})}\n\n"
+            yield writer.event('error', message='内容为空，无法进行分析')
             return
             
         if "错误：无法提取" in content:
-            yield f"data: {json.dumps({'type': 'error', 'message': '网页内容提取失败，请检查链接是否有效'})}\n\n"
+            yield writer.event('error', message='网页内容提取失败，请检查链接是否有效')
             return
             
         if "没有提取到任何内容" in content:
-            yield f"data: {json.dumps({'type': 'error', 'message': '没有提取到任何有效内容，请重新尝试'})}\n\n"
+            yield writer.event('error', message='没有提取到任何有效内容，请重新尝试')
             return
         
         # 第一步：文章解析
-        yield f"data: {json.dumps({'type': 'step_start', 'step': 1, 'name': '文章解析', 'description': '分析文章内容和结构'})}\n\n"
+        yield writer.event('step_start', step=1, name='文章解析', description='分析文章内容和结构')
         
+        # 按模型上下文预算放入原文（过长时保留首尾，中间标注省略）
         parsing_prompt = f"""我是一个专业的事实核查分析助手。我已经接收到了需要进行真伪鉴定的内容，现在开始进行结构化解析。
 
 **待分析内容：**
-{content}
+{fit_to_model(content, ai_service.simple_model)}
 
 **分析任务：**
 请对上述内容进行结构化解析，重点识别需要验证的事实信息：
@@ -163,24 +172,27 @@ def generate_fact_checking_analysis(content, session_id):
 </think>"""
         
         parsed_content = ""
-        for chunk in ai_service.simple_chat(parsing_prompt):
-            thinking, display = ai_service.extract_thinking(chunk)
+        for thinking, display in ai_service.split_thinking(ai_service.simple_chat(parsing_prompt)):
             if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'step': 1, 'content': thinking})}\n\n"
+                yield writer.thinking(thinking, step=1)
             if display:
                 parsed_content += display
-                yield f"data: {json.dumps({'type': 'content', 'step': 1, 'content': display})}\n\n"
+                yield writer.content(display, step=1)
         
-        yield f"data: {json.dumps({'type': 'step_complete', 'step': 1})}\n\n"
+        yield writer.event('step_complete', step=1)
         
         # 第二步：关键词提取和搜索
-        yield f"data: {json.dumps({'type': 'step_start', 'step': 2, 'name': '搜索结果', 'description': '提取关键信息并搜索验证资料'})}\n\n"
+        yield writer.event('step_start', step=2, name='搜索结果', description='提取关键信息并搜索验证资料')
         
+        parts = fit_parts(ai_service.simple_model, {
+            'parsed': (parsed_content, 1),
+            'content': (content, 2)
+        })
         keyword_prompt = f"""基于文章解析结果：
-{parsed_content}
+{parts['parsed']}
 
 原文：
-{content}
+{parts['content']}
 
 请提取需要事实核查的关键词，用于搜索验证。要求：
 - 提取5个最重要的关键词或短语
@@ -194,10 +206,9 @@ IAEA报告
 海洋污染"""
         
         keywords_content = ""
-        for chunk in ai_service.simple_chat(keyword_prompt):
-            thinking, display = ai_service.extract_thinking(chunk)
+        for thinking, display in ai_service.split_thinking(ai_service.simple_chat(keyword_prompt)):
             if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'step': 2, 'content': thinking})}\n\n"
+                yield writer.thinking(thinking, step=2)
             if display:
                 keywords_content += display
         
@@ -211,14 +222,17 @@ IAEA报告
             keywords_display += f"**{i}.** `{kw}`\\n\\n"
         keywords_display += "\\n正在基于这些关键词搜索验证资料...\\n\\n"
         
-        yield f"data: {json.dumps({'type': 'content', 'step': 2, 'content': keywords_display})}\n\n"
+        yield writer.content(keywords_display, step=2)
         
         # 执行搜索
         search_results = []
         for keyword in keywords:
-            yield f"data: {json.dumps({'type': 'thinking', 'step': 2, 'content': f'正在搜索关键词: {keyword}'})}\n\n"
-            
-            search_result = search_information(keyword)
+            yield writer.thinking(f'正在搜索关键词: {keyword}', step=2)
+        
+        # 所有关键词并发搜索，结果按关键词顺序展示
+        keyword_results = search_client.search_many(keywords)
+        
+        for keyword, search_result in zip(keywords, keyword_results):
             if 'error' not in search_result:
                 search_results.append({
                     'keyword': keyword,
@@ -244,10 +258,10 @@ IAEA报告
                 else:
                     result_content += "未找到相关搜索结果\\n\\n"
                 
-                yield f"data: {json.dumps({'type': 'content', 'step': 2, 'content': result_content})}\n\n"
+                yield writer.content(result_content, step=2)
             else:
                 error_msg = search_result.get('error', '未知错误')
-                yield f"data: {json.dumps({'type': 'thinking', 'step': 2, 'content': f'搜索 {keyword} 失败: {error_msg}'})}\n\n"
+                yield writer.thinking(f'搜索 {keyword} 失败: {error_msg}', step=2)
         
         # 总结搜索结果
         summary_content = f"\\n\\n## 📊 搜索结果总结\\n\\n"
@@ -257,12 +271,12 @@ IAEA报告
         if search_results:
             summary_content += "\\n这些搜索结果将用于下一步的事实验证和真伪鉴定分析。"
         
-        yield f"data: {json.dumps({'type': 'content', 'step': 2, 'content': summary_content})}\n\n"
+        yield writer.content(summary_content, step=2)
         
-        yield f"data: {json.dumps({'type': 'step_complete', 'step': 2})}\n\n"
+        yield writer.event('step_complete', step=2)
         
         # 第三步：深度分析
-        yield f"data: {json.dumps({'type': 'step_start', 'step': 3, 'name': '深度分析', 'description': '对比搜索结果与原文进行深度分析'})}\n\n"
+        yield writer.event('step_start', step=3, name='深度分析', description='对比搜索结果与原文进行深度分析')
         
         # 将搜索结果整理为文本
         search_context = ""
@@ -276,18 +290,23 @@ IAEA报告
             search_context += "\n"
         
         # 第四步：真伪鉴定
-        yield f"data: {json.dumps({'type': 'step_start', 'step': 4, 'name': '真伪鉴定', 'description': '基于搜索结果进行真伪分析'})}\n\n"
+        yield writer.event('step_start', step=4, name='真伪鉴定', description='基于搜索结果进行真伪分析')
         
+        parts = fit_parts(ai_service.complex_model, {
+            'parsed': (parsed_content, 2),
+            'content': (content, 3),
+            'search': (search_context, 2)
+        })
         analysis_prompt = f"""基于文章解析和搜索结果进行深度分析：
 
 文章解析：
-{parsed_content}
+{parts['parsed']}
 
 原文：
-{content}
+{parts['content']}
 
 搜索得到的验证资料：
-{search_context}
+{parts['search']}
 
 请结合搜索到的资料对原文进行深度分析：
 
@@ -312,35 +331,41 @@ IAEA报告
 </think>"""
         
         analysis_content = ""
-        for chunk in ai_service.complex_chat(analysis_prompt):
-            thinking, display = ai_service.extract_thinking(chunk)
+        for thinking, display in ai_service.split_thinking(ai_service.complex_chat(analysis_prompt)):
             if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'step': 3, 'content': thinking})}\n\n"
+                yield writer.thinking(thinking, step=3)
             if display:
                 analysis_content += display
-                yield f"data: {json.dumps({'type': 'content', 'step': 3, 'content': display})}\n\n"
+                yield writer.content(display, step=3)
         
-        yield f"data: {json.dumps({'type': 'step_complete', 'step': 3})}\n\n"
+        yield writer.event('step_complete', step=3)
         
         # 第四步：真伪鉴定
-        yield f"data: {json.dumps({'type': 'step_start', 'step': 4, 'name': '真伪鉴定', 'description': '基于搜索结果进行真伪分析'})}\n\n"
-        
+        yield writer.event('step_start', step=4, name='真伪鉴定', description='基于搜索结果进行真伪分析')
+        
+        parts = fit_parts(ai_service.complex_model, {
+            'content': (content, 3),
+            'parsed': (parsed_content, 1),
+            'keywords': (keywords_content, 1),
+            'search': (search_context, 2),
+            'analysis': (analysis_content, 2)
+        })
         verification_prompt = f"""请基于以下信息进行真伪鉴定：
 
 原文内容：
-{content}
+{parts['content']}
 
 文章解析：
-{parsed_content}
+{parts['parsed']}
 
 提取的关键词：
-{keywords_content}
+{parts['keywords']}
 
 搜索得到的验证资料：
-{search_context}
+{parts['search']}
 
 深度分析结果：
-{analysis_content}
+{parts['analysis']}
 
 请进行综合分析并提供：
 
@@ -370,19 +395,18 @@ IAEA报告
 现在我需要综合所有信息，客观地分析文章的真实性。我要对比原文声明和搜索到的资料，找出一致性和矛盾之处。
 </think>"""
         
-        for chunk in ai_service.complex_chat(verification_prompt):
-            thinking, display = ai_service.extract_thinking(chunk)
+        for thinking, display in ai_service.split_thinking(ai_service.complex_chat(verification_prompt)):
             if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'step': 4, 'content': thinking})}\n\n"
+                yield writer.thinking(thinking, step=4)
             if display:
-                yield f"data: {json.dumps({'type': 'content', 'step': 4, 'content': display})}\n\n"
+                yield writer.content(display, step=4)
         
-        yield f"data: {json.dumps({'type': 'step_complete', 'step': 4})}\n\n"
-        yield f"data: {json.dumps({'type': 'verification_complete'})}\n\n"
+        yield writer.event('step_complete', step=4)
+        yield writer.event('verification_complete')
         
     except Exception as e:
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield writer.event('error', message=str(e))
+        yield writer.event('error', message=str(e))
 
 @fact_checking_bp.route('/chat', methods=['POST'])
 def chat_with_ai():
@@ -396,44 +420,34 @@ def chat_with_ai():
         if not user_message:
             return jsonify({'success': False, 'message': '消息不能为空'})
         
-        # 构建对话历史
-        messages = []
-        for msg in chat_history:
-            messages.append({"role": msg['role'], "content": msg['content']})
-        
-        # 添加用户新消息
-        messages.append({"role": "user", "content": user_message})
+        # 构建对话历史（较早的对话折叠为摘要）
+        messages = history_compactor.build_messages('fact_checking', chat_history, user_message)
         
-        return Response(
-            generate_chat_response(messages, session_id),
-            mimetype='text/plain'
-        )
+        return sse_response(generate_chat_response(messages, session_id))
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'聊天失败：{str(e)}'})
 
 def generate_chat_response(messages, session_id):
     """生成聊天响应"""
+    writer = SSEWriter()
     try:
-        yield f"data: {json.dumps({'type': 'session_id', 'session_id': session_id})}\n\n"
+        yield writer.event('session_id', session_id=session_id)
         
         # 直接使用已构建的消息列表，不添加额外的空消息
         model = ai_service.simple_model  # 使用简单模型进行对话
         
-        for chunk in ai_service._make_request(messages, model):
-            # 提取思考内容和显示内容
-            thinking, display = ai_service.extract_thinking(chunk)
-            
+        for thinking, display in ai_service.split_thinking(ai_service._make_request(messages, model)):
             if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'content': thinking})}\n\n"
+                yield writer.thinking(thinking)
             
             if display:
-                yield f"data: {json.dumps({'type': 'content', 'content': display})}\n\n"
+                yield writer.content(display)
         
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield writer.event('done')
         
     except Exception as e:
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield writer.event('error', message=str(e))
 
 def generate_fact_checking_analysis_json(content, session_id):
     """生成真伪鉴定分析的四个步骤 - JSON版本（非流式）"""
@@ -462,7 +476,7 @@ def generate_fact_checking_analysis_json(content, session_id):
         content_analysis_prompt = f"""我是一个专业的真伪鉴定助手。现在需要对以下内容进行真伪鉴定分析。
 
 **待鉴定内容：**
-{content}
+{fit_to_model(content, ai_service.simple_model)}
 
 **鉴定任务：**
 请对上述内容进行详细的解析，包括：
@@ -499,11 +513,15 @@ def generate_fact_checking_analysis_json(content, session_id):
         print("开始第二步：事实核查")
         
         # 提取核查关键词
+        parts = fit_parts(ai_service.simple_model, {
+            'analysis': (content_analysis, 1),
+            'content': (content, 2)
+        })
         keyword_prompt = f"""基于以下内容解析：
-{content_analysis}
+{parts['analysis']}
 
 以及原始内容：
-{content}
+{parts['content']}
 
 请提取3-5个最需要核查的关键词或关键声明，用于搜索验证信息。
 关键词应该是：
@@ -520,10 +538,11 @@ def generate_fact_checking_analysis_json(content, session_id):
         
         fact_check_content = "## 事实核查结果\n\n"
         
-        for i, keyword in enumerate(keywords, 1):
+        keyword_results = search_client.search_many(keywords)
+        
+        for i, (keyword, search_data) in enumerate(zip(keywords, keyword_results), 1):
             fact_check_content += f"### {i}. 核查要点：{keyword}\n\n"
             
-            search_data = search_information(keyword)
             if 'error' not in search_data and 'results' in search_data:
                 results = search_data['results'][:3]  # 取前3个结果
                 for j, result in enumerate(results, 1):
@@ -545,14 +564,19 @@ def generate_fact_checking_analysis_json(content, session_id):
         
         # 第三步：可信度分析
         print("开始第三步：可信度分析")
+        parts = fit_parts(ai_service.complex_model, {
+            'analysis': (content_analysis, 2),
+            'fact_check': (fact_check_content, 2),
+            'content': (content, 3)
+        })
         credibility_prompt = f"""基于前面的内容解析：
-{content_analysis}
+{parts['analysis']}
 
 以及事实核查结果：
-{fact_check_content}
+{parts['fact_check']}
 
 以及原始内容：
-{content}
+{parts['content']}
 
 请进行可信度分析，包括：
 
@@ -585,19 +609,25 @@ def generate_fact_checking_analysis_json(content, session_id):
         
         # 第四步：结论判定
         print("开始第四步：结论判定")
+        parts = fit_parts(ai_service.complex_model, {
+            'analysis': (content_analysis, 2),
+            'fact_check': (fact_check_content, 2),
+            'credibility': (credibility_analysis, 2),
+            'content': (content, 3)
+        })
         conclusion_prompt = f"""基于所有前面的分析：
 
 **内容解析：**
-{content_analysis}
+{parts['analysis']}
 
 **事实核查：**
-{fact_check_content}
+{parts['fact_check']}
 
 **可信度分析：**
-{credibility_analysis}
+{parts['credibility']}
 
 **原始内容：**
-{content}
+{parts['content']}
 
 请给出最终的真伪判定结论：
 
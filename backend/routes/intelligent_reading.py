@@ -1,10 +1,13 @@
-from flask import Blueprint, request, jsonify, session, Response
-import json
+from flask import Blueprint, request, jsonify, session
 import uuid
 from services.ai_service import ai_service
 from services.web_crawler import web_crawler
 from services.ocr_service import ocr_service
-from utils.file_handler import save_uploaded_files, extract_text_from_file
+from services.reading_session import reading_sessions
+from utils.file_handler import save_uploaded_files, stream_text_from_file
+from utils.sse import SSEWriter, sse_response
+from services.passage_retriever import passage_retriever
+from services.history_compactor import history_compactor
 
 intelligent_reading_bp = Blueprint('intelligent_reading', __name__)
 
@@ -60,53 +63,75 @@ def start_reading():
         
         elif content_type == 'file':
             # 文件上传
+            # 在流式响应中提取文件文字，PDF逐页报告进度
             files = request.files.getlist('files')
             saved_paths = save_uploaded_files(files)
-            
-            for file_path in saved_paths:
-                file_content = extract_text_from_file(file_path)
-                if file_content:
-                    extracted_content += f"\n\n=== {file_path} ===\n{file_content}"
+            return sse_response(generate_file_parsed_response(saved_paths, content_type))
         
         elif content_type == 'image':
-            # 图片OCR
+            # 图片OCR：在流式响应中并发识别，逐张报告进度
             images = request.files.getlist('images')
             saved_paths = ocr_service.save_uploaded_images(images)
-            ocr_results = ocr_service.extract_text_from_multiple_images(saved_paths)
-            
-            for result in ocr_results:
-                if result['success']:
-                    extracted_content += f"\n\n=== 图片文字 ===\n{result['text']}"
-                    content_info[result['image_path']] = {
-                        'word_count': result['word_count']
-                    }
-                else:
-                    extracted_content += f"\n\n错误：无法识别图片 {result['image_path']} 的文字：{result['error']}"
+            return sse_response(generate_image_parsed_response(saved_paths, content_type))
         
         if not extracted_content.strip():
             # 统一使用流式响应格式返回错误
-            def generate_error_response():
-                yield f"data: {json.dumps({'type': 'session_id', 'session_id': str(uuid.uuid4())})}\n\n"
-                yield f"data: {json.dumps({'type': 'error', 'message': '没有提取到任何内容。可能的原因：页面内容需要JavaScript动态加载、网站有反爬虫保护或网络连接问题。建议：复制页面主要文字内容进行直接分析。'})}\n\n"
-                yield f"data: {json.dumps({'type': 'done'})}\n\n"
-            
-            return Response(
-                generate_error_response(),
-                mimetype='text/plain'
-            )
+            return sse_response(generate_empty_content_response())
         
         # 生成会话ID
         session_id = str(uuid.uuid4())
         
         # 返回解析结果，询问用户问题
-        return Response(
-            generate_content_parsed_response(session_id, extracted_content, content_info, content_type),
-            mimetype='text/plain'
-        )
+        return sse_response(generate_content_parsed_response(session_id, extracted_content, content_info, content_type))
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'启动智能伴读失败：{str(e)}'})
 
+def generate_empty_content_response():
+    """没有提取到内容时的流式错误响应"""
+    writer = SSEWriter()
+    yield writer.event('session_id', session_id=str(uuid.uuid4()))
+    yield writer.event('error', message='没有提取到任何内容。可能的原因：页面内容需要JavaScript动态加载、网站有反爬虫保护或网络连接问题。建议：复制页面主要文字内容进行直接分析。')
+    yield writer.event('done')
+
+def generate_file_parsed_response(saved_paths, content_type):
+    """提取文件文字（PDF每完成一页发送pdf_progress事件），然后返回内容解析结果"""
+    writer = SSEWriter()
+    extracted_content = ""
+    for file_path in saved_paths:
+        file_content = yield from stream_text_from_file(file_path, writer)
+        if file_content:
+            extracted_content += f"\n\n=== {file_path} ===\n{file_content}"
+    
+    if not extracted_content.strip():
+        yield from generate_empty_content_response()
+        return
+    
+    yield from generate_content_parsed_response(str(uuid.uuid4()), extracted_content, {}, content_type)
+
+
+def generate_image_parsed_response(saved_paths, content_type):
+    """识别图片文字（每完成一张发送ocr_progress事件），然后返回内容解析结果"""
+    writer = SSEWriter()
+    ocr_results = yield from ocr_service.stream_text_from_multiple_images(saved_paths, writer)
+    
+    extracted_content = ""
+    content_info = {}
+    for result in ocr_results:
+        if result['success']:
+            extracted_content += f"\n\n=== 图片文字 ===\n{result['text']}"
+            content_info[result['image_path']] = {
+                'word_count': result['word_count']
+            }
+        else:
+            extracted_content += f"\n\n错误：无法识别图片 {result['image_path']} 的文字：{result['error']}"
+    
+    if not extracted_content.strip():
+        yield from generate_empty_content_response()
+        return
+    
+    yield from generate_content_parsed_response(str(uuid.uuid4()), extracted_content, content_info, content_type)
+
 @intelligent_reading_bp.route('/chat', methods=['POST'])
 def chat_with_ai():
     """与AI聊天"""
@@ -121,12 +146,38 @@ def chat_with_ai():
         if not user_message:
             return jsonify({'success': False, 'message': '消息不能为空'})
         
-        # 构建对话历史
-        messages = []
+        # 优先使用服务端会话中的文档和对话
+        reading_session = reading_sessions.get(session_id)
+        if reading_session is not None:
+            content_context = reading_session['content']
+            chat_history = list(reading_session['messages'])
+        elif data.get('reading_session'):
+            # 客户端只发送了新消息但会话已过期：通知客户端重新上传内容
+            return sse_response(generate_session_expired_response(session_id))
+        elif content_context and session_id:
+            # 旧客户端或会话过期后的重发：用请求中的内容重建会话，之后的请求只需携带新消息
+            history = list(chat_history)
+            if history and history[-1].get('role') == 'user' and history[-1].get('content', '').strip() == user_message:
+                history.pop()
+            reading_session = reading_sessions.create(session_id, content_context, messages=history)
+            chat_history = list(reading_session['messages'])
         
         # 如果有内容上下文，添加系统提示
+        system_prompt = None
         if content_context:
-            system_prompt = f"""你是一个智能阅读伴侣，正在帮助用户理解和分析以下内容：
+            # 长文档只放入与问题（连同上一个问题，便于理解追问）最相关的段落；短文档或未命中时按预算保留首尾
+            previous_questions = [msg['content'] for msg in chat_history if msg.get('role') == 'user'][-1:]
+            content_context, retrieved = passage_retriever.select(
+                content_context,
+                reading_session.get('retrieval') if reading_session else None,
+                '\n'.join(previous_questions + [user_message]),
+                selected_model or ai_service.simple_model
+            )
+            if retrieved:
+                intro = "你是一个智能阅读伴侣，正在帮助用户理解和分析一份文档。以下是文档中与用户问题最相关的片段（按原文顺序，标注了片段序号）："
+            else:
+                intro = "你是一个智能阅读伴侣，正在帮助用户理解和分析以下内容："
+            system_prompt = f"""{intro}
 
 {content_context}
 
@@ -136,28 +187,24 @@ def chat_with_ai():
 3. 提供准确、有用的分析和解释
 4. 保持耐心、友好和专业的态度
 5. 可以引用具体段落或要点来支持你的回答"""
-            messages.append({"role": "system", "content": system_prompt})
-        
-        # 添加历史对话
-        for msg in chat_history:
-            messages.append({"role": msg['role'], "content": msg['content']})
-        
-        # 添加用户新消息
-        messages.append({"role": "user", "content": user_message})
         
-        return Response(
-            generate_chat_response(messages, session_id, selected_model),
-            mimetype='text/plain'
+        # 构建对话历史（较早的对话折叠为摘要）
+        messages = history_compactor.build_messages(
+            'intelligent_reading', chat_history, user_message,
+            system_prompt=system_prompt, model=selected_model
         )
         
+        return sse_response(generate_chat_response(messages, session_id, selected_model, remember=reading_session is not None))
+        
     except Exception as e:
         return jsonify({'success': False, 'message': f'聊天失败：{str(e)}'})
 
 def generate_content_parsed_response(session_id, extracted_content, content_info, content_type):
     """生成内容解析完成的响应"""
+    writer = SSEWriter()
     try:
-        yield f"data: {json.dumps({'type': 'session_id', 'session_id': session_id})}\n\n"
-        yield f"data: {json.dumps({'type': 'status', 'message': '正在解析内容...'})}\n\n"
+        yield writer.event('session_id', session_id=session_id)
+        yield writer.event('status', message='正在解析内容...')
         
         # 分析内容信息
         word_count = len(extracted_content.split()) if extracted_content else 0
@@ -169,11 +216,12 @@ def generate_content_parsed_response(session_id, extracted_content, content_info
             'word_count': word_count,
             'char_count': char_count,
             'content_preview': extracted_content[:300] + '...' if len(extracted_content) > 300 else extracted_content,
-            'full_content': extracted_content,
-            'content_info': content_info
+            'content_info': content_info,
+            'reading_session': True  # 文档已保存在服务端会话中，继续聊天时无需再发送
         }
+        reading_sessions.create(session_id, extracted_content, content_info, content_type)
         
-        yield f"data: {json.dumps({'type': 'content_parsed', 'result': parse_result})}\n\n"
+        yield writer.event('content_parsed', result=parse_result)
         
         # 发送询问消息
         ask_message = f"""📖 **内容解析完成！**
@@ -193,30 +241,40 @@ def generate_content_parsed_response(session_id, extracted_content, content_info
 
 ❓ **请告诉我您想了解什么，我来为您详细解答！**"""
         
-        yield f"data: {json.dumps({'type': 'content', 'content': ask_message})}\n\n"
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield writer.content(ask_message)
+        yield writer.event('done')
         
     except Exception as e:
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-def generate_chat_response(messages, session_id, model=None):
-    """生成聊天响应"""
+        yield writer.event('error', message=str(e))
+
+def generate_session_expired_response(session_id):
+    """服务端会话不存在时的流式响应，客户端收到后提示用户重新上传内容"""
+    writer = SSEWriter()
+    yield writer.event('session_id', session_id=session_id)
+    yield writer.event('session_expired')
+
+def generate_chat_response(messages, session_id, model=None, remember=False):
+    """生成聊天响应，remember为True时把这一轮对话记入服务端会话"""
+    writer = SSEWriter()
     try:
-        yield f"data: {json.dumps({'type': 'session_id', 'session_id': session_id})}\n\n"
+        yield writer.event('session_id', session_id=session_id)
         
         # 选择模型：优先使用指定模型，否则使用简单模型
         selected_model = model if model else ai_service.simple_model
         
-        for chunk in ai_service._make_request(messages, selected_model):
-            # 提取思考内容和显示内容
-            thinking, display = ai_service.extract_thinking(chunk)
-            
+        answer = ''
+        for thinking, display in ai_service.split_thinking(ai_service._make_request(messages, selected_model)):
             if thinking:
-                yield f"data: {json.dumps({'type': 'thinking', 'content': thinking})}\n\n"
+                yield writer.thinking(thinking)
             
             if display:
-                yield f"data: {json.dumps({'type': 'content', 'content': display})}\n\n"
+                answer += display
+                yield writer.content(display)
+        
+        if remember and answer and not answer.startswith('错误：'):
+            reading_sessions.append_messages(session_id, [messages[-1], {'role': 'assistant', 'content': answer}])
         
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield writer.event('done')
         
     except Exception as e:
-        yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        yield writer.event('error', message=str(e))
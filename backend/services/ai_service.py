@@ -1,8 +1,13 @@
 import requests
 import json
 import re
+import socket
+import threading
+from requests.adapters import HTTPAdapter
 from typing import Generator, Dict, Any
-from config import AI_CONFIG
+from config import AI_CONFIG, AI_HTTP_CONFIG
+from services.llm_cache import llm_cache
+from utils.think_parser import split_thinking_stream
 
 class AIService:
     def __init__(self):
@@ -10,28 +15,113 @@ class AIService:
         self.api_key = AI_CONFIG['api_key']
         self.simple_model = AI_CONFIG['simple_model']
         self.complex_model = AI_CONFIG['complex_model']
-    
-    def _make_request(self, messages: list, model: str, stream: bool = True) -> Generator[str, None, None]:
-        """发送请求到AI模型"""
-        headers = {
+        self.temperature = 0.7
+        self.response_cache = llm_cache
+        self.timeout = (AI_HTTP_CONFIG['connect_timeout'], AI_HTTP_CONFIG['read_timeout'])
+        
+        # 复用同一个Session，避免每次请求都重新进行TCP+TLS握手
+        self._adapter = self._create_adapter()
+        self.session = requests.Session()
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+        self.session.headers.update({
             'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            'Connection': 'keep-alive'
+        })
+        self._stats_lock = threading.Lock()
+    
+    def _create_adapter(self) -> HTTPAdapter:
+        """创建带连接池和keep-alive配置的HTTP适配器"""
+        socket_options = None
+        if AI_HTTP_CONFIG['keep_alive']:
+            socket_options = [
+                (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        
+        class _KeepAliveAdapter(HTTPAdapter):
+            def init_poolmanager(self, *args, **kwargs):
+                if socket_options:
+                    kwargs['socket_options'] = socket_options
+                super().init_poolmanager(*args, **kwargs)
+        
+        return _KeepAliveAdapter(
+            pool_connections=AI_HTTP_CONFIG['pool_connections'],
+            pool_maxsize=AI_HTTP_CONFIG['pool_maxsize'],
+            pool_block=AI_HTTP_CONFIG['pool_block'],
+            max_retries=AI_HTTP_CONFIG['max_retries']
+        )
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """获取连接池命中统计（新建连接记为未命中，复用连接记为命中）"""
+        requests_total = 0
+        misses = 0
+        with self._stats_lock:
+            pools = self._adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    requests_total += pool.num_requests
+                    misses += pool.num_connections
+        hits = max(requests_total - misses, 0)
+        return {
+            'requests': requests_total,
+            'pool_hits': hits,
+            'pool_misses': misses,
+            'hit_rate': round(hits / requests_total, 4) if requests_total else 0.0,
+            'pool_maxsize': AI_HTTP_CONFIG['pool_maxsize']
         }
+    
+    def _make_request(self, messages: list, model: str, stream: bool = True) -> Generator[str, None, None]:
+        """发送请求到AI模型（开启缓存时，相同的请求直接回放缓存结果）"""
+        if not self.response_cache.enabled:
+            yield from self._request_completion(messages, model, stream)
+            return
+        
+        cache_key = self.response_cache.make_key(model, messages, self.temperature)
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            yield from self.response_cache.replay(cached)
+            return
         
+        chunks = []
+        generator = self._request_completion(messages, model, stream)
+        while True:
+            try:
+                chunk = next(generator)
+            except StopIteration as stop:
+                completed = stop.value
+                break
+            chunks.append(chunk)
+            yield chunk
+        
+        content = ''.join(chunks)
+        # 只缓存正常结束（收到[DONE]且没有出错）的完整回复，中途断开的流不缓存
+        if completed and content:
+            self.response_cache.set(cache_key, content)
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取响应缓存命中统计"""
+        return self.response_cache.get_stats()
+    
+    def _request_completion(self, messages: list, model: str, stream: bool = True) -> Generator[str, None, bool]:
+        """实际发送请求到AI模型，生成器的返回值表示回复是否正常结束（流式时收到了[DONE]且没有出错）"""
         data = {
             'model': model,
             'messages': messages,
             'stream': stream,
-            'temperature': 0.7
+            'temperature': self.temperature
         }
         
+        response = None
+        completed = False
         try:
-            response = requests.post(
+            response = self.session.post(
                 f'{self.base_url}/chat/completions',
-                headers=headers,
                 data=json.dumps(data),
                 stream=stream,
-                timeout=60  # 添加60秒超时
+                timeout=self.timeout
             )
             
             if stream:
@@ -41,7 +131,9 @@ class AIService:
                         if line.startswith('data: '):
                             data_str = line[6:]
                             if data_str == '[DONE]':
-                                break
+                                # 不提前break，读到流末尾才能让连接完整归还连接池
+                                completed = True
+                                continue
                             try:
                                 data_obj = json.loads(data_str)
                                 if 'choices' in data_obj and len(data_obj['choices']) > 0:
@@ -55,9 +147,16 @@ class AIService:
                 response_data = response.json()
                 if 'choices' in response_data and len(response_data['choices']) > 0:
                     yield response_data['choices'][0]['message']['content']
+                    completed = True
                     
         except Exception as e:
+            completed = False
             yield f"错误：{str(e)}"
+        finally:
+            # 读取完毕后把连接归还连接池
+            if response is not None:
+                response.close()
+        return completed
     
     def simple_chat(self, prompt: str, system_prompt: str = None, model: str = None) -> Generator[str, None, None]:
         """简单任务聊天（使用GLM-4-Flash）"""
@@ -93,6 +192,10 @@ class AIService:
         
         return thinking_content, display_content
     
+    def split_thinking(self, chunks) -> Generator[tuple[str, str], None, None]:
+        """流式拆分思考内容和显示内容，<think>标签跨数据块时也能正确识别"""
+        return split_thinking_stream(chunks)
+    
     def continue_conversation(self, messages: list, new_message: str, use_complex: bool = False, model: str = None) -> Generator[str, None, None]:
         """继续对话"""
         messages.append({"role": "user", "content": new_message})
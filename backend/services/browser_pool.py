@@ -0,0 +1,264 @@
+import asyncio
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+from playwright.async_api import async_playwright
+from config import BROWSER_POOL_CONFIG
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+class BrowserPool:
+    """常驻的Playwright浏览器池：浏览器只启动一次，上下文提前预热、每次用完即关闭，页面数量受限"""
+
+    def __init__(self):
+        self.max_pages = BROWSER_POOL_CONFIG['max_pages']
+        self.recycle_after_pages = BROWSER_POOL_CONFIG['recycle_after_pages']
+        self.max_memory_mb = BROWSER_POOL_CONFIG['max_memory_mb']
+        self.warm_contexts = BROWSER_POOL_CONFIG['warm_contexts']
+        self.memory_check_interval = BROWSER_POOL_CONFIG['memory_check_interval']
+
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+        # 以下状态只在浏览器池自己的事件循环线程中访问
+        self._playwright = None
+        self._browsers = {}
+        self._idle_contexts = {}
+        self._pages_served = {}
+        self._active_pages = {}  # 浏览器 -> 正在使用的页面数（包括等待关闭的旧浏览器）
+        self._draining = set()  # 已退役、等页面全部归还后关闭的浏览器
+        self._memory_checked_at = 0.0
+        self._page_semaphore = None
+        self._launch_lock = None
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """启动（或返回）浏览器池专用的事件循环线程"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name='browser-pool', daemon=True)
+                thread.start()
+            return self._loop
+
+    def run(self, coro, timeout: float = None):
+        """在浏览器池的事件循环中执行协程，并同步等待结果（替代asyncio.run）"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+        try:
+            return future.result(timeout or BROWSER_POOL_CONFIG['task_timeout'])
+        except Exception:
+            future.cancel()
+            raise
+
+    async def _ensure_started(self):
+        if self._page_semaphore is None:
+            self._page_semaphore = asyncio.Semaphore(self.max_pages)
+            self._launch_lock = asyncio.Lock()
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+
+    async def _get_browser(self, browser_name: str):
+        """获取已启动的浏览器，断开连接时重新启动"""
+        async with self._launch_lock:
+            browser = self._browsers.get(browser_name)
+            if browser is not None and browser.is_connected():
+                return browser
+
+            print(f"启动浏览器池中的 {browser_name}...")
+            if browser_name == 'chromium':
+                browser = await self._playwright.chromium.launch(
+                    headless=True,
+                    args=BROWSER_POOL_CONFIG['chromium_args']
+                )
+            else:
+                browser = await self._playwright.firefox.launch(headless=True)
+
+            self._browsers[browser_name] = browser
+            self._idle_contexts[browser_name] = {}
+            self._pages_served[browser_name] = 0
+            return browser
+
+    async def _acquire_context(self, browser_name: str, browser, context_options: dict):
+        """优先复用预热好的上下文，没有时新建"""
+        key = json.dumps(context_options, sort_keys=True)
+        idle = self._idle_contexts.setdefault(browser_name, {}).setdefault(key, [])
+        while idle:
+            context = idle.pop()
+            if context.browser is browser:
+                return key, context
+        return key, await browser.new_context(**context_options)
+
+    async def _release_context(self, browser_name: str, browser, key: str, context, context_options: dict):
+        """关闭用过的上下文（cookie、localStorage、IndexedDB、Service Worker等不会带给下一次抓取），
+        空闲列表不足预热数量时补一个全新的上下文（已退役的浏览器不再补充）"""
+        try:
+            await context.close()
+        except Exception:
+            pass
+        idle = self._idle_contexts.get(browser_name, {}).get(key)
+        if (idle is not None and len(idle) < self.warm_contexts
+                and self._browsers.get(browser_name) is browser and browser.is_connected()):
+            try:
+                idle.append(await browser.new_context(**context_options))
+            except Exception:
+                pass
+
+    @asynccontextmanager
+    async def page(self, browser_name: str = 'chromium', context_options: dict = None):
+        """借出一个页面，用完自动归还；同时打开的页面数不超过max_pages"""
+        await self._ensure_started()
+        async with self._page_semaphore:
+            browser = await self._get_browser(browser_name)
+            context_options = context_options or {}
+            key, context = await self._acquire_context(browser_name, browser, context_options)
+            page = await context.new_page()
+            self._active_pages[browser] = self._active_pages.get(browser, 0) + 1
+            try:
+                yield page
+            finally:
+                self._active_pages[browser] -= 1
+                if self._browsers.get(browser_name) is browser:
+                    self._pages_served[browser_name] += 1
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+                await self._release_context(browser_name, browser, key, context, context_options)
+                await self._maybe_recycle(browser_name, browser)
+
+    @staticmethod
+    def _is_playwright_driver(process) -> bool:
+        try:
+            return 'run-driver' in ' '.join(process.cmdline())
+        except psutil.Error:
+            return False
+
+    def _browser_memory_mb(self) -> float:
+        """统计Playwright驱动进程及其下浏览器进程树的内存占用（不含OCR、PDF等其他进程池）"""
+        if psutil is None:
+            return 0.0
+        try:
+            drivers = [child for child in psutil.Process(os.getpid()).children() if self._is_playwright_driver(child)]
+        except psutil.Error:
+            return 0.0
+        total = 0
+        for driver in drivers:
+            try:
+                processes = [driver] + driver.children(recursive=True)
+            except psutil.Error:
+                continue
+            for process in processes:
+                try:
+                    total += process.memory_info().rss
+                except psutil.Error:
+                    continue
+        return total / (1024 * 1024)
+
+    async def _memory_too_high(self) -> bool:
+        """每memory_check_interval秒最多检查一次内存；psutil扫描进程在线程池中执行，不阻塞事件循环"""
+        now = time.monotonic()
+        if psutil is None or now - self._memory_checked_at < self.memory_check_interval:
+            return False
+        self._memory_checked_at = now
+        memory_mb = await asyncio.get_running_loop().run_in_executor(None, self._browser_memory_mb)
+        return memory_mb > self.max_memory_mb
+
+    async def _maybe_recycle(self, browser_name: str, browser):
+        """达到页面数上限或内存过高时让浏览器退役：新页面改用新启动的浏览器，旧浏览器等页面全部归还后关闭"""
+        if self._browsers.get(browser_name) is browser and (
+                self._pages_served.get(browser_name, 0) >= self.recycle_after_pages
+                or await self._memory_too_high()):
+            await self._retire_browser(browser_name)
+
+        # 已退役（或断开后被替换）的浏览器，页面全部归还后关闭
+        if self._browsers.get(browser_name) is not browser and self._active_pages.get(browser, 0) == 0:
+            self._draining.discard(browser)
+            self._active_pages.pop(browser, None)
+            try:
+                await browser.close()
+            except Exception:
+                pass
+
+    async def _retire_browser(self, browser_name: str):
+        """把当前浏览器移出池子（下次借页面时启动新的），关闭它的预热上下文"""
+        browser = self._browsers.pop(browser_name, None)
+        idle_contexts = self._idle_contexts.pop(browser_name, {})
+        print(f"回收浏览器池中的 {browser_name}（已服务 {self._pages_served.get(browser_name, 0)} 个页面）")
+        self._pages_served[browser_name] = 0
+        if browser is not None:
+            self._draining.add(browser)
+        for contexts in idle_contexts.values():
+            for context in contexts:
+                try:
+                    await context.close()
+                except Exception:
+                    pass
+
+    async def _close_browser(self, browser_name: str):
+        browser = self._browsers.get(browser_name)
+        await self._retire_browser(browser_name)
+        if browser is not None:
+            self._draining.discard(browser)
+            self._active_pages.pop(browser, None)
+            try:
+                await browser.close()
+            except Exception:
+                pass
+
+    async def _health_check(self) -> Dict:
+        started = time.monotonic()
+        async with self.page('chromium') as page:
+            await page.goto('about:blank', timeout=10000)
+        return {
+            'healthy': True,
+            'latency_ms': round((time.monotonic() - started) * 1000, 1),
+            'browsers': {
+                name: {
+                    'connected': browser.is_connected(),
+                    'pages_served': self._pages_served.get(name, 0),
+                    'active_pages': self._active_pages.get(browser, 0)
+                }
+                for name, browser in self._browsers.items()
+            },
+            'draining': len(self._draining),
+            'memory_mb': round(await asyncio.get_running_loop().run_in_executor(None, self._browser_memory_mb), 1)
+        }
+
+    def health_check(self) -> Dict:
+        """健康检查：确认浏览器可用并能打开空白页"""
+        try:
+            return self.run(self._health_check(), timeout=30)
+        except Exception as e:
+            return {'healthy': False, 'error': str(e)}
+
+    async def _shutdown(self):
+        for browser_name in list(self._browsers.keys()):
+            await self._close_browser(browser_name)
+        for browser in list(self._draining):
+            self._draining.discard(browser)
+            try:
+                await browser.close()
+            except Exception:
+                pass
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    def shutdown(self):
+        """关闭所有浏览器并停止Playwright"""
+        if self._loop is None:
+            return
+        try:
+            self.run(self._shutdown(), timeout=30)
+        except Exception as e:
+            print(f"关闭浏览器池失败: {str(e)}")
+
+# 全局浏览器池实例
+browser_pool = BrowserPool()
+atexit.register(browser_pool.shutdown)
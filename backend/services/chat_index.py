@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+from utils.file_lock import file_lock
+
+SORT_FIELDS = ('updated_at', 'created_at', 'title', 'message_count')
+
+class ChatIndex:
+    """每个用户一份的聊天记录索引（标题、功能、时间、消息数），列表页不再逐个打开对话文件
+
+    索引保存在 data/users/<用户>/chat_index.json，由聊天记录存储在创建、保存、改名、删除时同步更新。
+    索引中记录了聊天目录的修改时间，目录被绕过索引改动（或索引丢失、损坏）时自动从文件重建。
+    """
+
+    VERSION = 1
+
+    def __init__(self, store):
+        self.store = store
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
+    def get_index_path(self, username: str) -> str:
+        return f"data/users/{username}/chat_index.json"
+
+    def _folder_mtime(self, username: str) -> int:
+        try:
+            return os.stat(self.store.get_chat_folder(username)).st_mtime_ns
+        except OSError:
+            return 0
+
+    def _read(self, username: str) -> Optional[Dict]:
+        """读取索引文件（按文件修改时间缓存在内存中）"""
+        path = self.get_index_path(username)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        with self._cache_lock:
+            cached = self._cache.get(username)
+            if cached and cached[0] == mtime:
+                return cached[1]
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if index.get('version') != self.VERSION or not isinstance(index.get('chats'), dict):
+            return None
+
+        with self._cache_lock:
+            self._cache[username] = (mtime, index)
+        return index
+
+    def _write(self, username: str, chats: Dict[str, Dict]):
+        """原子地写入索引（调用方需持有索引文件锁）"""
+        path = self.get_index_path(username)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        index = {
+            'version': self.VERSION,
+            'folder_mtime': self._folder_mtime(username),
+            'chats': chats
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        with self._cache_lock:
+            self._cache[username] = (os.stat(path).st_mtime_ns, index)
+
+    def _is_stale(self, username: str, index: Optional[Dict]) -> bool:
+        return index is None or index.get('folder_mtime') != self._folder_mtime(username)
+
+    def _rebuild_locked(self, username: str) -> Dict[str, Dict]:
+        chats = {}
+        for chat_id in self.store.list_chat_ids(username):
+            try:
+                summary = self.store.get_summary(username, chat_id)
+            except Exception:
+                # 如果文件损坏，跳过
+                continue
+            if summary:
+                chats[chat_id] = summary
+        self._write(username, chats)
+        print(f"已重建用户 {username} 的聊天记录索引，共 {len(chats)} 条")
+        return chats
+
+    def rebuild(self, username: str) -> Dict[str, Dict]:
+        """从聊天记录文件重建索引"""
+        with file_lock(self.get_index_path(username)):
+            return self._rebuild_locked(username)
+
+    def _load_fresh(self, username: str) -> Dict[str, Dict]:
+        index = self._read(username)
+        if not self._is_stale(username, index):
+            return index['chats']
+        with file_lock(self.get_index_path(username)):
+            index = self._read(username)
+            if not self._is_stale(username, index):
+                return index['chats']
+            return self._rebuild_locked(username)
+
+    @staticmethod
+    def _is_older(summary: Dict, current: Optional[Dict]) -> bool:
+        """summary是否比索引中已有的摘要旧（并发追加时索引的更新可能晚到、乱序）"""
+        if not current:
+            return False
+        new_key = (summary.get('updated_at') or '', summary.get('message_count') or 0)
+        current_key = (current.get('updated_at') or '', current.get('message_count') or 0)
+        return new_key < current_key
+
+    def update(self, username: str, summary: Dict):
+        """写入（或覆盖）一条对话摘要，不会用较旧的摘要覆盖较新的"""
+        with file_lock(self.get_index_path(username)):
+            index = self._read(username)
+            if index is None:
+                self._rebuild_locked(username)
+                return
+            if self._is_older(summary, index['chats'].get(summary['chat_id'])):
+                return
+            chats = dict(index['chats'])
+            chats[summary['chat_id']] = summary
+            self._write(username, chats)
+
+    def remove(self, username: str, chat_id: str):
+        """删除一条对话摘要"""
+        with file_lock(self.get_index_path(username)):
+            index = self._read(username)
+            if index is None:
+                self._rebuild_locked(username)
+                return
+            chats = dict(index['chats'])
+            chats.pop(chat_id, None)
+            self._write(username, chats)
+
+    def summaries(self, username: str) -> Dict[str, Dict]:
+        """全部对话摘要 {chat_id: 摘要}（只读）"""
+        return self._load_fresh(username)
+
+    def list(self, username: str, sort_by: str = 'updated_at', descending: bool = True,
+             page: int = 1, page_size: int = None) -> Tuple[List[Dict], int]:
+        """按字段排序并分页，返回 (当前页的对话摘要, 总数)；page_size为空时返回全部"""
+        if sort_by not in SORT_FIELDS:
+            sort_by = 'updated_at'
+        default = 0 if sort_by == 'message_count' else ''
+        chats = list(self._load_fresh(username).values())
+        chats.sort(key=lambda chat: chat.get(sort_by) or default, reverse=descending)
+
+        total = len(chats)
+        if page_size:
+            page = max(page, 1)
+            start = (page - 1) * page_size
+            chats = chats[start:start + page_size]
+        return chats, total
@@ -0,0 +1,343 @@
+import json
+import os
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple
+from config import CHAT_SEARCH_CONFIG
+from utils.bm25 import bm25_idf, tokenize
+from utils.file_lock import file_lock, append_line
+
+class _SearchState:
+    """一个用户的倒排索引在内存中的状态"""
+
+    def __init__(self):
+        self.chats = {}  # chat_id -> {'title', 'message_count', 'length', 'terms': {词: 词频}, 'messages': [[角色, 开头文字, 全文长度]]}
+        self.postings = {}  # 词 -> {chat_id: 词频}
+        self.total_length = 0
+        self.offset = 0  # 已读到的日志文件位置
+        self.inode = None
+        self.log_lines = 0  # 快照之后的日志行数
+
+    def _add_terms(self, chat_id: str, terms: Dict[str, int], sign: int = 1):
+        doc = self.chats[chat_id]
+        for term, tf in terms.items():
+            tf *= sign
+            new_tf = doc['terms'].get(term, 0) + tf
+            posting = self.postings.setdefault(term, {})
+            if new_tf > 0:
+                doc['terms'][term] = new_tf
+                posting[chat_id] = new_tf
+            else:
+                doc['terms'].pop(term, None)
+                posting.pop(chat_id, None)
+                if not posting:
+                    del self.postings[term]
+            doc['length'] += tf
+            self.total_length += tf
+
+    def _remove(self, chat_id: str):
+        doc = self.chats.get(chat_id)
+        if doc is None:
+            return
+        self._add_terms(chat_id, dict(doc['terms']), -1)
+        del self.chats[chat_id]
+
+    def apply(self, op: Dict, title_weight: int):
+        kind = op.get('op')
+        chat_id = op.get('chat_id')
+        if kind == 'reset':
+            self._remove(chat_id)
+            self.chats[chat_id] = {
+                'title': op['title'], 'message_count': op['message_count'], 'length': 0, 'terms': {},
+                'messages': list(op.get('messages', []))
+            }
+            self._add_terms(chat_id, op['terms'])
+        elif kind == 'delete':
+            self._remove(chat_id)
+        elif chat_id not in self.chats:
+            return
+        elif kind == 'message':
+            doc = self.chats[chat_id]
+            if doc['message_count'] != op['message_count'] - 1:
+                # 与索引中的消息数对不上（并发写入或漏记），标记为过期，搜索时从对话文件重建
+                doc['message_count'] = -1
+                return
+            doc['message_count'] = op['message_count']
+            doc['messages'].append(op.get('preview') or ['', '', 0])
+            self._add_terms(chat_id, op['terms'])
+            self._set_title(chat_id, op['title'], title_weight)
+        elif kind == 'title':
+            self._set_title(chat_id, op['title'], title_weight)
+
+    def _set_title(self, chat_id: str, title: str, title_weight: int):
+        doc = self.chats[chat_id]
+        if doc['title'] == title:
+            return
+        self._add_terms(chat_id, _weighted_terms(doc['title'], title_weight), -1)
+        self._add_terms(chat_id, _weighted_terms(title, title_weight))
+        doc['title'] = title
+
+def _weighted_terms(text: str, weight: int = 1) -> Dict[str, int]:
+    return {term: tf * weight for term, tf in Counter(tokenize(text or '')).items()}
+
+class ChatSearchIndex:
+    """每个用户一份的聊天记录全文检索：BM25评分的倒排索引，中文按相邻两字切词
+
+    索引以追加日志保存在 data/users/<用户>/chat_search.jsonl：保存消息、改名、删除时各追加一行增量，
+    日志过长时压缩为一行快照。内存中缓存各用户的索引，读到其他进程追加的行时增量回放。
+    搜索前与聊天记录索引（ChatIndex）核对每个对话的标题和消息数，对不上的对话从文件重新建立。
+    每条消息的开头文字也记在索引中，结果片段从这里截取，不必为每个结果读取整个对话文件。
+    """
+
+    VERSION = 2
+
+    def __init__(self, store):
+        self.store = store
+        self.compact_after = CHAT_SEARCH_CONFIG['compact_after']
+        self.title_weight = CHAT_SEARCH_CONFIG['title_weight']
+        self.k1 = CHAT_SEARCH_CONFIG['k1']
+        self.b = CHAT_SEARCH_CONFIG['b']
+        self.snippet_chars = CHAT_SEARCH_CONFIG['snippet_chars']
+        self.snippet_source_chars = CHAT_SEARCH_CONFIG['snippet_source_chars']
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get_index_path(self, username: str) -> str:
+        return f"data/users/{username}/chat_search.jsonl"
+
+    # ---- 写入：保存、改名、删除时由聊天记录存储调用 ----
+
+    def _append_ops(self, username: str, ops: List[Dict]):
+        path = self.get_index_path(username)
+        lines = [json.dumps(op, ensure_ascii=False, separators=(',', ':')) for op in ops]
+        try:
+            with file_lock(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                append_line(path, '\n'.join(lines))
+        except OSError as e:
+            # 漏记的变更会在下次搜索核对时补上
+            print(f"更新聊天记录检索索引失败: {str(e)}")
+
+    def _preview(self, message: Dict) -> List:
+        """索引中保存的消息开头文字：[角色, 开头文字, 全文长度]"""
+        content = message.get('content') or ''
+        return [message.get('role'), content[:self.snippet_source_chars], len(content)]
+
+    def _doc_op(self, chat_data: Dict) -> Dict:
+        terms = Counter(_weighted_terms(chat_data.get('title'), self.title_weight))
+        for message in chat_data.get('messages', []):
+            terms.update(tokenize(message.get('content') or ''))
+        return {
+            'op': 'reset',
+            'chat_id': chat_data['chat_id'],
+            'title': chat_data.get('title', ''),
+            'message_count': len(chat_data.get('messages', [])),
+            'terms': dict(terms),
+            'messages': [self._preview(message) for message in chat_data.get('messages', [])]
+        }
+
+    def on_create(self, username: str, summary: Dict):
+        self._append_ops(username, [self._doc_op({'chat_id': summary['chat_id'], 'title': summary['title']})])
+
+    def on_message(self, username: str, chat_id: str, message: Dict, summary: Dict):
+        self._append_ops(username, [{
+            'op': 'message',
+            'chat_id': chat_id,
+            'title': summary['title'],
+            'message_count': summary['message_count'],
+            'terms': dict(Counter(tokenize(message.get('content') or ''))),
+            'preview': self._preview(message)
+        }])
+
+    def on_title(self, username: str, chat_id: str, title: str):
+        self._append_ops(username, [{'op': 'title', 'chat_id': chat_id, 'title': title}])
+
+    def on_delete(self, username: str, chat_id: str):
+        self._append_ops(username, [{'op': 'delete', 'chat_id': chat_id}])
+
+    # ---- 读取：加载快照并回放日志 ----
+
+    def _read_new_lines(self, username: str, state: _SearchState):
+        """从上次读到的位置继续回放日志；文件被压缩替换（或删除）时从头加载"""
+        path = self.get_index_path(username)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if state.inode is not None:
+                state.__init__()
+            return
+        if stat.st_ino != state.inode or stat.st_size < state.offset:
+            state.__init__()
+            state.inode = stat.st_ino
+        if stat.st_size == state.offset:
+            return
+
+        with open(path, 'rb') as f:
+            f.seek(state.offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except (ValueError, UnicodeDecodeError):
+                continue
+            if record.get('op') == 'snapshot':
+                if record.get('version') == self.VERSION:
+                    self._load_snapshot(state, record)
+                continue
+            state.apply(record, self.title_weight)
+            state.log_lines += 1
+        state.offset += end
+
+    def _load_snapshot(self, state: _SearchState, record: Dict):
+        state.chats = {}
+        state.postings = {}
+        state.total_length = 0
+        state.log_lines = 0
+        for chat_id, doc in record['chats'].items():
+            state.apply({'op': 'reset', 'chat_id': chat_id, **doc}, self.title_weight)
+
+    def _compact(self, username: str, state: _SearchState):
+        """把日志压缩为一行快照"""
+        path = self.get_index_path(username)
+        with file_lock(path):
+            self._read_new_lines(username, state)
+            snapshot = {
+                'op': 'snapshot',
+                'version': self.VERSION,
+                'chats': {
+                    chat_id: {
+                        'title': doc['title'], 'message_count': doc['message_count'],
+                        'terms': doc['terms'], 'messages': doc['messages']
+                    }
+                    for chat_id, doc in state.chats.items()
+                }
+            }
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+                f.write(json.dumps(snapshot, ensure_ascii=False, separators=(',', ':')) + '\n')
+            os.replace(tmp_path, path)
+        state.__init__()
+        self._read_new_lines(username, state)
+
+    def _sync(self, username: str, state: _SearchState, summaries: Dict[str, Dict]):
+        """与聊天记录索引核对：缺失或标题、消息数（含保存的消息开头文字数）对不上的对话从文件重新建立，已删除的对话移除"""
+        ops = [{'op': 'delete', 'chat_id': chat_id} for chat_id in state.chats if chat_id not in summaries]
+        for chat_id, summary in summaries.items():
+            doc = state.chats.get(chat_id)
+            if (doc and doc['message_count'] == summary.get('message_count') == len(doc['messages'])
+                    and doc['title'] == summary.get('title')):
+                continue
+            try:
+                chat_data = self.store.load(username, chat_id)
+            except Exception:
+                # 如果文件损坏，跳过
+                continue
+            if chat_data:
+                ops.append(self._doc_op(chat_data))
+        if ops:
+            if len(ops) > 1:
+                print(f"已更新用户 {username} 的聊天记录检索索引，重建 {len(ops)} 条")
+            self._append_ops(username, ops)
+            self._read_new_lines(username, state)
+
+    def _load(self, username: str, summaries: Dict[str, Dict]) -> _SearchState:
+        state = self._states.setdefault(username, _SearchState())
+        self._read_new_lines(username, state)
+        self._sync(username, state, summaries)
+        if state.log_lines > self.compact_after:
+            self._compact(username, state)
+        return state
+
+    # ---- 搜索 ----
+
+    def _snippet(self, username: str, chat_id: str, terms: List[str], previews: List[List]) -> Dict:
+        """取匹配词最多的一条消息，截取第一个匹配词附近的文字
+
+        先在索引保存的消息开头文字中查找，都没有匹配（匹配词在长消息的后半部分）时才读取对话文件。
+        """
+        snippet = self._best_snippet(terms, previews)
+        if snippet is None:
+            chat_data = self.store.load(username, chat_id)
+            snippet = self._best_snippet(terms, [
+                [message.get('role'), message.get('content') or '', len(message.get('content') or '')]
+                for message in (chat_data or {}).get('messages', [])
+            ])
+        return snippet or {}
+
+    def _best_snippet(self, terms: List[str], messages: List[List]) -> Dict:
+        best = None
+        for index, (role, content, length) in enumerate(messages):
+            lowered = content.lower()
+            hits = sum(lowered.count(term) for term in terms)
+            if hits and (best is None or hits > best[0]):
+                positions = [lowered.find(term) for term in terms if term in lowered]
+                best = (hits, index, role, content, length, min(positions))
+        if best is None:
+            return None
+        _, index, role, content, length, position = best
+        start = max(position - self.snippet_chars // 4, 0)
+        end = start + self.snippet_chars
+        text = content[start:end].replace('\n', ' ')
+        return {
+            'message_index': index,
+            'role': role,
+            'snippet': ('…' if start > 0 else '') + text + ('…' if end < length else '')
+        }
+
+    def search(self, username: str, query: str, feature: str = None, date_from: str = None, date_to: str = None,
+               page: int = 1, page_size: int = 20) -> Tuple[List[Dict], int]:
+        """全文搜索，按BM25得分排序并分页，返回 (当前页的对话摘要（含得分和片段）, 命中总数)
+
+        feature按功能过滤；date_from / date_to 为 YYYY-MM-DD，按最后更新日期过滤（包含两端）。
+        """
+        with self._lock:
+            summaries = self.store.index.summaries(username)
+            state = self._load(username, summaries)
+            query_terms = Counter(tokenize(query))
+
+            def allowed(chat_id: str) -> bool:
+                summary = summaries.get(chat_id)
+                if summary is None:
+                    return False
+                if feature and summary.get('feature') != feature:
+                    return False
+                updated = (summary.get('updated_at') or '')[:10]
+                if date_from and updated < date_from:
+                    return False
+                if date_to and updated > date_to:
+                    return False
+                return True
+
+            doc_count = len(state.chats)
+            avg_length = state.total_length / doc_count if doc_count else 0
+            scores = {}
+            for term, query_tf in query_terms.items():
+                posting = state.postings.get(term)
+                if not posting:
+                    continue
+                idf = bm25_idf(doc_count, len(posting))
+                for chat_id, tf in posting.items():
+                    length_norm = self.k1 * (1 - self.b + self.b * state.chats[chat_id]['length'] / max(avg_length, 1e-6))
+                    scores[chat_id] = scores.get(chat_id, 0.0) + query_tf * idf * tf * (self.k1 + 1) / (tf + length_norm)
+            previews = {chat_id: list(state.chats[chat_id]['messages']) for chat_id in scores}
+
+        ranked = sorted(
+            ((score, chat_id) for chat_id, score in scores.items() if allowed(chat_id)),
+            reverse=True
+        )
+        total = len(ranked)
+        page = max(page, 1)
+        start = (page - 1) * page_size
+        results = []
+        for score, chat_id in ranked[start:start + page_size]:
+            result = dict(summaries[chat_id])
+            result['score'] = round(score, 4)
+            try:
+                result.update(self._snippet(username, chat_id, list(query_terms), previews[chat_id]))
+            except Exception:
+                pass
+            results.append(result)
+        return results, total
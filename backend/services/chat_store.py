@@ -0,0 +1,336 @@
+import json
+import os
+from datetime import datetime
+from typing import Dict, Optional
+from config import CHAT_STORE_CONFIG
+from services.chat_index import ChatIndex
+from services.chat_search import ChatSearchIndex
+from utils.file_lock import file_lock, append_line
+
+class ChatStore:
+    """按对话保存的追加式聊天记录：每个对话一个JSONL文件
+
+    第一行是头部记录（标题、功能、时间等），之后每条消息追加一行，修改标题等元数据也追加一行。
+    追加的每一行都带有截至该行的标题、message_count、updated_at，因此只需读文件头尾两行即可得知对话现状。
+    元数据更新累计过多时压缩为 头部 + 消息。旧的 {chat_id}.json 文件在首次访问时迁移。
+    创建、追加、改名、删除后同步更新用户的聊天记录索引（见ChatIndex）和全文检索索引（见ChatSearchIndex）。
+    """
+
+    VERSION = 1
+
+    def __init__(self):
+        self.compact_after = CHAT_STORE_CONFIG['compact_after']
+        self.index = ChatIndex(self)
+        self.search = ChatSearchIndex(self)
+
+    def get_chat_folder(self, username: str) -> str:
+        return f"data/users/{username}/chat_history"
+
+    def get_log_path(self, username: str, chat_id: str) -> str:
+        return os.path.join(self.get_chat_folder(username), f"{chat_id}.jsonl")
+
+    def get_legacy_path(self, username: str, chat_id: str) -> str:
+        return os.path.join(self.get_chat_folder(username), f"{chat_id}.json")
+
+    def get_lock_path(self, username: str) -> str:
+        """一个用户的所有对话共用一个锁文件（chat_history/chats.lock），删除对话后不会留下锁文件"""
+        return os.path.join(self.get_chat_folder(username), 'chats')
+
+    @staticmethod
+    def _dumps(record: Dict) -> str:
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+    @staticmethod
+    def _read_tail(path: str):
+        """读取文件最后一条完整记录，返回 (记录, 文件是否以换行结尾)"""
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            block = 4096
+            data = b''
+            pos = size
+            while pos > 0:
+                step = min(block, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+                # 至少包含一个完整行（前面还有换行符或已读到文件头）时停止
+                if data.count(b'\n') >= 2 or pos == 0:
+                    break
+                block *= 2
+
+        ends_with_newline = data.endswith(b'\n')
+        for line in reversed(data.splitlines()):
+            if not line.strip():
+                continue
+            try:
+                return json.loads(line.decode('utf-8')), ends_with_newline
+            except (ValueError, UnicodeDecodeError):
+                # 末尾可能是写入中断的半行，继续向前找
+                continue
+        return None, ends_with_newline
+
+    def _header(self, chat_data: Dict, meta_updates: int = 0) -> Dict:
+        return {
+            'type': 'header',
+            'version': self.VERSION,
+            'chat_id': chat_data['chat_id'],
+            'title': chat_data.get('title', '未命名对话'),
+            'feature': chat_data.get('feature', 'intelligent_reading'),
+            'created_at': chat_data.get('created_at', ''),
+            'updated_at': chat_data.get('updated_at', ''),
+            'message_count': len(chat_data.get('messages', [])),
+            'meta_updates': meta_updates
+        }
+
+    def _write_full(self, path: str, chat_data: Dict):
+        """写入 头部 + 全部消息（临时文件 + 替换，调用方需持有文件锁）"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(self._dumps(self._header(chat_data)) + '\n')
+            count = 0
+            for message in chat_data.get('messages', []):
+                count += 1
+                f.write(self._dumps({
+                    'type': 'message',
+                    'message': message,
+                    'message_count': count,
+                    'updated_at': chat_data.get('updated_at', ''),
+                    'meta_updates': 0
+                }) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _migrate_legacy(self, username: str, chat_id: str) -> bool:
+        """把旧的整文件JSON转换为追加日志，返回对话是否存在"""
+        path = self.get_log_path(username, chat_id)
+        if os.path.exists(path):
+            return True
+        legacy_path = self.get_legacy_path(username, chat_id)
+        if not os.path.exists(legacy_path):
+            return False
+
+        with file_lock(self.get_lock_path(username)):
+            if os.path.exists(path):
+                return True
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                chat_data = json.load(f)
+            chat_data.setdefault('chat_id', chat_id)
+            self._write_full(path, chat_data)
+            os.remove(legacy_path)
+        print(f"聊天记录已迁移为追加日志: {chat_id}")
+        return True
+
+    def exists(self, username: str, chat_id: str) -> bool:
+        return self._migrate_legacy(username, chat_id)
+
+    def create(self, username: str, chat_id: str, title: str = '新对话', feature: str = 'intelligent_reading') -> Dict:
+        """创建新的对话，返回对话摘要；对话已存在（例如两个请求同时首次保存）时保留原有记录，返回它的摘要"""
+        now = datetime.now().isoformat()
+        chat_data = {
+            'chat_id': chat_id,
+            'title': title,
+            'feature': feature,
+            'created_at': now,
+            'updated_at': now,
+            'messages': []
+        }
+        path = self.get_log_path(username, chat_id)
+        with file_lock(self.get_lock_path(username)):
+            existed = os.path.exists(path) or os.path.exists(self.get_legacy_path(username, chat_id))
+            if not existed:
+                self._write_full(path, chat_data)
+        if existed:
+            return self.get_summary(username, chat_id)
+        summary = self._summary(self._header(chat_data))
+        self.index.update(username, summary)
+        self.search.on_create(username, summary)
+        return summary
+
+    def load(self, username: str, chat_id: str) -> Optional[Dict]:
+        """读取完整对话（与旧JSON文件的结构一致），不存在时返回None"""
+        if not self._migrate_legacy(username, chat_id):
+            return None
+
+        chat_data = None
+        messages = []
+        with open(self.get_log_path(username, chat_id), 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError):
+                    continue
+                record_type = record.get('type')
+                if record_type == 'header':
+                    chat_data = {
+                        'chat_id': record.get('chat_id', chat_id),
+                        'title': record.get('title', '未命名对话'),
+                        'feature': record.get('feature', 'intelligent_reading'),
+                        'created_at': record.get('created_at', ''),
+                        'updated_at': record.get('updated_at', '')
+                    }
+                elif chat_data is None:
+                    continue
+                else:
+                    if record_type == 'message':
+                        messages.append(record['message'])
+                    for key in ('title', 'feature', 'updated_at'):
+                        if key in record:
+                            chat_data[key] = record[key]
+
+        if chat_data is None:
+            return None
+        chat_data['messages'] = messages
+        return chat_data
+
+    def _summary(self, record: Dict, chat_id: str = None) -> Dict:
+        return {
+            'chat_id': record.get('chat_id', chat_id),
+            'title': record.get('title', '未命名对话'),
+            'feature': record.get('feature', 'intelligent_reading'),
+            'created_at': record.get('created_at', ''),
+            'updated_at': record.get('updated_at', ''),
+            'message_count': record.get('message_count', 0)
+        }
+
+    def _read_state(self, path: str, chat_id: str):
+        """只读头部和末尾记录，返回 (对话摘要, 元数据更新次数, 文件是否以换行结尾)"""
+        with open(path, 'rb') as f:
+            try:
+                header = json.loads(f.readline().decode('utf-8'))
+            except (ValueError, UnicodeDecodeError):
+                return None, 0, True
+        tail, ends_with_newline = self._read_tail(path)
+        summary = self._summary(header, chat_id)
+        meta_updates = header.get('meta_updates', 0)
+        if tail:
+            for key in ('title', 'feature', 'updated_at', 'message_count'):
+                if key in tail:
+                    summary[key] = tail[key]
+            meta_updates = tail.get('meta_updates', meta_updates)
+        return summary, meta_updates, ends_with_newline
+
+    def get_summary(self, username: str, chat_id: str) -> Optional[Dict]:
+        """对话摘要（标题、功能、时间、消息数），不读取消息内容"""
+        if not self._migrate_legacy(username, chat_id):
+            return None
+        summary, _, _ = self._read_state(self.get_log_path(username, chat_id), chat_id)
+        return summary
+
+    def _append(self, username: str, chat_id: str, build_record) -> Optional[Dict]:
+        """加锁读取末尾状态，构造并追加一条记录，返回追加后的对话摘要；对话不存在时返回None"""
+        if not self._migrate_legacy(username, chat_id):
+            return None
+        path = self.get_log_path(username, chat_id)
+        with file_lock(self.get_lock_path(username)):
+            if not os.path.exists(path):
+                return None
+            summary, meta_updates, ends_with_newline = self._read_state(path, chat_id)
+            if summary is None:
+                return None
+
+            record = build_record(summary, meta_updates)
+            line = self._dumps(record)
+            if not ends_with_newline:
+                # 上次写入被中断留下了半行，先换行隔开，读取时会跳过那半行
+                line = '\n' + line
+            append_line(path, line)
+
+            for key in ('title', 'feature', 'updated_at', 'message_count'):
+                if key in record:
+                    summary[key] = record[key]
+
+            if record.get('meta_updates', 0) >= self.compact_after:
+                self._compact_locked(username, chat_id)
+        self.index.update(username, summary)
+        return summary
+
+    def append_message(self, username: str, chat_id: str, message: Dict, first_message_title: str = None) -> Optional[Dict]:
+        """追加一条消息（只写一行，不重写文件）；如果这是第一条消息且给出了first_message_title，同时设为标题"""
+        now = datetime.now().isoformat()
+
+        def build(summary, meta_updates):
+            title = summary['title']
+            if first_message_title and summary['message_count'] == 0:
+                title = first_message_title
+            return {
+                'type': 'message',
+                'message': message,
+                'title': title,
+                'feature': summary['feature'],
+                'message_count': summary['message_count'] + 1,
+                'updated_at': now,
+                'meta_updates': meta_updates
+            }
+
+        summary = self._append(username, chat_id, build)
+        if summary is not None:
+            self.search.on_message(username, chat_id, message, summary)
+        return summary
+
+    def update_meta(self, username: str, chat_id: str, **fields) -> Optional[Dict]:
+        """更新标题等元数据（追加一条meta记录）"""
+        now = datetime.now().isoformat()
+
+        def build(summary, meta_updates):
+            return {
+                'type': 'meta',
+                'title': fields.get('title', summary['title']),
+                'feature': fields.get('feature', summary['feature']),
+                'message_count': summary['message_count'],
+                'updated_at': now,
+                'meta_updates': meta_updates + 1
+            }
+
+        summary = self._append(username, chat_id, build)
+        if summary is not None:
+            self.search.on_title(username, chat_id, summary['title'])
+        return summary
+
+    def _compact_locked(self, username: str, chat_id: str):
+        chat_data = self.load(username, chat_id)
+        if chat_data is not None:
+            self._write_full(self.get_log_path(username, chat_id), chat_data)
+
+    def compact(self, username: str, chat_id: str):
+        """把元数据更新合并进头部，重写为 头部 + 消息"""
+        if not self._migrate_legacy(username, chat_id):
+            return
+        with file_lock(self.get_lock_path(username)):
+            self._compact_locked(username, chat_id)
+
+    def delete(self, username: str, chat_id: str) -> bool:
+        """删除对话（包括未迁移的旧文件），返回是否存在"""
+        path = self.get_log_path(username, chat_id)
+        deleted = False
+        with file_lock(self.get_lock_path(username)):
+            for file_path in (path, self.get_legacy_path(username, chat_id)):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                    deleted = True
+            # 早期版本每个对话单独加锁，留下的 <对话>.jsonl.lock 一并删除
+            if os.path.exists(f"{path}.lock"):
+                os.remove(f"{path}.lock")
+        self.index.remove(username, chat_id)
+        self.search.on_delete(username, chat_id)
+        return deleted
+
+    def list_chat_ids(self, username: str) -> list:
+        """列出用户所有对话ID（包括尚未迁移的旧JSON文件）"""
+        chat_folder = self.get_chat_folder(username)
+        if not os.path.isdir(chat_folder):
+            return []
+        chat_ids = []
+        for filename in os.listdir(chat_folder):
+            if filename.endswith('.jsonl'):
+                chat_ids.append(filename[:-6])
+            elif filename.endswith('.json'):
+                chat_ids.append(filename[:-5])
+        return list(dict.fromkeys(chat_ids))
+
+# 全局聊天记录存储实例
+chat_store = ChatStore()
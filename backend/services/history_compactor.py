@@ -0,0 +1,188 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from config import HISTORY_CONFIG
+from services.ai_service import ai_service
+from utils.cache import DiskCache, LRUCache, make_cache_key
+from utils.context_budget import estimate_tokens, fit_text, input_budget
+
+SUMMARY_PROMPT = """请把下面的对话历史压缩为一份摘要，供之后继续对话时参考：
+- 保留用户关心的问题、已经给出的结论、提到的关键事实和数据，以及尚未解决的问题
+- 按对话先后顺序组织，不要添加对话中没有的信息
+- 不超过{limit}字，直接输出摘要，不要其他说明
+
+{previous}新增的对话：
+{dialogue}"""
+
+class HistoryCompactor:
+    """长对话的历史压缩：最近几轮原样保留，更早的对话折叠成滚动摘要，整体控制在token预算内
+
+    更早的对话每累计fold_turns轮折叠一次：在上一份摘要的基础上加入新折叠的对话生成新摘要，
+    按 (模型, 被折叠的全部消息的哈希) 缓存；积累了多批未折叠的对话时逐批折叠，每次只送入一批。
+    摘要在后台线程生成，不增加当前请求的延迟；
+    还没有摘要的旧对话在预算内原样保留，放不下时从最早的开始舍弃。各功能的参数见 HISTORY_CONFIG。
+    """
+
+    VERSION = 1
+
+    def __init__(self):
+        self.model = HISTORY_CONFIG['model'] or ai_service.simple_model
+        self.summary_chars = HISTORY_CONFIG['summary_chars']
+        self.memory = LRUCache(max_entries=512, ttl=HISTORY_CONFIG['cache_ttl'])
+        self.disk = DiskCache(
+            HISTORY_CONFIG['cache_dir'],
+            ttl=HISTORY_CONFIG['cache_ttl'],
+            max_bytes=HISTORY_CONFIG['cache_max_bytes']
+        )
+        self._executor = ThreadPoolExecutor(max_workers=HISTORY_CONFIG['max_workers'], thread_name_prefix='history')
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+
+    def settings(self, feature: str) -> Dict:
+        """某个功能的压缩参数（默认参数 + 该功能单独的设置）"""
+        return {**HISTORY_CONFIG['default'], **HISTORY_CONFIG['features'].get(feature, {})}
+
+    @staticmethod
+    def _normalize(chat_history: List[Dict]) -> List[Dict]:
+        return [
+            {'role': msg['role'], 'content': msg['content']}
+            for msg in chat_history or []
+            if msg.get('role') in ('user', 'assistant') and msg.get('content')
+        ]
+
+    @staticmethod
+    def _prefix_digests(messages: List[Dict]) -> List[str]:
+        """digests[i] 为前i条消息的累积哈希"""
+        digest = hashlib.sha256()
+        digests = [digest.hexdigest()]
+        for msg in messages:
+            digest.update(json.dumps([msg['role'], msg['content']], ensure_ascii=False).encode('utf-8'))
+            digests.append(digest.hexdigest())
+        return digests
+
+    def _cache_key(self, digest: str) -> str:
+        return make_cache_key('history_summary', self.VERSION, self.model, self.summary_chars, digest)
+
+    def _get_summary(self, digest: str) -> Optional[str]:
+        key = self._cache_key(digest)
+        summary = self.memory.get(key)
+        if summary is None:
+            summary = self.disk.get(key)
+            if summary is not None:
+                self.memory.set(key, summary)
+        return summary
+
+    def _fold(self, previous: Optional[str], messages: List[Dict], max_message_tokens: int) -> Optional[str]:
+        """把一批对话折叠进上一份摘要，失败时返回None"""
+        dialogue = '\n\n'.join(
+            f"{'用户' if msg['role'] == 'user' else 'AI'}：{fit_text(msg['content'], max_message_tokens, self.model)}"
+            for msg in messages
+        )
+        # 单条消息都已裁剪，合起来仍可能超出摘要模型的上下文
+        dialogue = fit_text(dialogue, input_budget(self.model) - estimate_tokens(previous, self.model), self.model)
+        prompt = SUMMARY_PROMPT.format(
+            limit=self.summary_chars,
+            previous=f"之前对话的摘要：\n{previous}\n\n" if previous else '',
+            dialogue=dialogue
+        )
+        _, summary = ai_service.extract_thinking(ai_service.simple_chat_complete(prompt, model=self.model))
+        if summary and not summary.startswith('错误：'):
+            return summary
+        print(f"对话历史摘要失败: {summary}")
+        return None
+
+    def _summarize(self, key: str, digests: List[str], previous: Optional[str], messages: List[Dict],
+                   start: int, target: int, fold: int, max_message_tokens: int):
+        """从start到target逐批折叠（每批fold条消息），每一批的摘要都写入缓存（在后台线程执行）"""
+        try:
+            for boundary in range(start + fold, target + 1, fold):
+                previous = self._fold(previous, messages[boundary - fold:boundary], max_message_tokens)
+                if previous is None:
+                    return
+                boundary_key = self._cache_key(digests[boundary])
+                self.memory.set(boundary_key, previous)
+                self.disk.set(boundary_key, previous)
+        except Exception as e:
+            print(f"对话历史摘要失败: {str(e)}")
+        finally:
+            with self._pending_lock:
+                self._pending.discard(key)
+
+    def _schedule(self, digests: List[str], previous: Optional[str], messages: List[Dict],
+                  start: int, target: int, fold: int, max_message_tokens: int):
+        key = self._cache_key(digests[target])
+        with self._pending_lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(
+            self._summarize, key, digests, previous, messages, start, target, fold, max_message_tokens
+        )
+
+    def compact(self, chat_history: List[Dict], feature: str, budget: int,
+                model: str = None) -> Tuple[Optional[str], List[Dict]]:
+        """压缩对话历史，返回 (更早对话的摘要或None, 原样保留的消息)，两者合计不超过budget个token（按model估算）"""
+        settings = self.settings(feature)
+        messages = self._normalize(chat_history)
+        keep = settings['keep_turns'] * 2
+        fold = max(settings['fold_turns'], 1) * 2
+
+        summary, start = None, 0
+        older = len(messages) - keep
+        if settings['summarize'] and older >= fold:
+            digests = self._prefix_digests(messages)
+            target = older - older % fold
+            # 找到最近一次折叠的摘要，再把之后的旧对话折叠进去
+            for boundary in range(target, 0, -fold):
+                summary = self._get_summary(digests[boundary])
+                if summary is not None:
+                    start = boundary
+                    break
+            if start < target:
+                self._schedule(digests, summary, messages, start, target, fold, settings['max_message_tokens'])
+
+        remaining = budget - estimate_tokens(summary, model)
+        kept = [
+            {'role': msg['role'], 'content': fit_text(msg['content'], settings['max_message_tokens'], model)}
+            for msg in messages[start:]
+        ]
+        sizes = [estimate_tokens(msg['content'], model) for msg in kept]
+        # 超出预算时从最早的开始舍弃，至少保留最近一轮
+        while len(kept) > 2 and sum(sizes) > remaining:
+            kept.pop(0)
+            sizes.pop(0)
+            # 舍弃后让历史从用户消息开始
+            if kept[0]['role'] == 'assistant' and len(kept) > 2:
+                kept.pop(0)
+                sizes.pop(0)
+        return summary, kept
+
+    def build_messages(self, feature: str, chat_history: List[Dict], user_message: str,
+                       system_prompt: str = None, model: str = None) -> List[Dict]:
+        """组装发送给模型的消息：系统提示（附上更早对话的摘要）+ 压缩后的历史 + 新消息"""
+        model = model or ai_service.simple_model
+        settings = self.settings(feature)
+        chat_history = self._normalize(chat_history)
+        if chat_history and chat_history[-1]['role'] == 'user' and chat_history[-1]['content'].strip() == user_message:
+            # 客户端发送的历史中已包含本条消息
+            chat_history = chat_history[:-1]
+        budget = min(
+            settings['max_tokens'],
+            input_budget(model) - estimate_tokens(system_prompt, model) - estimate_tokens(user_message, model)
+        )
+        summary, history = self.compact(chat_history, feature, max(budget, settings['max_message_tokens']), model)
+
+        messages = []
+        if summary:
+            summary_section = f"以下是与用户之前对话的摘要，供继续对话时参考：\n{summary}"
+            system_prompt = f"{system_prompt}\n\n{summary_section}" if system_prompt else summary_section
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.extend(history)
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+# 全局对话历史压缩实例
+history_compactor = HistoryCompactor()
@@ -0,0 +1,82 @@
+import threading
+from typing import Dict, Generator, Optional
+from config import LLM_CACHE_CONFIG
+from utils.cache import LRUCache, DiskCache, make_cache_key
+
+class LLMResponseCache:
+    """按 (模型, 消息, 温度) 内容寻址的大模型响应缓存，内存LRU + 磁盘两级"""
+
+    def __init__(self):
+        self.enabled = LLM_CACHE_CONFIG['enabled']
+        self.replay_chunk_size = LLM_CACHE_CONFIG['replay_chunk_size']
+        self.memory = LRUCache(
+            max_entries=LLM_CACHE_CONFIG['memory_max_entries'],
+            ttl=LLM_CACHE_CONFIG['ttl']
+        )
+        self.disk = None
+        if self.enabled and LLM_CACHE_CONFIG['disk_enabled']:
+            self.disk = DiskCache(
+                LLM_CACHE_CONFIG['disk_dir'],
+                ttl=LLM_CACHE_CONFIG['ttl'],
+                max_bytes=LLM_CACHE_CONFIG['disk_max_bytes']
+            )
+
+        self._stats_lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+
+    def make_key(self, model: str, messages: list, temperature: float) -> str:
+        return make_cache_key(model, messages, temperature)
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        """查找缓存，内存未命中时回落到磁盘并回填内存"""
+        content = self.memory.get(key)
+        if content is not None:
+            self._count('memory_hits')
+            return content
+
+        if self.disk is not None:
+            content = self.disk.get(key)
+            if content is not None:
+                self.memory.set(key, content)
+                self._count('disk_hits')
+                return content
+
+        self._count('misses')
+        return None
+
+    def set(self, key: str, content: str):
+        if len(content) > LLM_CACHE_CONFIG['max_item_chars']:
+            return
+        self.memory.set(key, content)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, content)
+            except OSError as e:
+                print(f"写入LLM磁盘缓存失败: {str(e)}")
+        self._count('stores')
+
+    def replay(self, content: str) -> Generator[str, None, None]:
+        """把缓存的完整回复按固定大小切块，以流的形式重新输出"""
+        size = self.replay_chunk_size
+        for i in range(0, len(content), size):
+            yield content[i:i + size]
+
+    def get_stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats.update({
+            'enabled': self.enabled,
+            'hits': hits,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'memory_entries': len(self.memory)
+        })
+        return stats
+
+# 全局LLM响应缓存实例
+llm_cache = LLMResponseCache()
@@ -1,20 +1,143 @@
 import pytesseract
 from PIL import Image
-import cv2
-import numpy as np
 import os
+import re
+import atexit
 import tempfile
+import threading
 import time
-from typing import List, Dict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Generator, Tuple
+from config import OCR_CONFIG
+from utils.cache import DiskCache, make_cache_key, file_sha256
+from utils.file_handler import save_content_addressed
+from utils.image_preprocess import preprocess_for_ocr, legacy_preprocess, PREPROCESS_VERSION, PREPROCESS_CONFIG_KEYS
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+def _ocr_worker_init():
+    """OCR进程池子进程启动时预先加载Tesseract引擎，之后每张图片不再重复加载语言模型"""
+    ocr_service.warm_up()
+
+def _ocr_worker(image_path: str, timeout: float) -> Dict:
+    """在OCR进程池的子进程中执行"""
+    return ocr_service.extract_text_from_image(image_path, timeout)
 
 class OCRService:
     def __init__(self):
         # 配置Tesseract路径（如果需要）
         # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-        pass
+        self.max_workers = OCR_CONFIG['max_workers']
+        self.image_timeout = OCR_CONFIG['image_timeout']
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # 进程池最近一次完成任务的时间（所有请求共用），用于判断进程池是否整体卡住
+        self._pool_progress = time.monotonic()
+        # 常驻Tesseract引擎（每个进程一个，按进程号区分，避免子进程沿用父进程的引擎）
+        self.engine = OCR_CONFIG['engine']
+        self._api = None
+        self._api_pid = None
+        self._api_failed = False
+        self._api_lock = threading.Lock()
+        # 按图片内容哈希缓存识别结果，同一张图片在不同功能中重复上传时不再识别
+        self.cache = None
+        if OCR_CONFIG['cache_enabled']:
+            self.cache = DiskCache(OCR_CONFIG['cache_dir'], max_bytes=OCR_CONFIG['cache_max_bytes'])
     
-    def extract_text_from_image(self, image_path: str) -> Dict:
-        """从单个图片提取文本"""
+    def _cache_key(self, image_path: str, engine: str):
+        """图片内容 + 预处理版本与参数 + 识别引擎、语言与参数，读取失败时返回None"""
+        try:
+            image_hash = file_sha256(image_path)
+        except OSError:
+            return None
+        return make_cache_key(
+            'ocr',
+            image_hash,
+            PREPROCESS_VERSION,
+            {key: OCR_CONFIG[key] for key in PREPROCESS_CONFIG_KEYS},
+            engine,
+            OCR_CONFIG['lang'],
+            OCR_CONFIG['tesseract_config']
+        )
+    
+    def _use_tesserocr(self) -> bool:
+        if self.engine == 'pytesseract' or tesserocr is None or self._api_failed:
+            return False
+        return True
+    
+    def active_engine(self) -> str:
+        """当前进程识别时会使用的引擎名称"""
+        return 'tesserocr' if self._use_tesserocr() else 'pytesseract'
+    
+    def _get_api(self):
+        """懒加载当前进程的常驻引擎（调用方需持有self._api_lock），加载失败时返回None并改用pytesseract"""
+        if self._api is not None and self._api_pid == os.getpid():
+            return self._api
+        
+        options = dict(re.findall(r'--(oem|psm)\s+(\d+)', OCR_CONFIG['tesseract_config']))
+        try:
+            self._api = tesserocr.PyTessBaseAPI(
+                lang=OCR_CONFIG['lang'],
+                oem=int(options.get('oem', tesserocr.OEM.DEFAULT)),
+                psm=int(options.get('psm', tesserocr.PSM.AUTO))
+            )
+            self._api_pid = os.getpid()
+            return self._api
+        except Exception as e:
+            self._api = None
+            self._api_failed = True
+            print(f"Tesseract引擎加载失败，改用pytesseract: {str(e)}")
+            return None
+    
+    def warm_up(self):
+        """预先加载常驻引擎"""
+        if self._use_tesserocr():
+            with self._api_lock:
+                self._get_api()
+    
+    def _recognize(self, image: Image, timeout: float = 0) -> Tuple[str, str]:
+        """识别单张预处理后的图片，返回 (文本, 实际使用的引擎)：优先使用常驻引擎，不可用时每张图片调用一次tesseract命令"""
+        if self._use_tesserocr():
+            with self._api_lock:
+                api = self._get_api()
+                if api is not None:
+                    try:
+                        api.SetImage(image)
+                        if not api.Recognize(timeout=int(timeout * 1000)):
+                            raise RuntimeError(f"识别失败或超时（超过{timeout}秒）")
+                        return api.GetUTF8Text(), 'tesserocr'
+                    finally:
+                        api.Clear()
+        
+        return pytesseract.image_to_string(
+            image, 
+            lang=OCR_CONFIG['lang'],
+            config=OCR_CONFIG['tesseract_config'],
+            timeout=timeout
+        ), 'pytesseract'
+    
+    def _get_pool(self):
+        """懒加载OCR进程池，max_workers为0时返回None（串行识别）"""
+        if self.max_workers <= 0:
+            return None
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_ocr_worker_init)
+            return self._pool
+    
+    def shutdown(self):
+        """关闭进程池；进程池损坏（例如子进程崩溃）时也用它丢弃，下次使用时重建"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+    
+    def extract_text_from_image(self, image_path: str, timeout: float = 0) -> Dict:
+        """从单个图片提取文本（timeout为Tesseract识别超时秒数，0表示不限制）"""
         try:
             # 读取图片
             image = Image.open(image_path)
@@ -27,11 +150,7 @@ class OCRService:
             processed_image = self._preprocess_image(image)
             
             # OCR识别
-            text = pytesseract.image_to_string(
-                processed_image, 
-                lang='chi_sim+eng',  # 支持中英文
-                config='--oem 3 --psm 6'
-            )
+            text, engine = self._recognize(processed_image, timeout)
             
             # 清理文本
             cleaned_text = self._clean_text(text)
@@ -40,6 +159,7 @@ class OCRService:
                 'success': True,
                 'text': cleaned_text,
                 'word_count': len(cleaned_text.split()),
+                'engine': engine,
                 'image_path': image_path
             }
             
@@ -50,41 +170,173 @@ class OCRService:
                 'image_path': image_path
             }
     
+    def _error_result(self, image_path: str, error: str) -> Dict:
+        return {
+            'success': False,
+            'error': error,
+            'image_path': image_path
+        }
+    
+    def iter_text_from_multiple_images(self, image_paths: List[str]) -> Generator[Tuple[int, Dict], None, None]:
+        """并发识别多张图片，按完成顺序产出 (图片序号, 结果)；命中缓存的图片直接产出，内容相同的图片只识别一次"""
+        if not image_paths:
+            return
+        
+        engine = self.active_engine()
+        groups = {}
+        for index, image_path in enumerate(image_paths):
+            key = self._cache_key(image_path, engine) if self.cache else None
+            cached = self.cache.get(key) if key else None
+            if cached is not None:
+                yield index, dict(cached, image_path=image_path)
+                continue
+            groups.setdefault(key or image_path, (key, []))[1].append(index)
+        
+        if not groups:
+            return
+        
+        # 每组只识别第一张，结果分发给组内所有序号
+        leaders = {indices[0]: (key, indices) for key, indices in groups.values()}
+        for index, result in self._iter_uncached(image_paths, list(leaders)):
+            key, indices = leaders[index]
+            # 子进程加载常驻引擎失败时会改用pytesseract，这样的结果不写入按tesserocr计算的缓存键
+            if key and result['success'] and result.get('engine') == engine:
+                self.cache.set(key, result)
+            for member in indices:
+                yield member, dict(result, image_path=image_paths[member])
+    
+    def _iter_uncached(self, image_paths: List[str], indices: List[int]) -> Generator[Tuple[int, Dict], None, None]:
+        """在进程池中并发识别image_paths中指定序号的图片，按完成顺序产出 (图片序号, 结果)"""
+        pool = self._get_pool()
+        if pool is None:
+            for index in indices:
+                yield index, self.extract_text_from_image(image_paths[index], self.image_timeout)
+            return
+        
+        futures = {
+            pool.submit(_ocr_worker, image_paths[index], self.image_timeout): index
+            for index in indices
+        }
+        for future in futures:
+            future.add_done_callback(self._record_pool_progress)
+        
+        # Tesseract本身受单张超时限制；这里再从每张图片实际开始识别时计时，防止预处理卡死。
+        # 进程池被其他请求占满时排队的图片不计时；进程池会提前把一个任务标记为运行中，所以上限放宽到两倍
+        limit = self.image_timeout * 2 + 10
+        started = {}
+        submitted = time.monotonic()
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                for future in done:
+                    index = futures[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        self.shutdown()
+                        result = self._error_result(image_paths[index], f"OCR进程异常退出: {str(e)}")
+                    except Exception as e:
+                        result = self._error_result(image_paths[index], str(e))
+                    yield index, result
+                
+                for future in pending:
+                    if future not in started and future.running():
+                        started[future] = now
+                # 超时的图片放弃等待；整个进程池（包括其他请求的任务）长时间没有完成任何任务时，排队的图片一并放弃
+                stalled = now - max(submitted, self._pool_progress) > limit
+                expired = {future for future in pending if stalled or now - started.get(future, now) > limit}
+                for future in expired:
+                    index = futures[future]
+                    future.cancel()
+                    print(f"OCR超时: {image_paths[index]}")
+                    yield index, self._error_result(image_paths[index], f"识别超时（超过{self.image_timeout}秒）")
+                pending -= expired
+        finally:
+            # 调用方提前停止时取消尚未开始的任务
+            for future in futures:
+                future.cancel()
+    
+    def _record_pool_progress(self, future=None):
+        self._pool_progress = time.monotonic()
+    
     def extract_text_from_multiple_images(self, image_paths: List[str]) -> List[Dict]:
-        """从多个图片提取文本"""
-        results = []
-        for image_path in image_paths:
-            result = self.extract_text_from_image(image_path)
-            results.append(result)
+        """从多个图片提取文本（并发识别，结果顺序与输入一致）"""
+        results = [None] * len(image_paths)
+        for index, result in self.iter_text_from_multiple_images(image_paths):
+            results[index] = result
+        return results
+    
+    def stream_text_from_multiple_images(self, image_paths: List[str], writer) -> Generator[str, None, List[Dict]]:
+        """并发识别多张图片，每完成一张输出一个ocr_progress事件；生成器的返回值为按输入顺序排列的结果"""
+        results = [None] * len(image_paths)
+        done = 0
+        for index, result in self.iter_text_from_multiple_images(image_paths):
+            results[index] = result
+            done += 1
+            yield writer.event(
+                'ocr_progress',
+                index=index,
+                done=done,
+                total=len(image_paths),
+                success=result['success'],
+                text=result.get('text', ''),
+                error=result.get('error', '')
+            )
         return results
     
     def _preprocess_image(self, image: Image) -> Image:
-        """图片预处理，提高OCR识别率"""
+        """图片预处理，提高OCR识别率（按噪声和分辨率自适应，干净的截图跳过去噪和二值化）"""
         try:
-            # 转换为numpy数组
-            img_array = np.array(image)
-            
-            # 转换为灰度图
-            if len(img_array.shape) == 3:
-                gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-            else:
-                gray = img_array
-            
-            # 去噪
-            denoised = cv2.fastNlMeansDenoising(gray)
-            
-            # 二值化
-            _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            
-            # 转换回PIL图片
-            processed_image = Image.fromarray(binary)
-            
+            processed_image, _ = preprocess_for_ocr(image)
             return processed_image
             
         except Exception:
             # 如果预处理失败，返回原图
             return image
     
+    def benchmark_preprocessing(self, image_paths: List[str]) -> List[Dict]:
+        """预处理基准测试：对每张图片分别统计旧流程和自适应流程各阶段的耗时与识别出的字符数"""
+        def recognize(image) -> Dict:
+            started = time.perf_counter()
+            text = self._clean_text(self._recognize(image, self.image_timeout)[0])
+            return {
+                'ocr_ms': round((time.perf_counter() - started) * 1000, 2),
+                'chars': len(''.join(text.split()))
+            }
+        
+        reports = []
+        for image_path in image_paths:
+            try:
+                image = Image.open(image_path)
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
+                
+                started = time.perf_counter()
+                legacy_image = legacy_preprocess(image)
+                legacy = {'preprocess_ms': round((time.perf_counter() - started) * 1000, 2)}
+                legacy.update(recognize(legacy_image))
+                
+                _, stages = preprocess_for_ocr(image, keep_intermediate=True)
+                for stage in stages:
+                    # 对每个阶段的输出都识别一次，得到逐阶段的字符产出
+                    stage.update(recognize(stage.pop('image')))
+                
+                reports.append({
+                    'success': True,
+                    'image_path': image_path,
+                    'legacy': legacy,
+                    'adaptive': {
+                        'preprocess_ms': round(sum(stage['ms'] for stage in stages), 2),
+                        'chars': stages[-1]['chars'],
+                        'stages': stages
+                    }
+                })
+            except Exception as e:
+                reports.append(self._error_result(image_path, str(e)))
+        return reports
+    
     def _clean_text(self, text: str) -> str:
         """清理OCR识别的文本"""
         # 移除多余的空白字符
@@ -99,18 +351,13 @@ class OCRService:
         return '\n'.join(cleaned_lines)
     
     def save_uploaded_images(self, files) -> List[str]:
-        """保存上传的图片文件"""
+        """保存上传的图片文件（按内容哈希命名，重复上传的图片不再另存一份）"""
         saved_paths = []
         upload_dir = 'data/uploads/images'
-        os.makedirs(upload_dir, exist_ok=True)
         
         for file in files:
             if file and self._is_image_file(file.filename):
-                # 生成唯一文件名
-                filename = f"{int(time.time())}_{file.filename}"
-                file_path = os.path.join(upload_dir, filename)
-                file.save(file_path)
-                saved_paths.append(file_path)
+                saved_paths.append(save_content_addressed(file, upload_dir))
         
         return saved_paths
     
@@ -121,3 +368,4 @@ class OCRService:
 
 # 全局OCR服务实例
 ocr_service = OCRService()
+atexit.register(ocr_service.shutdown)
@@ -0,0 +1,78 @@
+from typing import Dict, List, Optional, Tuple
+from config import RETRIEVAL_CONFIG
+from utils.bm25 import BM25Index
+from utils.context_budget import estimate_tokens, fit_text, input_budget, split_into_chunks
+
+class PassageRetriever:
+    """智能伴读的文档检索：把文档切成段落建立BM25索引，每次提问只把最相关的几段放进提示词
+
+    短文档（不超过full_context_tokens）不建索引，直接整篇放入。
+    """
+
+    def __init__(self):
+        self.passage_tokens = RETRIEVAL_CONFIG['passage_tokens']
+        self.top_k = RETRIEVAL_CONFIG['top_k']
+        self.context_tokens = RETRIEVAL_CONFIG['context_tokens']
+        self.full_context_tokens = RETRIEVAL_CONFIG['full_context_tokens']
+        self.k1 = RETRIEVAL_CONFIG['k1']
+        self.b = RETRIEVAL_CONFIG['b']
+
+    def build(self, content: str) -> Optional[Dict]:
+        """为文档建立段落索引，短文档返回None"""
+        if not content or estimate_tokens(content) <= self.full_context_tokens:
+            return None
+        passages = split_into_chunks(content, self.passage_tokens)
+        return {'passages': passages, 'index': BM25Index(passages, k1=self.k1, b=self.b)}
+
+    def nbytes(self, retrieval: Optional[Dict]) -> int:
+        """索引占用内存的估算值（段落文本 + 倒排数组）"""
+        if not retrieval:
+            return 0
+        return sum(len(passage.encode('utf-8')) for passage in retrieval['passages']) + retrieval['index'].nbytes
+
+    def select(self, content: str, retrieval: Optional[Dict], query: str, model: str) -> Tuple[str, bool]:
+        """按问题挑选放入提示词的内容，返回 (内容, 是否为检索出的片段)
+
+        片段按原文顺序排列并标注序号；没有命中任何段落时（如"概括一下"）退回到按预算保留文档首尾。
+        """
+        budget = min(self.context_tokens, input_budget(model))
+        if retrieval is None or estimate_tokens(content, model) <= budget:
+            return fit_text(content, input_budget(model), model), False
+
+        passages = retrieval['passages']
+        hits = retrieval['index'].top_k(query, self.top_k)
+        if not hits:
+            return fit_text(content, budget, model), False
+
+        selected = []
+        used = 0
+        # 文档开头通常是标题和导语，放得下时一并带上
+        for passage_id in [passage_id for passage_id, _ in hits] + [0]:
+            if passage_id in selected:
+                continue
+            tokens = estimate_tokens(passages[passage_id], model)
+            if used + tokens > budget:
+                continue
+            selected.append(passage_id)
+            used += tokens
+
+        if not selected:
+            # 最相关的段落本身就超出预算：裁剪后放入
+            passage_id = hits[0][0]
+            return f"[片段 {passage_id + 1}/{len(passages)}]\n{fit_text(passages[passage_id], budget, model)}", True
+
+        return self._format(passages, sorted(selected)), True
+
+    @staticmethod
+    def _format(passages: List[str], selected: List[int]) -> str:
+        parts = []
+        previous = None
+        for passage_id in selected:
+            if previous is not None and passage_id != previous + 1:
+                parts.append('……')
+            parts.append(f"[片段 {passage_id + 1}/{len(passages)}]\n{passages[passage_id]}")
+            previous = passage_id
+        return '\n\n'.join(parts)
+
+# 全局文档检索实例
+passage_retriever = PassageRetriever()
@@ -0,0 +1,178 @@
+import atexit
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Generator, List
+from config import PDF_CONFIG
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+def _extract_page_range(file_path: str, start: int, end: int, backend: str) -> List[str]:
+    """提取 [start, end) 页的文本（在PDF进程池的子进程中执行，每个任务单独打开文档）"""
+    if backend == 'pypdfium2':
+        pdf = pypdfium2.PdfDocument(file_path)
+        try:
+            texts = []
+            for index in range(start, end):
+                page = pdf[index]
+                textpage = page.get_textpage()
+                texts.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+            return texts
+        finally:
+            pdf.close()
+
+    import PyPDF2
+    with open(file_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        return [reader.pages[index].extract_text() or '' for index in range(start, end)]
+
+class PDFExtractor:
+    """PDF文本提取：按页产出的生成器，长文档按页段分给进程池并行提取，受页数和字符数预算限制"""
+
+    def __init__(self):
+        self.backend = PDF_CONFIG['backend']
+        self.max_workers = PDF_CONFIG['max_workers']
+        self.pages_per_task = PDF_CONFIG['pages_per_task']
+        self.parallel_min_pages = PDF_CONFIG['parallel_min_pages']
+        self.max_pages = PDF_CONFIG['max_pages']
+        self.max_chars = PDF_CONFIG['max_chars']
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def get_backend(self) -> str:
+        """实际使用的提取后端：指定或自动选择pypdfium2时需已安装，否则使用PyPDF2"""
+        if self.backend in ('auto', 'pypdfium2') and pypdfium2 is not None:
+            return 'pypdfium2'
+        return 'pypdf2'
+
+    def _get_pool(self):
+        """懒加载PDF提取进程池，max_workers为0时返回None（在当前线程提取）"""
+        if self.max_workers <= 0:
+            return None
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+    def shutdown(self):
+        """关闭进程池；进程池损坏时也用它丢弃，下次使用时重建"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def page_count(self, file_path: str, backend: str = None) -> int:
+        backend = backend or self.get_backend()
+        if backend == 'pypdfium2':
+            pdf = pypdfium2.PdfDocument(file_path)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+
+        import PyPDF2
+        with open(file_path, 'rb') as f:
+            return len(PyPDF2.PdfReader(f).pages)
+
+    def _iter_ranges(self, file_path: str, ranges: List[tuple], backend: str) -> Generator[List[str], None, None]:
+        """按顺序产出每个页段的文本列表；并行时最多同时提交 2 * max_workers 个页段，控制内存占用"""
+        pool = None
+        if ranges and ranges[-1][1] >= self.parallel_min_pages:
+            pool = self._get_pool()
+        if pool is None:
+            for start, end in ranges:
+                yield _extract_page_range(file_path, start, end, backend)
+            return
+
+        pending = iter(ranges)
+        window = deque()
+        try:
+            for start, end in pending:
+                window.append(pool.submit(_extract_page_range, file_path, start, end, backend))
+                if len(window) >= self.max_workers * 2:
+                    break
+            while window:
+                try:
+                    texts = window.popleft().result()
+                except BrokenProcessPool:
+                    self.shutdown()
+                    raise
+                for start, end in pending:
+                    window.append(pool.submit(_extract_page_range, file_path, start, end, backend))
+                    break
+                yield texts
+        finally:
+            # 调用方提前停止（或超出预算）时取消尚未开始的页段
+            for future in window:
+                future.cancel()
+
+    def iter_pages(self, file_path: str, max_pages: int = None, max_chars: int = None) -> Generator[Dict, None, Dict]:
+        """按页序产出 {'page': 页码(从1开始), 'total': 总页数, 'text': 文本}
+
+        超出页数或字符数预算时停止（最后一页按剩余字符数截断）。
+        生成器的返回值为统计信息：已提取页数、总页数、字符数、是否截断、使用的后端。
+        """
+        max_pages = max_pages or self.max_pages
+        max_chars = max_chars or self.max_chars
+        backend = self.get_backend()
+        total = self.page_count(file_path, backend)
+        limit = min(total, max_pages)
+        ranges = [
+            (start, min(start + self.pages_per_task, limit))
+            for start in range(0, limit, self.pages_per_task)
+        ]
+
+        stats = {'pages': 0, 'total': total, 'chars': 0, 'truncated': limit < total, 'backend': backend}
+        page = 0
+        for texts in self._iter_ranges(file_path, ranges, backend):
+            for text in texts:
+                page += 1
+                remaining = max_chars - stats['chars']
+                if len(text) > remaining:
+                    text = text[:remaining]
+                    stats['truncated'] = True
+                stats['pages'] = page
+                stats['chars'] += len(text)
+                yield {'page': page, 'total': total, 'text': text}
+                if stats['chars'] >= max_chars:
+                    return stats
+        return stats
+
+    def _format(self, pages: List[str], stats: Dict) -> str:
+        text = '\n'.join(pages)
+        if stats['truncated']:
+            text += f"\n\n（文档过长，仅提取了前 {stats['pages']}/{stats['total']} 页的 {stats['chars']} 个字符）"
+        return text
+
+    def extract_text(self, file_path: str) -> str:
+        """提取整个文档的文本（受预算限制）"""
+        pages = []
+        generator = self.iter_pages(file_path)
+        while True:
+            try:
+                pages.append(next(generator)['text'])
+            except StopIteration as stop:
+                return self._format(pages, stop.value)
+
+    def stream_text(self, file_path: str, writer) -> Generator[str, None, str]:
+        """逐页提取，每完成一页输出一个pdf_progress事件（只带文件名，不暴露服务器上的路径）；生成器的返回值为提取的文本"""
+        pages = []
+        generator = self.iter_pages(file_path)
+        while True:
+            try:
+                item = next(generator)
+            except StopIteration as stop:
+                return self._format(pages, stop.value)
+            pages.append(item['text'])
+            yield writer.event('pdf_progress', page=item['page'], total=item['total'], file=os.path.basename(file_path))
+
+# 全局PDF提取实例
+pdf_extractor = PDFExtractor()
+atexit.register(pdf_extractor.shutdown)
@@ -0,0 +1,203 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from config import READING_SESSION_CONFIG
+from services.passage_retriever import passage_retriever
+
+# 允许落盘的会话ID（防止用客户端传入的ID拼出任意路径）
+_SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+class ReadingSessionStore:
+    """智能伴读的服务端会话：按session_id保存解析出的文档和对话，聊天请求只需携带新消息
+
+    创建会话时为长文档建立段落检索索引（见PassageRetriever）。
+    内存中按最近访问顺序保存，超过会话数或内存上限时淘汰最久未用的会话；
+    开启落盘时，超出上限被淘汰的会话写入磁盘（不含索引），下次访问时重新载入并重建索引。超过TTL未访问的会话直接丢弃。
+    """
+
+    def __init__(self):
+        self.max_sessions = READING_SESSION_CONFIG['max_sessions']
+        self.max_memory_bytes = READING_SESSION_CONFIG['max_memory_bytes']
+        self.ttl = READING_SESSION_CONFIG['ttl']
+        self.spill_dir = READING_SESSION_CONFIG['spill_dir'] if READING_SESSION_CONFIG['spill_enabled'] else None
+        self._sessions = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    @staticmethod
+    def _text_bytes(text: str) -> int:
+        return len(text.encode('utf-8')) if text else 0
+
+    def _session_bytes(self, session: Dict) -> int:
+        return self._text_bytes(session['content']) + passage_retriever.nbytes(session.get('retrieval')) + sum(
+            self._text_bytes(msg['content']) for msg in session['messages']
+        )
+
+    def _spill_path(self, session_id: str) -> Optional[str]:
+        if not self.spill_dir or not _SESSION_ID_PATTERN.match(session_id):
+            return None
+        return os.path.join(self.spill_dir, f"{session_id}.json")
+
+    def _expired(self, session: Dict) -> bool:
+        return self.ttl and session['updated_at'] + self.ttl < time.time()
+
+    def _put_locked(self, session: Dict):
+        old = self._sessions.pop(session['session_id'], None)
+        if old is not None:
+            self._memory_bytes -= old['size']
+        session['size'] = self._session_bytes(session)
+        self._sessions[session['session_id']] = session
+        self._memory_bytes += session['size']
+        self._evict_locked()
+
+    def _evict_locked(self):
+        """淘汰过期会话，再按最久未用淘汰到会话数和内存上限以内（最新的会话总是保留）"""
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            expired = self._expired(session)
+            over_limit = len(self._sessions) > self.max_sessions or self._memory_bytes > self.max_memory_bytes
+            if not expired and (not over_limit or len(self._sessions) == 1):
+                break
+            del self._sessions[session_id]
+            self._memory_bytes -= session['size']
+            if not expired:
+                self._spill(session)
+
+    def _spill(self, session: Dict):
+        path = self._spill_path(session['session_id'])
+        if not path:
+            return
+        data = {key: value for key, value in session.items() if key not in ('size', 'retrieval')}
+        tmp_path = f"{path}.{os.getpid()}_{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"会话落盘失败 {session['session_id']}: {str(e)}")
+
+    def _load_spilled(self, session_id: str) -> Optional[Dict]:
+        path = self._spill_path(session_id)
+        if not path:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            return None
+        finally:
+            # 载入内存后删除磁盘副本，之后以内存中的为准
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if self._expired(session):
+            return None
+        session['retrieval'] = passage_retriever.build(session['content'])
+        return session
+
+    def _sweep_spilled(self):
+        """每小时最多一次：删除磁盘上超过TTL未访问的会话"""
+        now = time.time()
+        if not self.spill_dir or not self.ttl or now - self._last_sweep < 3600:
+            return
+        self._last_sweep = now
+        try:
+            names = os.listdir(self.spill_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if os.path.getmtime(path) + self.ttl < now:
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def create(self, session_id: str, content: str, content_info: Dict = None, content_type: str = None,
+               messages: List[Dict] = None) -> Dict:
+        """保存解析出的文档，开始（或重建）一个会话"""
+        now = time.time()
+        session = {
+            'session_id': session_id,
+            'content': content,
+            'content_info': content_info or {},
+            'content_type': content_type,
+            'messages': [
+                {'role': msg['role'], 'content': msg['content']}
+                for msg in (messages or []) if msg.get('role') in ('user', 'assistant') and msg.get('content')
+            ],
+            'retrieval': passage_retriever.build(content),
+            'created_at': now,
+            'updated_at': now
+        }
+        with self._lock:
+            self._put_locked(session)
+        self._sweep_spilled()
+        return session
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """取出会话（必要时从磁盘载入）并刷新访问时间；不存在或已过期时返回None"""
+        if not session_id:
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and self._expired(session):
+                del self._sessions[session_id]
+                self._memory_bytes -= session['size']
+                session = None
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session['updated_at'] = time.time()
+                return session
+
+        # 从磁盘载入并重建索引（在锁外进行，不阻塞其他会话）
+        session = self._load_spilled(session_id)
+        if session is None:
+            return None
+        session['updated_at'] = time.time()
+        with self._lock:
+            self._put_locked(session)
+        return session
+
+    def append_messages(self, session_id: str, messages: List[Dict]) -> bool:
+        """在会话末尾追加一轮对话，会话已不在时返回False"""
+        session = self.get(session_id)
+        if session is None:
+            return False
+        added = [{'role': msg['role'], 'content': msg['content']} for msg in messages]
+        size = sum(self._text_bytes(msg['content']) for msg in added)
+        with self._lock:
+            session['messages'].extend(added)
+            session['updated_at'] = time.time()
+            if self._sessions.get(session_id) is session:
+                session['size'] += size
+                self._memory_bytes += size
+                self._evict_locked()
+        return True
+
+    def delete(self, session_id: str):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._memory_bytes -= session['size']
+        path = self._spill_path(session_id) if session_id else None
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'sessions': len(self._sessions), 'memory_bytes': self._memory_bytes}
+
+# 全局智能伴读会话存储
+reading_sessions = ReadingSessionStore()
@@ -0,0 +1,99 @@
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from requests.adapters import HTTPAdapter
+from typing import Dict, List
+from config import SEARCH_CONFIG
+from utils.cache import LRUCache
+
+class SearchClient:
+    """共享的搜索客户端：连接池复用、相同查询合并、结果按规范化查询缓存"""
+
+    def __init__(self):
+        self.api_url = SEARCH_CONFIG['api_url']
+        self.deadline = SEARCH_CONFIG['deadline']
+        self.timeout = (SEARCH_CONFIG['connect_timeout'], SEARCH_CONFIG['read_timeout'])
+
+        max_workers = SEARCH_CONFIG['max_workers']
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.cache = LRUCache(
+            max_entries=SEARCH_CONFIG['cache_max_entries'],
+            ttl=SEARCH_CONFIG['cache_ttl']
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='search')
+        # 正在进行中的查询，相同查询共用同一个请求
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """规范化查询：合并空白并忽略大小写"""
+        return ' '.join(query.split()).casefold()
+
+    def _fetch(self, query: str) -> Dict:
+        try:
+            params = {
+                'q': query,
+                'format': 'json'
+            }
+            response = self.session.get(self.api_url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            return {'error': str(e)}
+
+    def _fetch_and_cache(self, key: str, query: str) -> Dict:
+        try:
+            data = self._fetch(query)
+            # 只缓存成功的结果，失败的查询下次重新请求
+            if 'error' not in data:
+                self.cache.set(key, data)
+            return data
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def _submit(self, query: str):
+        """提交查询，返回缓存结果或Future"""
+        key = self.normalize_query(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._executor.submit(self._fetch_and_cache, key, query)
+                self._inflight[key] = future
+            return future
+
+    def search_many(self, queries: List[str], deadline: float = None) -> List[Dict]:
+        """并发搜索多个关键词，结果顺序与输入一致；超过总时限的查询返回超时错误"""
+        deadline = deadline or self.deadline
+        submitted_at = time.monotonic()
+        pending = [self._submit(query) for query in queries]
+
+        results = []
+        for query, item in zip(queries, pending):
+            if isinstance(item, dict):
+                results.append(item)
+                continue
+            remaining = deadline - (time.monotonic() - submitted_at)
+            try:
+                results.append(item.result(timeout=max(remaining, 0)))
+            except FutureTimeoutError:
+                # 放弃等待，请求在后台结束后仍会写入缓存
+                print(f"搜索超时: {query}")
+                results.append({'error': f"搜索超时（超过{deadline}秒）"})
+        return results
+
+    def search(self, query: str, deadline: float = None) -> Dict:
+        """搜索单个关键词"""
+        return self.search_many([query], deadline)[0]
+
+# 全局搜索客户端实例
+search_client = SearchClient()
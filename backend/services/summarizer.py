@@ -0,0 +1,131 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Generator, List
+from config import MAP_REDUCE_CONFIG
+from services.ai_service import ai_service
+from utils.cache import DiskCache, make_cache_key
+from utils.context_budget import estimate_tokens, fit_text, input_budget, split_into_chunks
+
+MAP_PROMPT = """下面是一份长文档中的一个连续片段。请为这个片段写一份摘要：
+- 保留关键事实、数据、人物、机构、时间和主要论点、结论
+- 保持原文的先后顺序，不要添加原文没有的信息
+- 不超过{limit}字，直接输出摘要，不要其他说明
+
+片段内容：
+{text}"""
+
+REDUCE_PROMPT = """下面是一份长文档若干连续部分的摘要（按原文顺序排列）。请把它们合并为一份连贯的摘要：
+- 保留关键事实、数据、人物、机构、时间和主要论点、结论
+- 去掉重复内容，保持原文的先后顺序
+- 不超过{limit}字，直接输出摘要，不要其他说明
+
+各部分摘要：
+{text}"""
+
+class MapReduceSummarizer:
+    """长文档的分段摘要：切块后并发摘要（map），再逐层合并（reduce），直到放得进目标预算
+
+    每个分段/合并的摘要按 (提示词版本, 模型, 输入内容哈希) 缓存在磁盘上，文档修改后重新分析只需重做变化的分段。
+    """
+
+    VERSION = 1
+
+    def __init__(self):
+        self.max_workers = MAP_REDUCE_CONFIG['max_workers']
+        self.chunk_tokens = MAP_REDUCE_CONFIG['chunk_tokens']
+        self.reduce_input_tokens = MAP_REDUCE_CONFIG['reduce_input_tokens']
+        self.summary_chars = MAP_REDUCE_CONFIG['summary_chars']
+        self.model = MAP_REDUCE_CONFIG['model'] or ai_service.simple_model
+        self.cache = DiskCache(
+            MAP_REDUCE_CONFIG['cache_dir'],
+            ttl=MAP_REDUCE_CONFIG['cache_ttl'],
+            max_bytes=MAP_REDUCE_CONFIG['cache_max_bytes']
+        )
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='summarize')
+
+    def needs_summary(self, text: str, model: str) -> bool:
+        """文本超出该模型的输入预算时需要先做分段摘要"""
+        return estimate_tokens(text, model) > input_budget(model)
+
+    def _cache_key(self, kind: str, text: str) -> str:
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return make_cache_key('chunk_summary', self.VERSION, self.model, kind, self.summary_chars, text_hash)
+
+    def _summarize_one(self, kind: str, text: str) -> str:
+        prompt = (MAP_PROMPT if kind == 'map' else REDUCE_PROMPT).format(limit=self.summary_chars, text=text)
+        raw = ai_service.simple_chat_complete(prompt, model=self.model)
+        _, summary = ai_service.extract_thinking(raw)
+        if not summary or summary.startswith('错误：'):
+            # 模型调用失败时退回到裁剪原文，不写入缓存
+            raise RuntimeError(summary or '摘要为空')
+        self.cache.set(self._cache_key(kind, text), summary)
+        return summary
+
+    def _run_level(self, kind: str, texts: List[str], writer, step, label: str) -> Generator[str, None, List[str]]:
+        """并发摘要一层输入，每完成一段输出一个status事件；生成器的返回值为按输入顺序排列的摘要"""
+        results = [None] * len(texts)
+        futures = {}
+        for index, text in enumerate(texts):
+            cached = self.cache.get(self._cache_key(kind, text))
+            if cached is not None:
+                results[index] = cached
+            else:
+                futures[self._executor.submit(self._summarize_one, kind, text)] = index
+
+        cached_count = len(texts) - len(futures)
+        done = cached_count
+        yield writer.event('status', step=step, message=f"{label}：共{len(texts)}段，命中缓存{cached_count}段")
+        try:
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    print(f"{label}第{index + 1}段失败，改用裁剪后的原文: {str(e)}")
+                    results[index] = fit_text(texts[index], self.summary_chars, self.model)
+                done += 1
+                yield writer.event('status', step=step, message=f"{label}：已完成 {done}/{len(texts)}")
+        finally:
+            # 调用方提前停止时取消尚未开始的摘要
+            for future in futures:
+                future.cancel()
+        return results
+
+    def _group(self, summaries: List[str]) -> List[str]:
+        """把相邻的摘要拼成不超过reduce_input_tokens的组"""
+        groups = []
+        current = []
+        used = 0
+        for summary in summaries:
+            tokens = estimate_tokens(summary, self.model)
+            if current and used + tokens > self.reduce_input_tokens:
+                groups.append('\n\n'.join(current))
+                current, used = [], 0
+            current.append(summary)
+            used += tokens
+        if current:
+            groups.append('\n\n'.join(current))
+        return groups
+
+    def summarize(self, text: str, writer, step: int = None, target_tokens: int = None) -> Generator[str, None, str]:
+        """分段摘要并逐层合并到target_tokens以内，过程中输出status事件；生成器的返回值为合并后的摘要"""
+        if target_tokens is None:
+            target_tokens = input_budget(ai_service.complex_model)
+
+        chunks = split_into_chunks(text, self.chunk_tokens, self.model)
+        print(f"长文档分段摘要：{len(text)}字，分为{len(chunks)}段")
+        summaries = yield from self._run_level('map', chunks, writer, step, '分段摘要')
+
+        level = 1
+        while len(summaries) > 1 and estimate_tokens('\n\n'.join(summaries), self.model) > target_tokens:
+            groups = self._group(summaries)
+            if len(groups) == len(summaries):
+                # 每段摘要都已接近合并上限，无法再合并
+                break
+            summaries = yield from self._run_level('reduce', groups, writer, step, f"第{level}层合并")
+            level += 1
+
+        return fit_text('\n\n'.join(summaries), target_tokens, self.model)
+
+# 全局分段摘要实例
+summarizer = MapReduceSummarizer()
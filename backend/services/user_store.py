@@ -0,0 +1,157 @@
+import csv
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+from utils.file_lock import file_lock, append_line
+
+USER_CSV_PATH = 'data/users.csv'
+USER_JOURNAL_PATH = 'data/users.jsonl'
+
+class UserStore:
+    """用户存储：追加写入的JSONL日志 + 内存哈希索引，查询不再逐行扫描文件
+
+    日志每行一条记录（{"op": "create", "username": ...}），写入时加文件锁并一次性追加整行。
+    其他进程追加的记录会在下次查询时按文件偏移增量读入。首次使用时从旧的users.csv导入。
+    """
+
+    def __init__(self, journal_path: str = USER_JOURNAL_PATH, csv_path: str = USER_CSV_PATH):
+        self.journal_path = journal_path
+        self.csv_path = csv_path
+        self._users: Dict[str, Dict] = {}
+        self._offset = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _migrate_from_csv(self):
+        """日志不存在时，把旧CSV中的用户导入到新日志（先写临时文件再替换）"""
+        if os.path.exists(self.journal_path):
+            return
+
+        lines = []
+        if os.path.exists(self.csv_path):
+            with open(self.csv_path, 'r', encoding='utf-8') as file:
+                reader = csv.reader(file)
+                next(reader, None)  # 跳过标题行
+                for row in reader:
+                    if not row or len(row) < 3:
+                        continue
+                    lines.append(json.dumps({
+                        'op': 'create',
+                        'username': row[0],
+                        'password': row[1],
+                        'user_folder': row[2],
+                        'created_at': row[3] if len(row) > 3 else 'Unknown'
+                    }, ensure_ascii=False))
+            print(f"从 {self.csv_path} 导入了 {len(lines)} 个用户")
+
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+            for line in lines:
+                f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def _apply(self, record: Dict):
+        if record.get('op') == 'create' and record.get('username'):
+            self._users.setdefault(record['username'], {
+                'username': record['username'],
+                'password': record.get('password', ''),
+                'user_folder': record.get('user_folder', ''),
+                'created_at': record.get('created_at', 'Unknown')
+            })
+
+    def _catch_up(self):
+        """增量读取日志中自上次以来新增的完整行（调用方需持有self._lock）"""
+        try:
+            size = os.path.getsize(self.journal_path)
+        except OSError:
+            return
+        if size <= self._offset:
+            return
+
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+
+        # 最后一行没有换行符时可能还在写入中，留到下次再读
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line.decode('utf-8')))
+            except (ValueError, UnicodeDecodeError):
+                print(f"跳过损坏的用户记录: {line[:80]!r}")
+        self._offset += end
+
+    def _ends_with_newline(self) -> bool:
+        """日志为空或以换行结尾（上次写入没有中断）"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return True
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) == b'\n'
+        except OSError:
+            return True
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        with file_lock(self.journal_path):
+            self._migrate_from_csv()
+        self._catch_up()
+        self._loaded = True
+
+    def get(self, username: str) -> Optional[Dict]:
+        """按用户名查找用户，O(1)"""
+        with self._lock:
+            self._ensure_loaded()
+            self._catch_up()
+            user = self._users.get(username)
+            return dict(user) if user else None
+
+    def verify(self, username: str, password: str) -> Optional[Dict]:
+        """校验用户名和密码，成功时返回用户信息"""
+        user = self.get(username)
+        if user and user['password'] == password:
+            return user
+        return None
+
+    def create(self, username: str, password: str, user_folder: str) -> bool:
+        """新建用户，用户名已存在时返回False"""
+        with self._lock:
+            self._ensure_loaded()
+            with file_lock(self.journal_path):
+                # 加锁后再同步一次，避免与其他进程同时注册同名用户
+                self._catch_up()
+                if username in self._users:
+                    return False
+                record = {
+                    'op': 'create',
+                    'username': username,
+                    'password': password,
+                    'user_folder': user_folder,
+                    'created_at': datetime.now().isoformat()
+                }
+                line = json.dumps(record, ensure_ascii=False)
+                if not self._ends_with_newline():
+                    # 上次写入被中断留下了半行，先换行隔开，读取时会跳过那半行
+                    line = '\n' + line
+                append_line(self.journal_path, line)
+                self._catch_up()
+            return True
+
+    def count(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            self._catch_up()
+            return len(self._users)
+
+# 全局用户存储实例
+user_store = UserStore()
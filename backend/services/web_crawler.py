@@ -4,12 +4,41 @@ import re
 from urllib.parse import urljoin, urlparse
 import time
 import json
-import asyncio
-import logging
-from playwright.async_api import async_playwright
-import asyncio
-from playwright.async_api import async_playwright
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from config import CRAWLER_CONFIG
+from services.browser_pool import browser_pool
+
+class DomainLimiter:
+    """按域名限制并发数和请求间隔，替代统一的sleep"""
+    
+    def __init__(self, max_concurrency: int, min_interval: float):
+        self.max_concurrency = max_concurrency
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_allowed = {}
+    
+    def _get_semaphore(self, domain: str) -> threading.Semaphore:
+        with self._lock:
+            if domain not in self._semaphores:
+                self._semaphores[domain] = threading.BoundedSemaphore(self.max_concurrency)
+            return self._semaphores[domain]
+    
+    def acquire(self, domain: str):
+        self._get_semaphore(domain).acquire()
+        # 预约下一个可用时间槽，保证同域名请求之间至少间隔min_interval
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_allowed.get(domain, 0))
+            self._next_allowed[domain] = start_at + self.min_interval
+        wait = start_at - now
+        if wait > 0:
+            time.sleep(wait)
+    
+    def release(self, domain: str):
+        self._get_semaphore(domain).release()
 
 class WebCrawler:
     def __init__(self):
@@ -33,6 +62,15 @@ class WebCrawler:
             'juejin.cn',
             'segmentfault.com'
         ]
+        
+        # 所有请求共享的抓取线程池，max_workers即全局并发上限
+        self.max_workers = CRAWLER_CONFIG['max_workers']
+        self.url_deadline = CRAWLER_CONFIG['url_deadline']
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='crawler')
+        self._domain_limiter = DomainLimiter(
+            CRAWLER_CONFIG['per_domain_concurrency'],
+            CRAWLER_CONFIG['per_domain_interval']
+        )
     
     def extract_text_from_url(self, url: str) -> dict:
         """从URL提取文本内容"""
@@ -45,7 +83,7 @@ class WebCrawler:
             
             if force_playwright:
                 print("检测到需要JavaScript渲染的网站，使用Playwright...")
-                playwright_result = asyncio.run(self._extract_with_playwright(url))
+                playwright_result = browser_pool.run(self._extract_with_playwright(url))
                 if playwright_result and playwright_result.get('success'):
                     return playwright_result
                 print("Playwright提取失败，尝试常规方法...")
@@ -68,7 +106,7 @@ class WebCrawler:
             if self._detect_anti_crawler_page(soup):
                 print("检测到反爬虫页面，尝试使用Playwright...")
                 if self.use_playwright_fallback:
-                    playwright_result = asyncio.run(self._extract_with_playwright(url))
+                    playwright_result = browser_pool.run(self._extract_with_playwright(url))
                     if playwright_result and playwright_result.get('success'):
                         return playwright_result
             
@@ -77,7 +115,7 @@ class WebCrawler:
             # 如果内容提取失败或太少，且启用了Playwright降级，则尝试Playwright
             if (not result.get('success') or not self._is_content_quality_good(result.get('content', ''), result.get('title', ''))) and self.use_playwright_fallback:
                 print("常规方法提取失败或内容质量不佳，尝试使用Playwright...")
-                playwright_result = asyncio.run(self._extract_with_playwright(url))
+                playwright_result = browser_pool.run(self._extract_with_playwright(url))
                 if playwright_result and playwright_result.get('success'):
                     return playwright_result
             
@@ -91,7 +129,7 @@ class WebCrawler:
             if self.use_playwright_fallback:
                 try:
                     print("尝试使用Playwright作为降级方案...")
-                    playwright_result = asyncio.run(self._extract_with_playwright(url))
+                    playwright_result = browser_pool.run(self._extract_with_playwright(url))
                     if playwright_result and playwright_result.get('success'):
                         return playwright_result
                 except Exception as pw_e:
@@ -233,7 +271,7 @@ class WebCrawler:
         try:
             # 对于知乎，直接使用Playwright
             print("知乎网站检测，使用Playwright进行内容提取...")
-            return asyncio.run(self._extract_zhihu_with_playwright(url))
+            return browser_pool.run(self._extract_zhihu_with_playwright(url))
             
         except Exception as e:
             print(f"知乎Playwright提取失败，尝试常规方法: {str(e)}")
@@ -242,14 +280,12 @@ class WebCrawler:
     async def _extract_zhihu_with_playwright(self, url: str) -> dict:
         """使用Playwright提取知乎内容"""
         try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True)
-                context = await browser.new_context(
-                    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    viewport={'width': 1920, 'height': 1080}
-                )
-                page = await context.new_page()
-                
+            context_options = {
+                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'viewport': {'width': 1920, 'height': 1080}
+            }
+            # 从常驻浏览器池借用页面，不再每次启动浏览器
+            async with browser_pool.page('chromium', context_options) as page:
                 # 拦截不必要的资源
                 await page.route("**/*.{png,jpg,jpeg,gif,svg,css,woff,woff2}", lambda route: route.abort())
                 
@@ -261,7 +297,6 @@ class WebCrawler:
                 await page.wait_for_timeout(1000)
                 
                 content = await page.content()
-                await browser.close()
                 
                 soup = BeautifulSoup(content, 'html.parser')
                 
@@ -379,7 +414,7 @@ class WebCrawler:
             # 如果常规方法提取失败或内容太少，使用Playwright
             if len(content_text) < 100:
                 print("CSDN常规提取失败，尝试使用Playwright...")
-                playwright_result = asyncio.run(self._extract_csdn_with_playwright(url))
+                playwright_result = browser_pool.run(self._extract_csdn_with_playwright(url))
                 if playwright_result and playwright_result.get('success'):
                     return playwright_result
             
@@ -410,7 +445,7 @@ class WebCrawler:
             print(f"CSDN常规提取失败: {str(e)}")
             # 尝试Playwright作为降级
             try:
-                return asyncio.run(self._extract_csdn_with_playwright(url))
+                return browser_pool.run(self._extract_csdn_with_playwright(url))
             except Exception as pw_e:
                 return {
                     'success': False,
@@ -421,21 +456,18 @@ class WebCrawler:
     async def _extract_csdn_with_playwright(self, url: str) -> dict:
         """使用Playwright提取CSDN内容"""
         try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True)
-                context = await browser.new_context(
-                    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    viewport={'width': 1920, 'height': 1080}
-                )
-                page = await context.new_page()
-                
+            context_options = {
+                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'viewport': {'width': 1920, 'height': 1080}
+            }
+            # 从常驻浏览器池借用页面，不再每次启动浏览器
+            async with browser_pool.page('chromium', context_options) as page:
                 await page.route("**/*.{png,jpg,jpeg,gif,svg,css,woff,woff2}", lambda route: route.abort())
                 
                 await page.goto(url, wait_until='domcontentloaded', timeout=30000)
                 await page.wait_for_timeout(2000)
                 
                 content = await page.content()
-                await browser.close()
                 
                 soup = BeautifulSoup(content, 'html.parser')
                 
@@ -507,50 +539,33 @@ class WebCrawler:
         
         for browser_name in browsers_to_try:
             try:
-                async with async_playwright() as p:
-                    # 尝试不同的浏览器
-                    if browser_name == 'chromium':
-                        browser = await p.chromium.launch(
-                            headless=True,
-                            args=[
-                                '--no-sandbox',
-                                '--disable-blink-features=AutomationControlled',
-                                '--disable-dev-shm-usage',
-                                '--disable-gpu',
-                                '--disable-web-security',
-                                '--disable-features=VizDisplayCompositor'
-                            ]
-                        )
-                    else:
-                        browser = await p.firefox.launch(headless=True)
-                    
-                    # 创建更真实的浏览器环境
-                    context = await browser.new_context(
-                        user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                        viewport={'width': 1920, 'height': 1080},
-                        locale='zh-CN',
-                        timezone_id='Asia/Shanghai',
-                        permissions=['geolocation'],
-                        java_script_enabled=True,
-                        extra_http_headers={
-                            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-                            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-                            'Accept-Encoding': 'gzip, deflate, br',
-                            'Cache-Control': 'no-cache',
-                            'Pragma': 'no-cache',
-                            'Sec-Ch-Ua': '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
-                            'Sec-Ch-Ua-Mobile': '?0',
-                            'Sec-Ch-Ua-Platform': '"Windows"',
-                            'Sec-Fetch-Dest': 'document',
-                            'Sec-Fetch-Mode': 'navigate',
-                            'Sec-Fetch-Site': 'none',
-                            'Sec-Fetch-User': '?1',
-                            'Upgrade-Insecure-Requests': '1',
-                        }
-                    )
-                    
-                    page = await context.new_page()
-                    
+                # 创建更真实的浏览器环境
+                context_options = {
+                    'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                    'viewport': {'width': 1920, 'height': 1080},
+                    'locale': 'zh-CN',
+                    'timezone_id': 'Asia/Shanghai',
+                    'permissions': ['geolocation'],
+                    'java_script_enabled': True,
+                    'extra_http_headers': {
+                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+                        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+                        'Accept-Encoding': 'gzip, deflate, br',
+                        'Cache-Control': 'no-cache',
+                        'Pragma': 'no-cache',
+                        'Sec-Ch-Ua': '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
+                        'Sec-Ch-Ua-Mobile': '?0',
+                        'Sec-Ch-Ua-Platform': '"Windows"',
+                        'Sec-Fetch-Dest': 'document',
+                        'Sec-Fetch-Mode': 'navigate',
+                        'Sec-Fetch-Site': 'none',
+                        'Sec-Fetch-User': '?1',
+                        'Upgrade-Insecure-Requests': '1',
+                    }
+                }
+                
+                # 从常驻浏览器池借用页面（尝试不同的浏览器）
+                async with browser_pool.page(browser_name, context_options) as page:
                     # 注入脚本来隐藏自动化特征
                     await page.add_init_script("""
                         Object.defineProperty(navigator, 'webdriver', {
@@ -652,7 +667,6 @@ class WebCrawler:
                     
                     if is_anti_crawler:
                         print(f"检测到安全验证页面 ({browser_name})，跳过...")
-                        await browser.close()
                         continue
                     
                     # 等待动态内容加载
@@ -665,7 +679,6 @@ class WebCrawler:
                     
                     # 获取最终页面内容
                     content = await page.content()
-                    await browser.close()
                     
                     # 使用BeautifulSoup解析
                     soup = BeautifulSoup(content, 'html.parser')
@@ -843,13 +856,44 @@ class WebCrawler:
         except:
             return "无法提取页面内容，可能是动态加载的内容"
     
-    def extract_text_from_multiple_urls(self, urls: list) -> list:
-        """从多个URL提取文本"""
+    def _extract_with_domain_limit(self, url: str) -> dict:
+        """在域名限流下抓取单个URL"""
+        domain = urlparse(url).netloc.lower()
+        self._domain_limiter.acquire(domain)
+        try:
+            return self.extract_text_from_url(url)
+        finally:
+            self._domain_limiter.release(domain)
+    
+    def extract_text_from_multiple_urls(self, urls: list, deadline: float = None) -> list:
+        """并发地从多个URL提取文本，结果顺序与输入一致"""
+        if not urls:
+            return []
+        
+        deadline = deadline or self.url_deadline
+        submitted_at = time.monotonic()
+        futures = [self._executor.submit(self._extract_with_domain_limit, url) for url in urls]
+        
         results = []
-        for url in urls:
-            result = self.extract_text_from_url(url)
-            results.append(result)
-            time.sleep(1)  # 避免过于频繁的请求
+        for url, future in zip(urls, futures):
+            remaining = deadline - (time.monotonic() - submitted_at)
+            try:
+                results.append(future.result(timeout=max(remaining, 0)))
+            except FutureTimeoutError:
+                # 超时的任务无法强制中断，这里直接放弃等待它的结果
+                future.cancel()
+                print(f"抓取超时: {url}")
+                results.append({
+                    'success': False,
+                    'error': f"抓取超时（超过{deadline}秒）",
+                    'url': url
+                })
+            except Exception as e:
+                results.append({
+                    'success': False,
+                    'error': str(e),
+                    'url': url
+                })
         return results
     
     def is_valid_url(self, url: str) -> bool:
@@ -0,0 +1,79 @@
+import math
+import re
+from collections import Counter
+from typing import List, Tuple
+import numpy as np
+
+_CJK_RANGES = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_CJK_PATTERN = re.compile(f'[{_CJK_RANGES}]')
+# 连续的中文字符，或连续的其他字母数字
+_TOKEN_PATTERN = re.compile(f'[{_CJK_RANGES}]+|[^\\W_{_CJK_RANGES}]+')
+
+def tokenize(text: str) -> List[str]:
+    """检索用分词：英文等按单词（小写），中文按相邻两字（bigram），单独的一个汉字作为一个词"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if len(run) == 1 or not _CJK_PATTERN.match(run):
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def bm25_idf(doc_count: int, doc_freq: int) -> float:
+    """BM25的逆文档频率（加1平滑，保证非负）"""
+    return math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+class BM25Index:
+    """一组文本的BM25倒排索引：每个词的倒排表是 (文档序号, 词频) 两个NumPy数组，查询时向量化累加得分"""
+
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_count = len(documents)
+        self.doc_lengths = np.zeros(self.doc_count, dtype=np.float32)
+
+        postings = {}
+        for doc_id, document in enumerate(documents):
+            counts = Counter(tokenize(document))
+            self.doc_lengths[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                docs, freqs = postings.setdefault(term, ([], []))
+                docs.append(doc_id)
+                freqs.append(tf)
+
+        self._postings = {
+            term: (np.array(docs, dtype=np.int32), np.array(freqs, dtype=np.float32))
+            for term, (docs, freqs) in postings.items()
+        }
+        self._idf = {term: bm25_idf(self.doc_count, len(docs)) for term, (docs, _) in self._postings.items()}
+        avg_length = float(self.doc_lengths.mean()) if self.doc_count else 0.0
+        # 文档长度归一化项 k1 * (1 - b + b * dl / avgdl) 只与文档有关，预先算好
+        self._length_norm = k1 * (1 - b + b * self.doc_lengths / max(avg_length, 1e-6))
+
+    @property
+    def nbytes(self) -> int:
+        """索引数组占用的内存（不含词表字典本身）"""
+        return int(self.doc_lengths.nbytes + self._length_norm.nbytes + sum(
+            docs.nbytes + freqs.nbytes for docs, freqs in self._postings.values()
+        ))
+
+    def scores(self, query: str) -> np.ndarray:
+        """查询对每个文档的BM25得分"""
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for term, query_tf in Counter(tokenize(query)).items():
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            docs, freqs = posting
+            scores[docs] += query_tf * self._idf[term] * freqs * (self.k1 + 1) / (freqs + self._length_norm[docs])
+        return scores
+
+    def top_k(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """得分最高的k个文档 [(文档序号, 得分)]，按得分从高到低，不含得分为0的文档"""
+        scores = self.scores(query)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in candidates]
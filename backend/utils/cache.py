@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+def make_cache_key(*parts) -> str:
+    """根据任意可JSON序列化的内容生成稳定的SHA-256缓存键"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """分块计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class LRUCache:
+    """线程安全的内存LRU缓存，支持TTL过期"""
+
+    def __init__(self, max_entries: int = 256, ttl: float = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class DiskCache:
+    """以键名分目录存放JSON文件的磁盘缓存，支持TTL和总大小上限
+
+    总大小在写入、删除时增量累计，只有超出上限（或距上次扫描超过RESCAN_INTERVAL，校正其他进程的写入）时才扫描目录。
+    """
+
+    RESCAN_INTERVAL = 600
+
+    def __init__(self, directory: str, ttl: float = None, max_bytes: int = None):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None  # 首次写入时扫描得到
+        self._scanned_at = 0.0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def _file_size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _add_bytes(self, delta: int):
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += delta
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                item = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self.ttl and item.get('created_at', 0) + self.ttl < time.time():
+            self.delete(key)
+            return None
+
+        # 更新访问时间，供淘汰时参考
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return item.get('value')
+
+    def set(self, key: str, value: Any):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}_{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'created_at': time.time(), 'value': value}, f, ensure_ascii=False)
+        old_size = self._file_size(path)
+        os.replace(tmp_path, path)
+
+        if self.max_bytes:
+            self._add_bytes(self._file_size(path) - old_size)
+            with self._lock:
+                needs_scan = (
+                    self._total_bytes is None
+                    or self._total_bytes > self.max_bytes
+                    or time.time() - self._scanned_at > self.RESCAN_INTERVAL
+                )
+            if needs_scan:
+                self._enforce_size_limit()
+
+    def delete(self, key: str):
+        path = self._path(key)
+        size = self._file_size(path)
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        self._add_bytes(-size)
+
+    def _enforce_size_limit(self):
+        """扫描目录校正总大小，超出上限时按最近访问时间淘汰最旧的文件"""
+        with self._lock:
+            self._scanned_at = time.time()
+            entries = []
+            total = 0
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if not name.endswith('.json'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            if total > self.max_bytes:
+                entries.sort()
+                for _, size, path in entries:
+                    try:
+                        os.remove(path)
+                        total -= size
+                    except OSError:
+                        continue
+                    # 淘汰到上限的90%，避免之后每次写入都重新扫描
+                    if total <= self.max_bytes * 0.9:
+                        break
+            self._total_bytes = total
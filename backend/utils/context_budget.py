@@ -0,0 +1,152 @@
+import re
+from typing import Dict, List, Tuple
+from config import CONTEXT_CONFIG
+
+# 中日韩文字（含全角标点），大多数中文分词器约1个字对应1个token左右
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+# 标题行：Markdown标题、各路由拼接内容时使用的 "=== 标题 ===" 以及 "一、" "1." 这类编号
+_HEADING_PATTERN = re.compile(r'^\s*(#{1,6}\s|===.*===\s*$|[一二三四五六七八九十]+、|\d+[.、]\s*\S)')
+# 句末标点（保留在句子末尾）
+_SENTENCE_PATTERN = re.compile(r'(?<=[。！？!?；;])|(?<=\.\s)')
+
+OMISSION_MARK = "\n\n……（中间约{chars}字因长度限制省略）……\n\n"
+
+def estimate_tokens(text: str, model: str = None) -> int:
+    """估算文本的token数：中文按字、其他字符按平均字符数折算（偏保守，宁可多估）"""
+    if not text:
+        return 0
+    ratios = CONTEXT_CONFIG['model_tokens_per_char'].get(model, CONTEXT_CONFIG['tokens_per_char'])
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return int(cjk * ratios['cjk'] + other * ratios['other']) + 1
+
+def context_tokens(model: str) -> int:
+    return CONTEXT_CONFIG['model_context_tokens'].get(model, CONTEXT_CONFIG['default_context_tokens'])
+
+def input_budget(model: str, step: str = None) -> int:
+    """模型上下文中可用于放入文档内容的token数（扣除输出预留和提示词模板本身），step对应配置中单独限制的步骤"""
+    available = context_tokens(model) - CONTEXT_CONFIG['reserve_output_tokens'] - CONTEXT_CONFIG['prompt_overhead_tokens']
+    if step in CONTEXT_CONFIG['step_budgets']:
+        available = min(available, CONTEXT_CONFIG['step_budgets'][step])
+    return max(available, CONTEXT_CONFIG['min_input_tokens'])
+
+def _split_sections(text: str) -> List[str]:
+    """按标题切成章节，每个章节以标题行开头"""
+    sections = []
+    current = []
+    for line in text.split('\n'):
+        if _HEADING_PATTERN.match(line) and any(item.strip() for item in current):
+            sections.append('\n'.join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append('\n'.join(current))
+    return sections
+
+def _split_units(text: str, max_tokens: int) -> List[str]:
+    """把超长的章节依次按段落、句子拆开，仍然超长的句子按长度硬切"""
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    for pattern in (r'\n\s*\n', r'\n', _SENTENCE_PATTERN):
+        pieces = [piece for piece in re.split(pattern, text) if piece.strip()]
+        if len(pieces) > 1:
+            units = []
+            for piece in pieces:
+                units.extend(_split_units(piece, max_tokens))
+            return units
+
+    # 单个句子也放不下：按估算的字符数硬切
+    chars = max(int(len(text) * max_tokens / estimate_tokens(text)), 1)
+    return [text[i:i + chars] for i in range(0, len(text), chars)]
+
+def split_into_chunks(text: str, max_tokens: int, model: str = None) -> List[str]:
+    """把文档切成不超过max_tokens的块：优先在标题处断开，其次段落、句子，尽量让每块语义完整"""
+    chunks = []
+    current = ''
+    for section in _split_sections(text):
+        for unit in _split_units(section, max_tokens):
+            candidate = f"{current}\n\n{unit}" if current else unit
+            if current and estimate_tokens(candidate, model) > max_tokens:
+                chunks.append(current)
+                current = unit
+            else:
+                current = candidate
+        # 新章节尽量从新块开始：当前块已用过半时就此断开
+        if current and estimate_tokens(current, model) > max_tokens // 2:
+            chunks.append(current)
+            current = ''
+    if current.strip():
+        chunks.append(current)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+def fit_text(text: str, max_tokens: int, model: str = None, head_ratio: float = None) -> str:
+    """把文本裁到max_tokens以内：按块保留开头和结尾（开头占head_ratio），中间标注省略，不在句子中间截断"""
+    if estimate_tokens(text, model) <= max_tokens:
+        return text
+    if head_ratio is None:
+        head_ratio = CONTEXT_CONFIG['head_ratio']
+
+    # 用较小的块拼接，首尾各自装满为止
+    units = split_into_chunks(text, max(max_tokens // 8, 32), model)
+    marker_tokens = estimate_tokens(OMISSION_MARK.format(chars=len(text)), model)
+    head_budget = int((max_tokens - marker_tokens) * head_ratio)
+    tail_budget = max_tokens - marker_tokens - head_budget
+
+    head, used = [], 0
+    for unit in units:
+        tokens = estimate_tokens(unit, model)
+        if used + tokens > head_budget:
+            break
+        head.append(unit)
+        used += tokens
+
+    tail, used = [], 0
+    for unit in reversed(units[len(head):]):
+        tokens = estimate_tokens(unit, model)
+        if used + tokens > tail_budget:
+            break
+        tail.insert(0, unit)
+        used += tokens
+
+    if not head and not tail:
+        # 连一个块都放不下时按字符数截取开头
+        chars = max(int(len(text) * max_tokens / estimate_tokens(text, model)), 1)
+        return text[:chars]
+
+    omitted = len(text) - sum(len(unit) for unit in head + tail)
+    return '\n\n'.join(head) + OMISSION_MARK.format(chars=omitted) + '\n\n'.join(tail)
+
+def fit_parts(model: str, parts: Dict[str, Tuple[str, float]], step: str = None) -> Dict[str, str]:
+    """在一个提示词里放入多段内容时分配token预算
+
+    parts为 {名称: (文本, 权重)}，预算按权重分配；短于自身份额的内容原样保留，剩余的预算再分给其他内容。
+    返回 {名称: 裁剪后的文本}。
+    """
+    budget = input_budget(model, step)
+    sizes = {name: estimate_tokens(text, model) for name, (text, _) in parts.items()}
+    allocation = {}
+    remaining = dict(parts)
+    while remaining:
+        total_weight = sum(weight for _, weight in remaining.values()) or 1
+        fits = {
+            name for name, (_, weight) in remaining.items()
+            if sizes[name] <= budget * weight / total_weight
+        }
+        if not fits:
+            for name, (_, weight) in remaining.items():
+                allocation[name] = int(budget * weight / total_weight)
+            break
+        for name in fits:
+            allocation[name] = sizes[name]
+            budget -= sizes[name]
+            del remaining[name]
+
+    return {
+        name: fit_text(text, allocation[name], model) if sizes[name] > allocation[name] else text
+        for name, (text, _) in parts.items()
+    }
+
+def fit_to_model(text: str, model: str, step: str = None) -> str:
+    """把单段内容裁到模型（或指定步骤）的输入预算以内"""
+    return fit_text(text, input_budget(model, step), model)
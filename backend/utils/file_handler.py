@@ -1,26 +1,145 @@
+import hashlib
 import os
 import tempfile
-import time
-from typing import List
+import threading
+from typing import Generator, List, Optional, Tuple
+from werkzeug.exceptions import RequestEntityTooLarge
+from config import EXTRACT_CACHE_CONFIG, PDF_CONFIG, UPLOAD_CONFIG
+from utils.cache import DiskCache, make_cache_key, file_sha256
+from utils.upload_stream import HashingUploadFile
+
+# 文本提取逻辑的版本，提取方式改变后递增，使旧的提取缓存失效
+EXTRACTOR_VERSION = 2
+
+_extract_cache = None
+if EXTRACT_CACHE_CONFIG['enabled']:
+    _extract_cache = DiskCache(EXTRACT_CACHE_CONFIG['dir'], max_bytes=EXTRACT_CACHE_CONFIG['max_bytes'])
 
 def save_uploaded_files(files) -> List[str]:
-    """保存上传的文件"""
+    """保存上传的文件（按内容哈希分目录保存并保留原文件名，重复上传的文件不再另存一份）"""
     saved_paths = []
     upload_dir = 'data/uploads/files'
-    os.makedirs(upload_dir, exist_ok=True)
     
     for file in files:
         if file and file.filename:
-            # 生成唯一文件名
-            filename = f"{int(time.time())}_{file.filename}"
-            file_path = os.path.join(upload_dir, filename)
-            file.save(file_path)
-            saved_paths.append(file_path)
+            saved_paths.append(save_content_addressed(file, upload_dir, keep_name=True))
     
     return saved_paths
 
+def _spool_upload(file, upload_dir: str) -> Tuple[str, str]:
+    """把上传文件放到上传目录下的临时文件，返回 (临时文件路径, SHA-256)
+
+    表单解析时已经落盘并算好哈希的（HashingUploadFile）直接取走；否则按块复制，同时计算哈希并检查大小上限。
+    """
+    if isinstance(file.stream, HashingUploadFile) and file.stream.path:
+        digest = file.stream.hexdigest()
+        return file.stream.detach(), digest
+    
+    tmp_path = os.path.join(upload_dir, f".{os.getpid()}_{threading.get_ident()}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    max_bytes = UPLOAD_CONFIG['max_file_bytes']
+    with open(tmp_path, 'wb') as f:
+        for chunk in iter(lambda: file.stream.read(UPLOAD_CONFIG['chunk_size']), b''):
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                f.close()
+                os.remove(tmp_path)
+                raise RequestEntityTooLarge(f"单个文件超过大小上限（{max_bytes // (1024 * 1024)}MB）")
+            digest.update(chunk)
+            f.write(chunk)
+    return tmp_path, digest.hexdigest()
+
+def save_content_addressed(file, upload_dir: str, keep_name: bool = False) -> str:
+    """按内容SHA-256保存上传文件，内容相同的文件只保存一份，返回保存路径
+
+    keep_name为False时保存为 <哈希><扩展名>；为True时保存为 <哈希>/<原文件名>，
+    同一内容以不同文件名上传时用硬链接指向已保存的文件。
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    _, ext = os.path.splitext(file.filename.lower())
+    tmp_path, file_hash = _spool_upload(file, upload_dir)
+    
+    if not keep_name:
+        file_path = os.path.join(upload_dir, f"{file_hash}{ext}")
+        if os.path.exists(file_path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, file_path)
+        return file_path
+    
+    content_dir = os.path.join(upload_dir, file_hash)
+    filename = clean_filename(os.path.basename(file.filename.replace('\\', '/'))).strip('. ') or f"file{ext}"
+    file_path = os.path.join(content_dir, filename)
+    existing = os.listdir(content_dir) if os.path.isdir(content_dir) else []
+    if filename in existing:
+        os.remove(tmp_path)
+        return file_path
+    
+    os.makedirs(content_dir, exist_ok=True)
+    if existing:
+        try:
+            os.link(os.path.join(content_dir, existing[0]), file_path)
+            os.remove(tmp_path)
+            return file_path
+        except OSError:
+            pass
+    os.replace(tmp_path, file_path)
+    return file_path
+
+def _extract_cache_key(file_path: str) -> Optional[str]:
+    if _extract_cache is None:
+        return None
+    try:
+        return make_cache_key(
+            'extract',
+            file_sha256(file_path),
+            os.path.splitext(file_path.lower())[1],
+            EXTRACTOR_VERSION,
+            PDF_CONFIG['max_pages'],
+            PDF_CONFIG['max_chars']
+        )
+    except OSError:
+        return None
+
 def extract_text_from_file(file_path: str) -> str:
-    """从文件中提取文本"""
+    """从文件中提取文本（按文件内容哈希缓存提取结果，同一文件再次分析时不再重新解析）"""
+    key = _extract_cache_key(file_path)
+    if key:
+        cached = _extract_cache.get(key)
+        if cached is not None:
+            return cached
+    
+    text, success = _extract_text_from_file(file_path)
+    if key and success:
+        _extract_cache.set(key, text)
+    return text
+
+def stream_text_from_file(file_path: str, writer) -> Generator[str, None, str]:
+    """同extract_text_from_file，PDF逐页提取并输出pdf_progress事件；生成器的返回值为提取的文本"""
+    key = _extract_cache_key(file_path)
+    if key:
+        cached = _extract_cache.get(key)
+        if cached is not None:
+            return cached
+    
+    if os.path.splitext(file_path.lower())[1] == '.pdf':
+        try:
+            from services.pdf_extractor import pdf_extractor
+            text = yield from pdf_extractor.stream_text(file_path, writer)
+            success = True
+        except ImportError:
+            text, success = "错误：需要安装PyPDF2库来处理PDF文档", False
+        except Exception as e:
+            text, success = f"读取文件失败：{str(e)}", False
+    else:
+        text, success = _extract_text_from_file(file_path)
+    if key and success:
+        _extract_cache.set(key, text)
+    return text
+
+def _extract_text_from_file(file_path: str) -> Tuple[str, bool]:
+    """实际解析文件，返回 (文本或错误信息, 是否成功)"""
     try:
         # 获取文件扩展名
         _, ext = os.path.splitext(file_path.lower())
@@ -28,11 +147,11 @@ def extract_text_from_file(file_path: str) -> str:
         if ext == '.txt':
             # 读取文本文件
             with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+                return f.read(), True
         elif ext in ['.md', '.markdown']:
             # 读取Markdown文件
             with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+                return f.read(), True
         elif ext == '.csv':
             # 读取CSV文件
             import csv
@@ -41,7 +160,7 @@ def extract_text_from_file(file_path: str) -> str:
                 reader = csv.reader(f)
                 for row in reader:
                     content.append(','.join(row))
-            return '\n'.join(content)
+            return '\n'.join(content), True
         elif ext in ['.docx', '.doc']:
             # 处理Word文档（需要安装python-docx）
             try:
@@ -50,26 +169,21 @@ def extract_text_from_file(file_path: str) -> str:
                 content = []
                 for paragraph in doc.paragraphs:
                     content.append(paragraph.text)
-                return '\n'.join(content)
+                return '\n'.join(content), True
             except ImportError:
-                return "错误：需要安装python-docx库来处理Word文档"
+                return "错误：需要安装python-docx库来处理Word文档", False
         elif ext == '.pdf':
-            # 处理PDF文件（需要安装PyPDF2）
+            # 处理PDF文件（需要安装PyPDF2，安装了pypdfium2时自动使用更快的后端）
             try:
-                import PyPDF2
-                content = []
-                with open(file_path, 'rb') as f:
-                    reader = PyPDF2.PdfReader(f)
-                    for page in reader.pages:
-                        content.append(page.extract_text())
-                return '\n'.join(content)
+                from services.pdf_extractor import pdf_extractor
+                return pdf_extractor.extract_text(file_path), True
             except ImportError:
-                return "错误：需要安装PyPDF2库来处理PDF文档"
+                return "错误：需要安装PyPDF2库来处理PDF文档", False
         else:
-            return f"不支持的文件格式：{ext}"
+            return f"不支持的文件格式：{ext}", False
             
     except Exception as e:
-        return f"读取文件失败：{str(e)}"
+        return f"读取文件失败：{str(e)}", False
 
 def clean_filename(filename: str) -> str:
     """清理文件名，移除非法字符"""
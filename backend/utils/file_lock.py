@@ -0,0 +1,53 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# 同一进程内的线程先用线程锁互斥，文件锁只负责进程之间的互斥
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+def _get_thread_lock(path: str) -> threading.Lock:
+    with _thread_locks_guard:
+        lock = _thread_locks.get(path)
+        if lock is None:
+            lock = threading.Lock()
+            _thread_locks[path] = lock
+        return lock
+
+@contextmanager
+def file_lock(path: str):
+    """对path加独占锁（使用旁边的 .lock 文件），同时兼容Windows和类Unix系统；不可重入"""
+    lock_path = os.path.abspath(path) + '.lock'
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+
+    with _get_thread_lock(lock_path):
+        with open(lock_path, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def append_line(path: str, line: str):
+    """以单次写入的方式追加一行并落盘，写入中途崩溃也不会与其他行交错"""
+    data = (line.rstrip('\n') + '\n').encode('utf-8')
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,126 @@
+import time
+import cv2
+import numpy as np
+from PIL import Image
+from typing import Dict, List, Tuple
+from config import OCR_CONFIG
+
+# 预处理流程版本，流程改动后递增，使旧的OCR缓存失效
+PREPROCESS_VERSION = 2
+PREPROCESS_CONFIG_KEYS = ('target_dpi', 'min_side', 'max_side', 'noise_low', 'noise_high')
+
+# Immerkær噪声估计使用的拉普拉斯差分核
+_NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float64)
+
+def estimate_noise(gray: np.ndarray, sample_size: int = 512) -> float:
+    """估计灰度图的噪声标准差（取中心区域原分辨率计算，避免缩放把噪声平滑掉）"""
+    height, width = gray.shape[:2]
+    top = max((height - sample_size) // 2, 0)
+    left = max((width - sample_size) // 2, 0)
+    sample = gray[top:top + sample_size, left:left + sample_size]
+    h, w = sample.shape[:2]
+    if h < 3 or w < 3:
+        return 0.0
+    response = cv2.filter2D(sample.astype(np.float64), -1, _NOISE_KERNEL)
+    return float(np.abs(response[1:-1, 1:-1]).sum() * np.sqrt(0.5 * np.pi) / (6 * (w - 2) * (h - 2)))
+
+def is_clean_screenshot(gray: np.ndarray, noise: float) -> bool:
+    """截图类图片：噪声很低，且大部分像素集中在少数几个灰度值（纯色背景）"""
+    if noise >= OCR_CONFIG['noise_low']:
+        return False
+    histogram = np.bincount(gray.ravel(), minlength=256)
+    top_two = np.sort(histogram)[-2:].sum()
+    return top_two / gray.size >= 0.5
+
+def _scale_factor(image: Image.Image, gray: np.ndarray) -> float:
+    """按图片DPI缩放到目标DPI；没有DPI信息时按长边限制在[min_side, max_side]之间"""
+    dpi = image.info.get('dpi')
+    if dpi and dpi[0] and dpi[0] >= 50:
+        scale = OCR_CONFIG['target_dpi'] / float(dpi[0])
+    else:
+        long_side = max(gray.shape[:2])
+        if long_side > OCR_CONFIG['max_side']:
+            scale = OCR_CONFIG['max_side'] / long_side
+        elif long_side < OCR_CONFIG['min_side']:
+            scale = OCR_CONFIG['min_side'] / long_side
+        else:
+            scale = 1.0
+
+    # 放大最多2倍，缩小后长边不低于min_side
+    scale = min(scale, 2.0)
+    long_side = max(gray.shape[:2])
+    if scale < 1.0 and long_side * scale < OCR_CONFIG['min_side']:
+        scale = min(OCR_CONFIG['min_side'] / long_side, 1.0)
+    return scale
+
+def preprocess_for_ocr(image: Image.Image, keep_intermediate: bool = False) -> Tuple[Image.Image, List[Dict]]:
+    """自适应预处理：先测量噪声和分辨率，再决定缩放、去噪强度和是否二值化
+
+    返回 (处理后的图片, 各阶段记录)。每条记录包含阶段名、耗时、实际采取的操作；
+    keep_intermediate为True时还包含该阶段输出的图片（用于基准测试）。
+    """
+    stages = []
+
+    def record(stage: str, started: float, action: str, array: np.ndarray):
+        item = {'stage': stage, 'ms': round((time.perf_counter() - started) * 1000, 2), 'action': action}
+        if keep_intermediate:
+            item['image'] = Image.fromarray(array)
+        stages.append(item)
+
+    # 灰度化
+    started = time.perf_counter()
+    img_array = np.array(image)
+    if len(img_array.shape) == 3:
+        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    else:
+        gray = img_array
+    record('grayscale', started, 'gray', gray)
+
+    # 测量噪声，判断是否为干净的截图
+    started = time.perf_counter()
+    noise = estimate_noise(gray)
+    clean = is_clean_screenshot(gray, noise)
+    record('measure', started, f"noise={noise:.2f}, clean={clean}", gray)
+
+    # 缩放到目标分辨率
+    started = time.perf_counter()
+    scale = _scale_factor(image, gray)
+    if abs(scale - 1.0) > 0.05:
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation)
+        record('resize', started, f"scale={scale:.2f}", gray)
+    else:
+        record('resize', started, 'skip', gray)
+
+    # 去噪：只有噪声明显时才使用代价很高的非局部均值去噪
+    started = time.perf_counter()
+    if clean or noise < OCR_CONFIG['noise_low']:
+        record('denoise', started, 'skip', gray)
+    elif noise < OCR_CONFIG['noise_high']:
+        gray = cv2.medianBlur(gray, 3)
+        record('denoise', started, 'median', gray)
+    else:
+        h = float(min(max(noise, 3.0), 15.0))
+        gray = cv2.fastNlMeansDenoising(gray, None, h=h)
+        record('denoise', started, f"nlmeans(h={h:.1f})", gray)
+
+    # 二值化：干净的截图交给Tesseract内部处理
+    started = time.perf_counter()
+    if clean:
+        record('binarize', started, 'skip', gray)
+    else:
+        _, gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        record('binarize', started, 'otsu', gray)
+
+    return Image.fromarray(gray), stages
+
+def legacy_preprocess(image: Image.Image) -> Image.Image:
+    """旧的固定流程（灰度 + 非局部均值去噪 + Otsu二值化），供基准测试对比"""
+    img_array = np.array(image)
+    if len(img_array.shape) == 3:
+        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    else:
+        gray = img_array
+    denoised = cv2.fastNlMeansDenoising(gray)
+    _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return Image.fromarray(binary)
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+from typing import Generator, Iterable
+from flask import Response
+from config import SSE_CONFIG
+
+# 流式响应使用的HTTP头，关闭代理缓冲以便逐块推送
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+# SSE注释行，客户端会忽略，只用于保持连接
+HEARTBEAT_EVENT = ': keepalive\n\n'
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def sse_event(event_type: str, **fields) -> str:
+    """编码一个完整的SSE事件"""
+    payload = {'type': event_type}
+    payload.update(fields)
+    return f"data: {_dumps(payload)}\n\n"
+
+class SSEWriter:
+    """增量SSE事件编码器：预编码事件前缀，并合并连续的content/thinking增量
+
+    缓冲的增量平时在下一段增量到来时按时间阈值发出；生成器阻塞（模型中途停顿）时，
+    在其他线程中消费事件的调度方可以用 flush_stale 把超时的缓冲先发出去。
+    """
+
+    def __init__(self, flush_chars: int = None, flush_interval: float = None):
+        self.flush_chars = flush_chars or SSE_CONFIG['flush_chars']
+        self.flush_interval = flush_interval if flush_interval is not None else SSE_CONFIG['flush_interval']
+        self._prefixes = {}
+        self._buffer = []
+        self._buffer_len = 0
+        self._buffer_key = None
+        self._buffer_started = 0.0
+        self._lock = threading.Lock()
+        self._unsent = False  # 已返回给生成器、但调度方还没确认发出的输出
+
+    def _prefix(self, event_type: str, step) -> str:
+        """获取（并缓存）形如 data: {"type":"content","step":1,"content": 的事件前缀"""
+        key = (event_type, step)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            head = {'type': event_type}
+            if step is not None:
+                head['step'] = step
+            prefix = f"data: {_dumps(head)[:-1]},\"content\":"
+            self._prefixes[key] = prefix
+        return prefix
+
+    def delta(self, event_type: str, text: str, step=None) -> str:
+        """缓冲一段增量文本，达到字数或时间阈值时返回编码后的事件，否则返回空字符串"""
+        if not text:
+            return ''
+
+        with self._lock:
+            output = ''
+            key = (event_type, step)
+            if self._buffer and key != self._buffer_key:
+                output = self._flush_locked()
+
+            if not self._buffer:
+                self._buffer_key = key
+                self._buffer_started = time.monotonic()
+            self._buffer.append(text)
+            self._buffer_len += len(text)
+
+            if (self._buffer_len >= self.flush_chars
+                    or time.monotonic() - self._buffer_started >= self.flush_interval):
+                output += self._flush_locked()
+            return self._track(output)
+
+    def content(self, text: str, step=None) -> str:
+        return self.delta('content', text, step)
+
+    def thinking(self, text: str, step=None) -> str:
+        return self.delta('thinking', text, step)
+
+    def _track(self, output: str) -> str:
+        if output:
+            self._unsent = True
+        return output
+
+    def flush(self) -> str:
+        """输出缓冲中的全部增量"""
+        with self._lock:
+            return self._track(self._flush_locked())
+
+    def _flush_locked(self) -> str:
+        if not self._buffer:
+            return ''
+        event_type, step = self._buffer_key
+        text = ''.join(self._buffer)
+        self._buffer = []
+        self._buffer_len = 0
+        self._buffer_key = None
+        return f"{self._prefix(event_type, step)}{_dumps(text)}}}\n\n"
+
+    def event(self, event_type: str, **fields) -> str:
+        """先输出缓冲的增量，再输出一个普通事件，保证事件顺序不变"""
+        with self._lock:
+            return self._track(self._flush_locked() + sse_event(event_type, **fields))
+
+    def mark_sent(self):
+        """调度方已把生成器产出的输出放入发送队列"""
+        with self._lock:
+            self._unsent = False
+
+    def flush_stale(self, sink):
+        """缓冲的增量超过flush_interval仍未发出时，在锁内交给sink发送
+
+        生成器刚产出、调度方还没放入队列的输出在前面时跳过本次，避免缓冲的增量插到它前面。
+        """
+        with self._lock:
+            if (self._unsent or not self._buffer
+                    or time.monotonic() - self._buffer_started < self.flush_interval):
+                return
+            sink(self._flush_locked())
+
+def _with_heartbeat(events: Iterable[str], interval: float) -> Generator[str, None, None]:
+    """过滤空块；距上次输出超过interval秒时插入心跳
+
+    不另开线程：生成器产出的空块（SSEWriter缓冲中的增量、等待中的步骤定时产出的空块）就是检查时间的时机。
+    """
+    last_sent = time.monotonic()
+    try:
+        for item in events:
+            if item:
+                yield item
+                last_sent = time.monotonic()
+            elif interval and time.monotonic() - last_sent >= interval:
+                yield HEARTBEAT_EVENT
+                last_sent = time.monotonic()
+    except Exception as e:
+        yield sse_event('error', message=str(e))
+    finally:
+        close = getattr(events, 'close', None)
+        if close:
+            close()
+
+def sse_response(events: Iterable[str], heartbeat_interval: float = None) -> Response:
+    """把事件生成器包装成text/event-stream响应（过滤空块，并按需发送心跳）"""
+    if heartbeat_interval is None:
+        heartbeat_interval = SSE_CONFIG['heartbeat_interval']
+    return Response(_with_heartbeat(events, heartbeat_interval), mimetype='text/event-stream', headers=SSE_HEADERS)
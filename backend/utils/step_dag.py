@@ -0,0 +1,103 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Generator, Iterable
+from utils.sse import SSEWriter
+
+class StepCancelled(Exception):
+    """消费端已停止（例如客户端断开），后台步骤随之放弃"""
+
+class _Step:
+    def __init__(self, name: str, func: Callable, deps: Iterable[str]):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.events = queue.Queue()
+        self.writer = None
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class StepDAG:
+    """小型步骤DAG执行器：依赖满足的步骤并发执行，事件按添加顺序依次输出
+
+    每个步骤是一个生成器函数 func(writer, inputs)，通过 yield writer.xxx(...) 产生SSE事件，
+    用 return 返回结果供后续步骤从 inputs[name] 读取。没有轮到输出的步骤，其事件先缓存在队列中。
+    """
+
+    _END = object()
+
+    def __init__(self):
+        self._steps: Dict[str, _Step] = {}
+        self._cancelled = threading.Event()
+
+    def add(self, name: str, func: Callable, deps: Iterable[str] = ()):
+        for dep in deps:
+            if dep not in self._steps:
+                raise ValueError(f"步骤 {name} 依赖的 {dep} 尚未添加")
+        self._steps[name] = _Step(name, func, deps)
+
+    def _run_step(self, step: _Step):
+        try:
+            inputs = {}
+            for dep in step.deps:
+                dep_step = self._steps[dep]
+                dep_step.done.wait()
+                if dep_step.error is not None:
+                    raise dep_step.error
+                inputs[dep] = dep_step.result
+
+            writer = SSEWriter()
+            step.writer = writer
+            events = step.func(writer, inputs)
+            try:
+                while True:
+                    if self._cancelled.is_set():
+                        raise StepCancelled(step.name)
+                    try:
+                        event = next(events)
+                    except StopIteration as stop:
+                        step.result = stop.value
+                        break
+                    if event:
+                        step.events.put(event)
+                    writer.mark_sent()
+            finally:
+                events.close()
+            step.events.put(writer.flush())
+        except BaseException as e:
+            step.error = e
+        finally:
+            step.done.set()
+            step.events.put(self._END)
+
+    def run(self) -> Generator[str, None, None]:
+        """启动所有步骤，按添加顺序流式输出各步骤的事件；某一步出错时抛出该异常
+
+        等待事件时定时产出空块，sse_response借此判断是否需要发送心跳；
+        同时把当前步骤中超时未发出的缓冲增量发出去（模型中途停顿时不必等到下一段增量）。
+        """
+        steps = list(self._steps.values())
+        executor = ThreadPoolExecutor(max_workers=len(steps) or 1, thread_name_prefix='step-dag')
+        try:
+            for step in steps:
+                executor.submit(self._run_step, step)
+
+            for step in steps:
+                while True:
+                    try:
+                        event = step.events.get(timeout=0.25)
+                    except queue.Empty:
+                        if step.writer is not None:
+                            step.writer.flush_stale(step.events.put)
+                        yield ''
+                        continue
+                    if event is self._END:
+                        break
+                    if event:
+                        yield event
+                if step.error is not None:
+                    raise step.error
+        finally:
+            self._cancelled.set()
+            executor.shutdown(wait=False)
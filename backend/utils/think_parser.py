@@ -0,0 +1,81 @@
+from typing import Generator, Iterable, Tuple
+
+THINK_OPEN = '<think>'
+THINK_CLOSE = '</think>'
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """返回text末尾与tag开头重合的长度（可能被切断在两个数据块之间的半个标签）"""
+    for k in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:k]):
+            return k
+    return 0
+
+class ThinkTagParser:
+    """流式<think>标签解析器：逐块输入，增量输出思考内容和显示内容，标签可跨块"""
+
+    def __init__(self):
+        self.in_think = False
+        self._pending = ''
+        # 回复开头及</think>之后的空白不输出，与原先按块strip的效果一致
+        self._content_start = True
+
+    def _emit_content(self, text: str) -> str:
+        if self._content_start:
+            text = text.lstrip()
+            if text:
+                self._content_start = False
+        return text
+
+    def feed(self, chunk: str) -> Tuple[str, str]:
+        """输入一个数据块，返回 (思考增量, 显示增量)"""
+        text = self._pending + chunk if self._pending else chunk
+        self._pending = ''
+        thinking = []
+        content = []
+        pos = 0
+
+        while pos < len(text):
+            tag = THINK_CLOSE if self.in_think else THINK_OPEN
+            index = text.find(tag, pos)
+            if index >= 0:
+                end = index
+            else:
+                # 未找到完整标签时保留末尾可能的半个标签，等下一块再判断
+                end = len(text) - _partial_tag_length(text[pos:], tag)
+                self._pending = text[end:]
+
+            if end > pos:
+                if self.in_think:
+                    thinking.append(text[pos:end])
+                else:
+                    content.append(self._emit_content(text[pos:end]))
+
+            if index < 0:
+                break
+            pos = index + len(tag)
+            if self.in_think:
+                self._content_start = True
+            self.in_think = not self.in_think
+
+        return ''.join(thinking), ''.join(content)
+
+    def flush(self) -> Tuple[str, str]:
+        """流结束时输出残留的半个标签（此时它只是普通文本）"""
+        text = self._pending
+        self._pending = ''
+        if not text:
+            return '', ''
+        if self.in_think:
+            return text, ''
+        return '', self._emit_content(text)
+
+def split_thinking_stream(chunks: Iterable[str]) -> Generator[Tuple[str, str], None, None]:
+    """把模型的流式输出拆分为 (思考增量, 显示增量)，跳过两者都为空的块"""
+    parser = ThinkTagParser()
+    for chunk in chunks:
+        thinking, display = parser.feed(chunk)
+        if thinking or display:
+            yield thinking, display
+    thinking, display = parser.flush()
+    if thinking or display:
+        yield thinking, display
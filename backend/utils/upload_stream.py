@@ -0,0 +1,64 @@
+import hashlib
+import os
+import tempfile
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from config import UPLOAD_CONFIG
+
+class HashingUploadFile:
+    """上传文件的落盘临时文件：表单解析时按块直接写入磁盘，同时计算SHA-256并统计大小
+
+    超过单文件大小上限时立即删除临时文件并中止解析，不会把整个文件读进内存。
+    """
+
+    def __init__(self, directory: str, max_bytes: int = None):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix='.upload_', suffix='.tmp', dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            self.discard()
+            raise RequestEntityTooLarge(f"单个文件超过大小上限（{self.max_bytes // (1024 * 1024)}MB）")
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+    def detach(self) -> str:
+        """关闭文件并交出临时文件路径，之后由调用方负责移动或删除"""
+        self._file.close()
+        path, self.path = self.path, None
+        return path
+
+    def discard(self):
+        """关闭并删除尚未被取走的临时文件"""
+        self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+    def close(self):
+        self._file.close()
+
+    def __getattr__(self, name):
+        # read / seek / tell / flush 等交给底层文件
+        return getattr(self._file, name)
+
+class StreamingUploadRequest(Request):
+    """上传的文件直接以HashingUploadFile落盘；请求结束时清理没有被保存的临时文件"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = HashingUploadFile(UPLOAD_CONFIG['incoming_dir'], UPLOAD_CONFIG['max_file_bytes'])
+        self.__dict__.setdefault('_upload_streams', []).append(stream)
+        return stream
+
+    def close(self):
+        super().close()
+        for stream in self.__dict__.pop('_upload_streams', []):
+            stream.discard()
@@ -9,6 +9,8 @@ class ChatManager {
         this.isProcessing = false;
         this.currentFunction = 'intelligent-reading';
         this.messageHistory = [];
+        // 智能伴读：文档和对话保存在服务端的会话ID
+        this.readingSessionId = null;
         // 新增：获取聊天容器元素
         this.chatMessagesContainer = document.getElementById('chatMessages');
         // 新增：用户滚动状态开关
@@ -333,8 +335,8 @@ class ChatManager {
             function: this.currentFunction
         };
 
-        // 只在继续聊天时添加历史记录
-        if (!isInitial && this.messageHistory.length > 0) {
+        // 只在继续聊天时添加历史记录（智能伴读的对话保存在服务端会话中，无需发送）
+        if (!isInitial && this.messageHistory.length > 0 && !this.usesReadingSession()) {
             // 过滤出有效的聊天历史（去除空消息和重复消息）
             const validHistory = this.messageHistory.filter(msg => 
                 msg.content && msg.content.trim() && 
@@ -434,14 +436,23 @@ class ChatManager {
             }
         }
 
-        // 添加内容上下文（如果是智能伴读且有解析过的内容）
-        if (this.currentFunction === 'intelligent-reading' && !isInitial && this.currentContentContext) {
-            data.content_context = this.currentContentContext;
+        // 智能伴读：文档保存在服务端会话中，只发送新消息
+        if (this.currentFunction === 'intelligent-reading' && !isInitial && this.usesReadingSession()) {
+            data.reading_session = true;
         }
 
         return data;
     }
 
+    /**
+     * 当前对话的文档是否保存在服务端会话中
+     */
+    usesReadingSession() {
+        return this.currentFunction === 'intelligent-reading' &&
+            !!this.readingSessionId &&
+            this.readingSessionId === this.currentSessionId;
+    }
+
     /**
      * 获取功能端点
      */
@@ -627,6 +638,7 @@ class ChatManager {
         
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
+        let lineBuffer = ''; // 保存跨数据块的不完整行
         
         try {
             while (true) {
@@ -638,7 +650,9 @@ class ChatManager {
 
                 const chunk = decoder.decode(value, { stream: true });
                 console.log('收到进度数据块:', chunk);
-                const lines = chunk.split('\n');
+                lineBuffer += chunk;
+                const lines = lineBuffer.split('\n');
+                lineBuffer = lines.pop();
 
                 for (const line of lines) {
                     if (line.startsWith('data: ')) {
@@ -677,6 +691,7 @@ class ChatManager {
         console.log('=== 开始处理流式响应 ===');
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
+        let lineBuffer = ''; // 保存跨数据块的不完整行
         
         let assistantMessageElement = null;
         let currentContent = '';
@@ -694,7 +709,9 @@ class ChatManager {
 
                 const chunk = decoder.decode(value, { stream: true });
                 console.log('收到数据块:', chunk);
-                const lines = chunk.split('\n');
+                lineBuffer += chunk;
+                const lines = lineBuffer.split('\n');
+                lineBuffer = lines.pop();
 
                 for (const line of lines) {
                     if (line.startsWith('data: ')) {
@@ -738,6 +755,13 @@ class ChatManager {
                                     this.addCrawlerResultsCollapse(data.results);
                                     break;
 
+                                case 'session_expired':
+                                    console.log('服务端伴读会话已过期，需要重新上传内容');
+                                    this.readingSessionId = null;
+                                    this.addMessage('assistant', '文档会话已过期，请重新上传内容后再继续提问。');
+                                    showNotification('文档会话已过期，请重新上传内容', 'warning');
+                                    break;
+
                                 case 'content_parsed':
                                     console.log('收到内容解析结果:', data.result);
                                     this.handleContentParsed(data.result);
@@ -748,6 +772,16 @@ class ChatManager {
                                     showLoading(data.message);
                                     break;
 
+                                case 'ocr_progress':
+                                    console.log('收到图片识别进度:', data.done, '/', data.total);
+                                    showLoading(`正在识别图片 ${data.done}/${data.total}...`);
+                                    break;
+
+                                case 'pdf_progress':
+                                    console.log('收到PDF提取进度:', data.page, '/', data.total);
+                                    showLoading(`正在提取PDF文字 ${data.page}/${data.total}页...`);
+                                    break;
+
                                 case 'thinking':
                                     console.log('收到思考内容:', data.content);
                                     // 处理思考内容
@@ -881,8 +915,8 @@ class ChatManager {
     handleContentParsed(result) {
         console.log('处理内容解析结果:', result);
         
-        // 存储解析结果供后续聊天使用
-        this.currentContentContext = result.full_content;
+        // 文档保存在服务端会话中，后续聊天只需携带会话ID
+        this.readingSessionId = result.reading_session ? this.currentSessionId : null;
         
         // 添加内容解析结果卡片
         this.addContentParseCard(result);
@@ -926,9 +960,6 @@ class ChatManager {
                         </button>
                     </div>
                     <div class="preview-text">${result.content_preview}</div>
-                    <div class="preview-full" style="display: none;">
-                        <div class="full-content">${result.full_content}</div>
-                    </div>
                 </div>
             </div>
         `;
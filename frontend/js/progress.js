@@ -1155,6 +1155,12 @@ class ProgressManager {
         console.log('进度管理器收到数据:', data);
         
         switch (data.type) {
+            case 'status':
+                // 后台状态（例如长文档分段摘要进度）显示在对应步骤的思考区域
+                console.log('收到状态消息:', data.message);
+                this.updateStep(data.step || this.activeStep + 1, `${data.message}\n`, 'thinking');
+                break;
+                
             case 'step_start':
                 console.log(`开始步骤 ${data.step}`);
                 this.activeStep = data.step - 1;
@@ -820,6 +820,7 @@ class UploadManager {
     async handleProgressStreamResponse(response) {
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
+        let lineBuffer = ''; // 保存跨数据块的不完整行
 
         try {
             while (true) {
@@ -827,7 +828,9 @@ class UploadManager {
                 if (done) break;
 
                 const chunk = decoder.decode(value, { stream: true });
-                const lines = chunk.split('\n');
+                lineBuffer += chunk;
+                const lines = lineBuffer.split('\n');
+                lineBuffer = lines.pop();
 
                 for (const line of lines) {
                     if (line.startsWith('data: ')) {
@@ -968,7 +971,20 @@ class UploadManager {
         const progressContent = document.getElementById('progressContent');
 
         switch (data.type) {
+            case 'ocr_progress':
+                this.updateOcrProgress(data);
+                break;
+            
+            case 'pdf_progress':
+                this.updatePdfProgress(data);
+                break;
+            
+            case 'status':
+                this.updateStatusTitle(data.message);
+                break;
+            
             case 'step_start':
+                this.restoreProgressTitle();
                 this.createProgressStep(data);
                 break;
             
@@ -990,6 +1006,63 @@ class UploadManager {
         }
     }
 
+    /**
+     * 显示图片识别进度（识别完成后恢复原标题）
+     * @param {Object} data - 进度数据
+     */
+    updateOcrProgress(data) {
+        const progressTitle = document.getElementById('progressTitle');
+        if (!progressTitle) return;
+
+        if (!this.progressTitleText) {
+            this.progressTitleText = progressTitle.textContent;
+        }
+
+        if (data.done >= data.total) {
+            progressTitle.textContent = this.progressTitleText;
+            this.progressTitleText = null;
+        } else {
+            progressTitle.textContent = `正在识别图片 ${data.done}/${data.total}...`;
+        }
+    }
+
+    /**
+     * 在进度标题中显示PDF逐页提取进度
+     * @param {Object} data - 包含page和total的进度数据
+     */
+    updatePdfProgress(data) {
+        if (data.page >= data.total) {
+            this.restoreProgressTitle();
+        } else {
+            this.updateStatusTitle(`正在提取PDF文字 ${data.page}/${data.total}页...`);
+        }
+    }
+
+    /**
+     * 在进度标题中显示后台状态（例如长文档分段摘要进度）
+     * @param {string} message - 状态消息
+     */
+    updateStatusTitle(message) {
+        const progressTitle = document.getElementById('progressTitle');
+        if (!progressTitle || !message) return;
+
+        if (!this.progressTitleText) {
+            this.progressTitleText = progressTitle.textContent;
+        }
+        progressTitle.textContent = message;
+    }
+
+    /**
+     * 恢复原来的进度标题
+     */
+    restoreProgressTitle() {
+        const progressTitle = document.getElementById('progressTitle');
+        if (progressTitle && this.progressTitleText) {
+            progressTitle.textContent = this.progressTitleText;
+            this.progressTitleText = null;
+        }
+    }
+
     /**
      * 创建进度步骤
      * @param {Object} data - 步骤数据
@@ -422,6 +422,7 @@ function createStreamRequest(url, options = {}) {
         
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
+        let lineBuffer = ''; // 保存跨数据块的不完整行
         
         function readStream() {
             return reader.read().then(({ done, value }) => {
@@ -432,8 +433,10 @@ function createStreamRequest(url, options = {}) {
                     return;
                 }
                 
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
+                const chunk = decoder.decode(value, { stream: true });
+                lineBuffer += chunk;
+                const lines = lineBuffer.split('\n');
+                lineBuffer = lines.pop();
                 
                 for (const line of lines) {
                     if (line.startsWith('data: ')) {